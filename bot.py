@@ -1,17 +1,20 @@
 
 # Необходимые библиотеки для работы с API telegram
 from telegram import Update
-from telegram.ext import Application, MessageHandler, filters, ContextTypes
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from telegram import ReplyKeyboardMarkup
 from telegram.constants import ChatAction
 
 # Базовые библиотеки
 import os
+import asyncio
+import uuid
+from datetime import datetime
 from dotenv import load_dotenv
 
 from bot.packages.app_context import AppContext
-
-from common.paths import TXT_DIR
+from bot.packages.ingestion_jobs import IngestionJob, JOB_KIND_FILE, JOB_KIND_URL
+from bot.packages.table_registry import DEFAULT_TABLE_NAME, chat_table_name
 
 UPLOAD_FOLDER = "temp_files"
 MODE_QUESTION = 0
@@ -20,6 +23,8 @@ MODE_UPLOAD = 2
 MODE_LINK_PARSE = 3
 MODE_TRAVILY_SEARCH = 4
 ALLOWED_EXTENSIONS = {".pdf", ".docx", ".txt"}
+# Сколько источников показывает /sources (ограничение длины сообщения Telegram)
+MAX_LISTED_SOURCES = 50
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
@@ -57,6 +62,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
         
     current_mode = context.user_data.get("mode", MODE_QUESTION)
+    app_context.maintenance_scheduler.record_activity()
 
     if current_mode == MODE_QUESTION:   
 
@@ -82,7 +88,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         thinking_msg = await update.message.reply_text("🤔 Думаю...", reply_markup=get_main_keyboard())
 
         # Реализация ответа через app_context
-        response = app_context.bot_handler.handle_question(text)
+        response = app_context.bot_handler.handle_question(text, chat_id=update.effective_chat.id)
 
         await context.bot.delete_message(
             chat_id=update.effective_chat.id,
@@ -95,40 +101,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         url = text
         
-        if is_url_reachable(url):
-
-            html_processor = app_context.html_processor
-            text_processor = app_context.text_processor
-            lance_db = app_context.lance_db
-            html_cleaner = app_context.html_cleaner
-            file_utilities = app_context.file_utilities
-
-            url_raw_text, status = await html_processor.download(url)
-            if url_raw_text is None and isinstance(status, str):
-                '''
-                status : None | str =
-                 "Указана неверная или пустая ссылка",
-                 "Ссылка не информативна",
-                 "Произошла ошибка при скачивании html".
-                '''
-                await update.message.reply_text(status, parse_mode="Markdown", reply_markup=get_main_keyboard()) # status
-            else:
-                url_clean_text = html_cleaner.clean(url_raw_text)
-                filepath = file_utilities.create_txt(url_clean_text, url)
-                if filepath is None:
-                    await update.message.reply_text("Произошла ошибка при сохранении txt файла", parse_mode="Markdown", reply_markup=get_main_keyboard())
-                else:
-                    chunks = text_processor.chunk_text(filepath=filepath, chunk_size=3000, chunk_overlap=200)
-                    if chunks is None:
-                        await update.message.reply_text("Ошибка при разбиении текста на чанки", parse_mode="Markdown", reply_markup=get_main_keyboard())
-                    else:
-                        lance_db.connect_db(db_path = "data/lancedb")
-                        lance_db.check_and_create_table("from_txt")
-                        lance_db.select_table("from_txt")
-                        table = lance_db.get_table()
-                        filename = file_utilities.decode_filename_base64(str(filepath).replace(f"{TXT_DIR}","").replace(".txt", "").replace("\\",""))
-                        lance_db.fill_table(filename=filename, chunks=chunks, current_table=table)
-                        await update.message.reply_text("Данные из ссылки были получены, обработаны и сохранены", parse_mode="Markdown", reply_markup=get_main_keyboard())   
+        if await asyncio.to_thread(is_url_reachable, url):
+            await enqueue_ingestion(update, context, kind=JOB_KIND_URL, source=url, name=url)
         else:
             await update.message.reply_text("Ссылка не валидна", parse_mode="Markdown", reply_markup=get_main_keyboard())
 
@@ -163,37 +137,95 @@ async def handle_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Поддерживаются только PDF/DOCX/TXT.", reply_markup=get_main_keyboard())
         return
 
-    file_path = os.path.join(UPLOAD_FOLDER, update.message.document.file_name)
+    file_name = update.message.document.file_name
+    # Префикс исключает конфликт одинаковых имён файлов от разных пользователей
+    file_path = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex[:8]}_{file_name}")
     file_path = await file.download_to_drive(file_path)
 
-    document_processor = app_context.document_processor
-    file_utilities = app_context.file_utilities
-    text_processor = app_context.text_processor
-    lance_db = app_context.lance_db
+    await enqueue_ingestion(update, context, kind=JOB_KIND_FILE, source=str(file_path), name=file_name)
 
-    text = document_processor.extract_text_from_file(file_path)
-    
-    filename = update.message.document.file_name.split('.')[0]
-    filename = file_utilities.encode_filename_base64(filename)
+async def enqueue_ingestion(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str, source: str, name: str):
+    app_context = context.bot_data["app_context"]
+    ingestion_queue = app_context.ingestion_queue
 
-    filepath = file_utilities.create_txt(text, filename)
+    job_id = ingestion_queue.new_job_id()
+    status_msg = await update.message.reply_text(
+        f"📥 Задача {job_id} поставлена в очередь. Отменить: /cancel {job_id}",
+        reply_markup=get_main_keyboard()
+    )
+    ingestion_queue.enqueue(
+        kind=kind,
+        source=source,
+        name=name,
+        chat_id=update.effective_chat.id,
+        message_id=status_msg.message_id,
+        job_id=job_id
+    )
 
-    if filepath is None:
-        await update.message.reply_text("Произошла ошибка при сохранении txt файла", parse_mode="Markdown", reply_markup=get_main_keyboard())
-    else:
-        chunks = text_processor.chunk_text(filepath=filepath, chunk_size=3000, chunk_overlap=200)
-        if chunks is None:
-            await update.message.reply_text("Ошибка при разбиении текста на чанки", parse_mode="Markdown", reply_markup=get_main_keyboard())
-        else:
-            lance_db.connect_db(db_path = "data/lancedb")
-            lance_db.check_and_create_table("from_txt")
-            lance_db.select_table("from_txt")
-            table = lance_db.get_table()
-            filename = file_utilities.decode_filename_base64(str(filepath).replace(f"{TXT_DIR}","").replace(".txt", "").replace("\\",""))
-            lance_db.fill_table(filename=filename, chunks=chunks, current_table=table)
-            await update.message.reply_text("Данные из файла были получены, обработаны и сохранены", parse_mode="Markdown", reply_markup=get_main_keyboard())   
+async def list_jobs(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    app_context = context.bot_data["app_context"]
+    jobs = app_context.ingestion_queue.store.list_for_chat(update.effective_chat.id)
+    if not jobs:
+        await update.message.reply_text("Задач загрузки нет", reply_markup=get_main_keyboard())
+        return
+    # progress_total = 0: количество страниц неизвестно, progress_done - обработано чанков
+    lines = [
+        f"{job['id']} — {job['state']} ({job['progress_done']}/{job['progress_total'] or '?'}) {job['name']}"
+        for job in jobs
+    ]
+    await update.message.reply_text("\n".join(lines), reply_markup=get_main_keyboard())
+
+async def cancel_job(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    app_context = context.bot_data["app_context"]
+    if not context.args:
+        await update.message.reply_text("Укажите номер задачи: /cancel <id>", reply_markup=get_main_keyboard())
+        return
+    job_id = context.args[0]
+    job = app_context.ingestion_queue.store.get(job_id)
+    if job is None or job["chat_id"] != update.effective_chat.id or not app_context.ingestion_queue.cancel(job_id):
+        await update.message.reply_text(f"Задача {job_id} не найдена или уже завершена", reply_markup=get_main_keyboard())
+        return
+    await update.message.reply_text(f"Задача {job_id} отменяется", reply_markup=get_main_keyboard())
 
-    os.remove(file_path)
+def chat_collection(app_context: AppContext, chat_id: int) -> str:
+    return chat_table_name(chat_id) if app_context.chat_collections else DEFAULT_TABLE_NAME
+
+async def list_sources(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    app_context = context.bot_data["app_context"]
+    table_name = chat_collection(app_context, update.effective_chat.id)
+    documents = []
+    if await asyncio.to_thread(app_context.table_registry.has_table, table_name):
+        table = await asyncio.to_thread(app_context.table_registry.get_table, table_name)
+        documents = await asyncio.to_thread(app_context.lance_db.list_documents, table)
+    if not documents:
+        await update.message.reply_text("В базе знаний чата нет документов", reply_markup=get_main_keyboard())
+        return
+    lines = []
+    for document in documents[:MAX_LISTED_SOURCES]:
+        line = f"{document['doc_name']} — чанков: {document['chunks']}"
+        if document["expires_at"] is not None:
+            line += f", хранится до {datetime.fromtimestamp(document['expires_at']):%d.%m.%Y}"
+        lines.append(line)
+    if len(documents) > MAX_LISTED_SOURCES:
+        lines.append(f"... и ещё {len(documents) - MAX_LISTED_SOURCES}")
+    lines.append("Удалить: /remove <название>")
+    await update.message.reply_text("\n".join(lines), reply_markup=get_main_keyboard())
+
+async def remove_source(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    app_context = context.bot_data["app_context"]
+    doc_name = " ".join(context.args).strip()
+    if not doc_name:
+        await update.message.reply_text("Укажите название источника: /remove <название> (список: /sources)", reply_markup=get_main_keyboard())
+        return
+    table_name = chat_collection(app_context, update.effective_chat.id)
+    deleted = 0
+    if await asyncio.to_thread(app_context.table_registry.has_table, table_name):
+        table = await asyncio.to_thread(app_context.table_registry.get_table, table_name)
+        deleted = await asyncio.to_thread(app_context.lance_db.delete_documents, table, [doc_name])
+    if not deleted:
+        await update.message.reply_text(f"Источник {doc_name} не найден", reply_markup=get_main_keyboard())
+        return
+    await update.message.reply_text(f"Источник {doc_name} удалён (чанков: {deleted})", reply_markup=get_main_keyboard())
 
 async def set_upload_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data["mode"] = MODE_UPLOAD
@@ -239,13 +271,35 @@ def is_url_reachable(url: str, timeout: float = 3.0) -> bool:
     except requests.RequestException:
         return False
 
+async def start_background_services(app: Application):
+    app_context = app.bot_data["app_context"]
+
+    async def notify_job_status(job: IngestionJob, text: str):
+        if job["chat_id"] is None:
+            return
+        if job["message_id"] is None:
+            await app.bot.send_message(chat_id=job["chat_id"], text=text)
+        else:
+            await app.bot.edit_message_text(chat_id=job["chat_id"], message_id=job["message_id"], text=text)
+
+    app_context.ingestion_queue.set_notifier(notify_job_status)
+    await app_context.ingestion_queue.start()
+    await app_context.maintenance_scheduler.start()
+
+async def stop_background_services(app: Application):
+    app_context = app.bot_data["app_context"]
+    await app_context.maintenance_scheduler.stop()
+    await app_context.ingestion_queue.stop()
+    app_context.document_processor.close()
+    app_context.lance_db.close()
+
 def main():
 
     path = os.path.join(os.path.dirname(__file__), "..\\.env")
     load_dotenv(path)
     TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
+    app = Application.builder().token(TELEGRAM_TOKEN).post_init(start_background_services).post_shutdown(stop_background_services).build()
 
     from common.paths import LOG_DIR, VECTOR_DB, DATA_DIR, BANK_DATA_OUTPUT, TXT_DIR
     from pathlib import Path
@@ -266,6 +320,10 @@ def main():
     app_context = AppContext()
     app.bot_data["app_context"] = app_context
     
+    app.add_handler(CommandHandler("jobs", list_jobs))
+    app.add_handler(CommandHandler("cancel", cancel_job))
+    app.add_handler(CommandHandler("sources", list_sources))
+    app.add_handler(CommandHandler("remove", remove_source))
     app.add_handler(MessageHandler(filters.Document.ALL, handle_file))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     
@@ -0,0 +1,105 @@
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+from bot.packages.i_classes.i_logger import ILogger
+
+# Минимальное косинусное сходство запросов, при котором ответ берётся из кэша
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+DEFAULT_MAX_ANSWERS = 256
+
+# Версия таблицы или кортеж версий всех коллекций, по которым идёт поиск
+TableVersion = Union[int, Tuple[int, ...]]
+
+class SemanticAnswerCache():
+    """
+    Кэш ответов базы знаний по смыслу вопроса.
+
+    Вопрос считается повтором, если косинусное сходство его эмбеддинга с
+    сохранённым не ниже порога. Каждый ответ привязан к версии таблицы LanceDB:
+    после любой загрузки версия меняется и старые ответы перестают выдаваться.
+    """
+
+    def __init__(self, logger : ILogger, threshold : float = DEFAULT_SIMILARITY_THRESHOLD, max_entries : int = DEFAULT_MAX_ANSWERS):
+        self.logger = logger
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.version : Optional[TableVersion] = None
+        # Ключ - порядковый номер записи, значение - (нормированный вектор вопроса, ответ)
+        self.entries : OrderedDict[int, tuple[np.ndarray, str]] = OrderedDict()
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def normalize(self, vector : List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def empty_copy(self) -> "SemanticAnswerCache":
+        """
+        Пустой кэш с теми же настройками (для отдельной коллекции).
+        """
+        return SemanticAnswerCache(self.logger, self.threshold, self.max_entries)
+
+    def sync_version(self, version : TableVersion):
+        # Вызывается под self.lock
+        if self.version != version:
+            if self.entries:
+                self.logger.info(f"Кэш ответов: версия таблицы {self.version} -> {version}, сброшено {len(self.entries)} ответов")
+            self.entries.clear()
+            self.version = version
+
+    def get(self, query_vector : List[float], version : TableVersion) -> Optional[str]:
+        """
+        Ищет ответ на похожий вопрос для текущей версии таблицы.
+
+        Args:
+            query_vector: эмбеддинг вопроса
+            version: текущая версия таблицы
+
+        Returns:
+            Сохранённый ответ или None
+        """
+        query = self.normalize(query_vector)
+        with self.lock:
+            self.sync_version(version)
+            if self.entries:
+                ids = list(self.entries)
+                similarities = np.stack([self.entries[i][0] for i in ids]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self.entries.move_to_end(ids[best])
+                    self.hits += 1
+                    self.logger.info(f"Кэш ответов: попадание, сходство {similarities[best]:.3f}")
+                    return self.entries[ids[best]][1]
+            self.misses += 1
+            return None
+
+    def put(self, query_vector : List[float], answer : str, version : TableVersion):
+        """
+        Сохраняет ответ. Ответ, полученный на устаревшей версии таблицы, не сохраняется.
+        """
+        query = self.normalize(query_vector)
+        with self.lock:
+            if self.version is not None and version < self.version:
+                return
+            self.sync_version(version)
+            self.entries[self.next_id] = (query, answer)
+            self.next_id += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries = len(self.entries)
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries
+        }
@@ -1,31 +1,125 @@
 from bot.packages.my_logger import StandardLogger
-from bot.packages.rag_bot import RAGAgent, RAGBotHandler
+from bot.packages.rag_bot import RAGAgent, RAGBotHandler, MAX_CHAT_ROUTES
 from bot.packages.html_processing import HTMLDownloader, HTMLCleaner
-from bot.packages.embedding_generator import OpenAIEmbeddingGenerator
+from bot.packages.async_embedding_generator import AsyncOpenAIEmbeddingGenerator
+from bot.packages.embedding_cache import EmbeddingCache, CachedEmbeddingGenerator, QueryEmbeddingCache, CachedQueryEmbeddings
 from bot.packages.my_logger import StandardLogger
-from bot.packages.lance_vector_db import LanceVectorDB
-from bot.packages.text_pocessor import TextProcessor
+from bot.packages.lance_vector_db import LanceVectorDB, INDEX_MIN_ROWS, MMR_LAMBDA
+from bot.packages.memory_search import MEMORY_SEARCH_MAX_ROWS, MEMORY_SEARCH_MAX_BYTES
+from bot.packages.text_pocessor import TextProcessor, DEFAULT_CHUNK_OVERLAP_TOKENS
 from bot.packages.travily_agent import TravilyAgent
 from bot.packages.qa_simple_bot import QAgent
 from bot.packages.doc_processor import DocumentProcessor
+from bot.packages.table_registry import LanceTableRegistry
+from bot.packages.table_maintenance import TableMaintenanceScheduler, DEFAULT_MAINTENANCE_INTERVAL, DEFAULT_IDLE_SECONDS, DEFAULT_VERSION_RETENTION
+from bot.packages.answer_cache import SemanticAnswerCache, DEFAULT_SIMILARITY_THRESHOLD, DEFAULT_MAX_ANSWERS
+from bot.packages.ingestion_pipeline import IngestionPipeline
+from bot.packages.ingestion_jobs import IngestionJobStore, IngestionProcessor, IngestionJobQueue, DEFAULT_INGEST_WORKERS
 
 from common.file_utils import FileUtilities
+from common.paths import EMBEDDING_CACHE, INGESTION_JOBS
+
+import os
+from datetime import timedelta
 
 class AppContext:
     def __init__(self):
         self.logger = StandardLogger(name="RAGBot")
-        self.embedding_generator = OpenAIEmbeddingGenerator(self.logger)
-        self.lance_db = LanceVectorDB(self.logger, self.embedding_generator)
+        self.embedding_cache = EmbeddingCache(self.logger, EMBEDDING_CACHE)
+        self.embedding_generator = CachedEmbeddingGenerator(
+            logger=self.logger,
+            generator=AsyncOpenAIEmbeddingGenerator(self.logger),
+            cache=self.embedding_cache
+        )
+        self.query_cache = QueryEmbeddingCache(self.logger)
+        prefix_dimensions = os.getenv("VECTOR_PREFIX_DIMS")
+        self.lance_db = LanceVectorDB(
+            self.logger,
+            self.embedding_generator,
+            vector_dtype=os.getenv("VECTOR_DTYPE", "float32"),
+            prefix_dimensions=int(prefix_dimensions) if prefix_dimensions else None,
+            index_type=os.getenv("VECTOR_INDEX_TYPE", "IVF_PQ"),
+            index_min_rows=int(os.getenv("VECTOR_INDEX_MIN_ROWS", INDEX_MIN_ROWS)),
+            nprobes=int(os.getenv("VECTOR_NPROBES")) if os.getenv("VECTOR_NPROBES") else None,
+            refine_factor=int(os.getenv("VECTOR_REFINE_FACTOR")) if os.getenv("VECTOR_REFINE_FACTOR") else None,
+            search_mode=os.getenv("SEARCH_MODE", "hybrid"),
+            query_cache=self.query_cache,
+            mmr_lambda=float(os.getenv("MMR_LAMBDA", MMR_LAMBDA)),
+            memory_search_rows=int(os.getenv("MEMORY_SEARCH_ROWS", MEMORY_SEARCH_MAX_ROWS)),
+            memory_search_bytes=int(os.getenv("MEMORY_SEARCH_MB", MEMORY_SEARCH_MAX_BYTES // 2**20)) * 2**20
+        )
+        # Одно соединение и одни объекты таблиц для загрузки и поиска
+        max_chat_routes = int(os.getenv("CHAT_ROUTES_MAX", MAX_CHAT_ROUTES))
+        # Таблицы маршрутов чатов и общая коллекция
+        self.table_registry = LanceTableRegistry(self.logger, self.lance_db, db_path="./data/lancedb", max_tables=max_chat_routes + 1)
         self.qa_agent = QAgent(logger=self.logger)
-        self.rag_agent = RAGAgent(logger=self.logger)
+        self.rag_agent = RAGAgent(
+            logger=self.logger,
+            schema=self.lance_db.get_schema(),
+            lance_db=self.lance_db,
+            search_mode=self.lance_db.search_mode,
+            embeddings=CachedQueryEmbeddings(self.embedding_generator, self.query_cache),
+            table_registry=self.table_registry,
+            diversify=os.getenv("SEARCH_DIVERSIFY", "0") == "1",
+            fast_path=os.getenv("SEARCH_FAST_PATH", "1") == "1"
+        )
+        self.answer_cache = SemanticAnswerCache(
+            self.logger,
+            threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", DEFAULT_SIMILARITY_THRESHOLD)),
+            max_entries=int(os.getenv("ANSWER_CACHE_SIZE", DEFAULT_MAX_ANSWERS))
+        )
+        # Документы чата загружаются в его коллекцию, поиск идёт по ней и по общей коллекции
+        self.chat_collections = os.getenv("CHAT_COLLECTIONS", "1") != "0"
         self.bot_handler = RAGBotHandler(
             agent=self.rag_agent,
             logger=self.logger,
-            db_path="./data/lancedb"
+            db_path="./data/lancedb",
+            answer_cache=self.answer_cache,
+            per_chat=self.chat_collections,
+            max_chat_routes=max_chat_routes
         )
         self.travily_agent = TravilyAgent(self.logger)
         self.html_processor = HTMLDownloader(self.logger)
         self.html_cleaner = HTMLCleaner(self.logger)
         self.text_processor = TextProcessor(self.logger)
         self.document_processor = DocumentProcessor(self.logger)
-        self.file_utilities = FileUtilities(self.logger)
\ No newline at end of file
+        self.file_utilities = FileUtilities(self.logger)
+        # CHUNK_TOKENS включает разбиение по токенам модели эмбеддингов вместо символов
+        chunk_tokens = os.getenv("CHUNK_TOKENS")
+        chunking_options = {}
+        if chunk_tokens:
+            chunking_options = {"chunk_size": int(chunk_tokens), "chunk_overlap": DEFAULT_CHUNK_OVERLAP_TOKENS, "by_tokens": True}
+        self.ingestion_pipeline = IngestionPipeline(
+            logger=self.logger,
+            text_processor=self.text_processor,
+            lance_db=self.lance_db,
+            file_utilities=self.file_utilities,
+            archive_txt=os.getenv("ARCHIVE_TXT", "1") != "0",
+            **chunking_options
+        )
+        self.ingestion_queue = IngestionJobQueue(
+            logger=self.logger,
+            store=IngestionJobStore(INGESTION_JOBS),
+            processor=IngestionProcessor(
+                logger=self.logger,
+                html_processor=self.html_processor,
+                html_cleaner=self.html_cleaner,
+                document_processor=self.document_processor,
+                pipeline=self.ingestion_pipeline,
+                table_registry=self.table_registry,
+                per_chat=self.chat_collections,
+                url_ttl=float(os.getenv("URL_TTL_DAYS")) * 86400 if os.getenv("URL_TTL_DAYS") else None
+            ),
+            workers=int(os.getenv("INGEST_WORKERS", DEFAULT_INGEST_WORKERS))
+        )
+        # Объединение фрагментов, удаление старых версий и обновление индексов во время простоя
+        retention_hours = os.getenv("VERSION_RETENTION_HOURS")
+        self.maintenance_scheduler = TableMaintenanceScheduler(
+            logger=self.logger,
+            table_registry=self.table_registry,
+            lance_db=self.lance_db,
+            interval=float(os.getenv("MAINTENANCE_INTERVAL", DEFAULT_MAINTENANCE_INTERVAL)),
+            idle_seconds=float(os.getenv("MAINTENANCE_IDLE_SECONDS", DEFAULT_IDLE_SECONDS)),
+            retention=timedelta(hours=float(retention_hours)) if retention_hours else DEFAULT_VERSION_RETENTION,
+            busy=lambda: bool(self.ingestion_queue.running)
+        )
@@ -0,0 +1,188 @@
+import asyncio
+import time
+from typing import List, Optional
+
+import openai
+from openai import AsyncOpenAI
+
+from bot.packages.embedding_generator import OpenAIEmbeddingGenerator
+from bot.packages.i_classes.i_logger import ILogger
+
+# Лимиты по умолчанию для text-embedding-3-large (Tier 1)
+DEFAULT_REQUESTS_PER_MINUTE = 3000
+DEFAULT_TOKENS_PER_MINUTE = 1_000_000
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_MAX_RETRIES = 6
+MAX_BACKOFF_SECONDS = 60.0
+
+class TokenBucket():
+    """
+    Ведро токенов для ограничения скорости: ёмкость восполняется равномерно
+    со скоростью rate_per_minute единиц в минуту.
+    """
+
+    def __init__(self, rate_per_minute : float, capacity : Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount : float) -> float:
+        """
+        Возвращает время ожидания (в секундах), через которое будет доступно amount единиц.
+        """
+        self.refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    async def acquire(self, amount : float):
+        amount = min(amount, self.capacity)
+        while True:
+            delay = self.wait_time(amount)
+            if delay <= 0:
+                self.tokens -= amount
+                return
+            await asyncio.sleep(delay)
+
+class AsyncOpenAIEmbeddingGenerator(OpenAIEmbeddingGenerator):
+    """
+    Асинхронный генератор эмбеддингов.
+
+    Держит не более max_concurrency запросов одновременно, соблюдает лимиты
+    запросов и токенов в минуту и адаптивно увеличивает паузу при ответах 429.
+    Синхронные методы базового класса остаются доступны для кода вне event loop.
+    """
+
+    def __init__(
+        self,
+        logger : ILogger,
+        requests_per_minute : int = DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute : int = DEFAULT_TOKENS_PER_MINUTE,
+        max_concurrency : int = DEFAULT_MAX_CONCURRENCY,
+        max_retries : int = DEFAULT_MAX_RETRIES
+    ):
+        super().__init__(logger)
+        self.async_client = AsyncOpenAI(api_key=self.client.api_key)
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = 0.0
+        self.paused_until = 0.0
+        self._semaphore : Optional[asyncio.Semaphore] = None
+        self._loop : Optional[asyncio.AbstractEventLoop] = None
+
+    def get_semaphore(self) -> asyncio.Semaphore:
+        # Семафор привязан к event loop, поэтому пересоздаём его при смене цикла
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    def register_rate_limit(self, retry_after : Optional[float]):
+        """
+        Увеличивает общую паузу после ответа 429 для всех запросов в полёте.
+        """
+        self.backoff = min(MAX_BACKOFF_SECONDS, max(1.0, self.backoff * 2))
+        delay = max(self.backoff, retry_after or 0.0)
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        self.logger.warning(f"Достигнут лимит запросов OpenAI, пауза {delay:.1f} с")
+
+    def register_success(self):
+        self.backoff = self.backoff / 2 if self.backoff > 1.0 else 0.0
+
+    def get_retry_after(self, error : openai.RateLimitError) -> Optional[float]:
+        try:
+            return float(error.response.headers.get("retry-after"))
+        except Exception:
+            return None
+
+    async def wait_for_pause(self):
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def aembed_batch(self, texts : List[str], tokens : Optional[int] = None) -> List[List[float]]:
+        """
+        Асинхронно создает эмбеддинги для одного пакета с учётом лимитов и повторов.
+
+        Args:
+            texts: тексты пакета
+            tokens: суммарное количество токенов пакета (None - считается токенизатором)
+
+        Returns:
+            Векторы в порядке исходных текстов
+        """
+        if tokens is None:
+            tokens = sum(min(self.count_tokens(text), self.max_tokens) for text in texts)
+        for attempt in range(1, self.max_retries + 1):
+            await self.wait_for_pause()
+            await self.request_bucket.acquire(1)
+            await self.token_bucket.acquire(tokens)
+            try:
+                async with self.get_semaphore():
+                    response = await self.async_client.embeddings.create(
+                        model=self.model,
+                        input=texts,
+                        dimensions=self.dimensions
+                    )
+                self.register_success()
+                data = sorted(response.data, key=lambda item: item.index)
+                return [item.embedding for item in data]
+            except openai.RateLimitError as e:
+                if attempt == self.max_retries:
+                    raise
+                self.register_rate_limit(self.get_retry_after(e))
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(MAX_BACKOFF_SECONDS, 2 ** (attempt - 1))
+                self.logger.warning(f"Ошибка API при создании эмбеддингов (попытка {attempt}), повтор через {delay} с. Trace: {e}")
+                await asyncio.sleep(delay)
+
+    async def acreate_embedding(self, text : str) -> list[float]:
+        """
+        Асинхронно создает эмбеддинг для одного текста.
+        """
+        vectors = await self.aembed_batch([self.truncate_text(text)])
+        return vectors[0]
+
+    async def acreate_embeddings_batch(self, texts : List[str], token_counts : Optional[List[Optional[int]]] = None) -> List[Optional[List[float]]]:
+        """
+        Асинхронно создает эмбеддинги для списка текстов. Пакеты отправляются
+        параллельно в пределах max_concurrency.
+
+        Args:
+            texts: список текстов
+            token_counts: количество токенов текстов, например metadata["token_count"] чанков
+
+        Returns:
+            Список векторов в исходном порядке, None для необработанных пакетов.
+        """
+        embeddings : List[Optional[List[float]]] = [None] * len(texts)
+        if not texts:
+            return embeddings
+
+        prepared, counts = self.prepare_texts(texts, token_counts)
+        batches = self.split_into_batches(prepared, counts)
+        self.logger.info(f"Асинхронное создание {len(texts)} эмбеддингов за {len(batches)} запрос(ов)")
+
+        results = await asyncio.gather(
+            *(self.aembed_batch([prepared[i] for i in batch], sum(counts[i] for i in batch)) for batch in batches),
+            return_exceptions=True
+        )
+        for batch_num, (batch, result) in enumerate(zip(batches, results)):
+            if isinstance(result, BaseException):
+                self.logger.critical(f"Ошибка при создании эмбеддингов для пакета {batch_num+1}/{len(batches)} ({len(batch)} текстов), Trace: {result}")
+                continue
+            for index, vector in zip(batch, result):
+                embeddings[index] = vector
+        return embeddings
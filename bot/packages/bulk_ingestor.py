@@ -0,0 +1,228 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, TypedDict
+
+from langchain_core.documents import Document
+
+from bot.packages.doc_processor import DocumentProcessor, ALLOWED_EXTENSIONS, document_name
+from bot.packages.i_classes.i_logger import ILogger
+from bot.packages.my_logger import StandardLogger
+from bot.packages.text_pocessor import TextProcessor
+
+DEFAULT_CHUNK_SIZE = 3000
+DEFAULT_CHUNK_OVERLAP = 200
+# Сколько документов одновременно находятся на этапе эмбеддингов
+DEFAULT_EMBEDDING_CONCURRENCY = 4
+
+class ExtractedDocument(TypedDict):
+    """
+    Результат извлечения и разбиения одного файла в дочернем процессе.
+    """
+    path: str
+    chunks: List[str]
+    token_counts: List[int]
+    pages: int
+    extract_seconds: float
+    chunk_seconds: float
+
+class StageStats(TypedDict):
+    count: int
+    seconds: float
+
+def extract_and_chunk(path : str, chunk_size : int, chunk_overlap : int, by_tokens : bool = False) -> ExtractedDocument:
+    """
+    Извлекает текст файла и разбивает его на чанки. Выполняется в пуле процессов,
+    поэтому параллелизм внутри одного документа отключён.
+    """
+    logger = StandardLogger(name="BulkIngestWorker", log_to_file=False)
+    document_processor = DocumentProcessor(logger, max_workers=1)
+    text_processor = TextProcessor(logger)
+
+    started = time.perf_counter()
+    pages = [text for _, text in document_processor.iter_pages(path)]
+    extracted = time.perf_counter()
+    chunks = list(text_processor.iter_chunks(pages, chunk_size, chunk_overlap, by_tokens))
+    chunked = time.perf_counter()
+    return {
+        "path": path,
+        "chunks": [chunk.page_content for chunk in chunks],
+        "token_counts": [chunk.metadata["token_count"] for chunk in chunks],
+        "pages": len(pages),
+        "extract_seconds": extracted - started,
+        "chunk_seconds": chunked - extracted
+    }
+
+class BulkIngestor():
+    """
+    Массовая загрузка каталога документов PDF/DOCX/TXT в LanceDB.
+
+    Извлечение и разбиение выполняются параллельно в пуле процессов, эмбеддинги
+    создаются асинхронно для нескольких документов одновременно, запись в таблицу
+    выполняется по документу за коммит. Обработанные файлы запоминаются в файле
+    состояния, поэтому прерванная загрузка продолжается с места остановки.
+    """
+
+    def __init__(
+        self,
+        logger : ILogger,
+        lance_db,
+        table_name : str,
+        state_path : str | Path,
+        workers : Optional[int] = None,
+        chunk_size : int = DEFAULT_CHUNK_SIZE,
+        chunk_overlap : int = DEFAULT_CHUNK_OVERLAP,
+        embedding_concurrency : int = DEFAULT_EMBEDDING_CONCURRENCY,
+        by_tokens : bool = False
+    ):
+        self.logger = logger
+        self.lance_db = lance_db
+        self.table_name = table_name
+        self.state_path = Path(state_path)
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.embedding_concurrency = embedding_concurrency
+        # chunk_size и chunk_overlap заданы в токенах, а не в символах
+        self.by_tokens = by_tokens
+        self.state : Dict[str, List[int]] = self.load_state()
+        self.stats : Dict[str, StageStats] = {
+            "extract": {"count": 0, "seconds": 0.0},
+            "chunk": {"count": 0, "seconds": 0.0},
+            "embed": {"count": 0, "seconds": 0.0},
+            "write": {"count": 0, "seconds": 0.0}
+        }
+
+    def load_state(self) -> Dict[str, List[int]]:
+        if not self.state_path.exists():
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            self.logger.warning(f"Не удалось прочитать файл состояния {self.state_path}, загрузка начнётся заново: {e}")
+            return {}
+
+    def save_state(self):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+
+    def reset_state(self):
+        self.state = {}
+        if self.state_path.exists():
+            self.state_path.unlink()
+
+    def file_signature(self, path : Path) -> List[int]:
+        stat = path.stat()
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def find_documents(self, root : str | Path) -> List[Path]:
+        """
+        Возвращает поддерживаемые файлы каталога, которые ещё не были загружены
+        или изменились после загрузки.
+        """
+        root = Path(root)
+        files = sorted(
+            path for path in root.rglob("*")
+            if path.is_file() and path.suffix.lower() in ALLOWED_EXTENSIONS
+        )
+        pending = [path for path in files if self.state.get(self.doc_name(root, path)) != self.file_signature(path)]
+        self.logger.info(f"Найдено файлов: {len(files)}, к загрузке: {len(pending)}")
+        return pending
+
+    def doc_name(self, root : Path, path : Path) -> str:
+        # То же правило, что и для файлов, загруженных через бота
+        return document_name(path, root)
+
+    async def run(self, root : str | Path) -> Dict[str, StageStats]:
+        """
+        Загружает все документы каталога.
+
+        Args:
+            root: корневой каталог с документами
+
+        Returns:
+            Статистика по этапам (количество и суммарное время)
+        """
+        root = Path(root)
+        documents = self.find_documents(root)
+        if not documents:
+            return self.stats
+
+        table = await asyncio.to_thread(self.open_table)
+        write_lock = asyncio.Lock()
+        embed_slots = asyncio.Semaphore(self.embedding_concurrency)
+        # Ограничивает количество извлечённых, но ещё не записанных документов в памяти
+        inflight = asyncio.Semaphore(self.workers * 2)
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            async def ingest(path : Path):
+                async with inflight:
+                    extracted = await loop.run_in_executor(executor, extract_and_chunk, str(path), self.chunk_size, self.chunk_overlap, self.by_tokens)
+                    self.add_stat("extract", 1, extracted["extract_seconds"])
+                    self.add_stat("chunk", len(extracted["chunks"]), extracted["chunk_seconds"])
+                    async with embed_slots:
+                        await self.ingest_document(self.doc_name(root, path), extracted["chunks"], table, write_lock, extracted["token_counts"])
+                    async with write_lock:
+                        self.state[self.doc_name(root, path)] = self.file_signature(path)
+                        await asyncio.to_thread(self.save_state)
+                    self.logger.info(f"Документ {path} загружен ({len(extracted['chunks'])} чанков)")
+
+            results = await asyncio.gather(*(ingest(path) for path in documents), return_exceptions=True)
+
+        for path, result in zip(documents, results):
+            if isinstance(result, BaseException):
+                self.logger.critical(f"Ошибка при загрузке {path}, Trace: {result}")
+
+        # Индекс обновляется один раз после всей загрузки, а не после каждого документа
+        await asyncio.to_thread(self.lance_db.ensure_index, table)
+        self.report(time.perf_counter() - started)
+        return self.stats
+
+    async def ingest_document(self, doc_name : str, chunk_texts : List[str], table, write_lock : asyncio.Lock, token_counts : Optional[List[int]] = None):
+        if token_counts is None:
+            chunks = [Document(page_content=text) for text in chunk_texts]
+        else:
+            chunks = [Document(page_content=text, metadata={"token_count": count}) for text, count in zip(chunk_texts, token_counts)]
+        diff = await asyncio.to_thread(self.lance_db.diff_document, doc_name, chunks, table)
+        new_chunks = [chunks[i] for i in diff["new_indices"]]
+
+        started = time.perf_counter()
+        vectors = await self.lance_db.aembed_chunks(new_chunks)
+        self.add_stat("embed", len(new_chunks), time.perf_counter() - started)
+
+        # Запись сериализуется, чтобы коммиты разных документов не конфликтовали
+        async with write_lock:
+            started = time.perf_counter()
+            report = await asyncio.to_thread(self.lance_db.upsert_document, doc_name, chunks, vectors, diff, table)
+            self.add_stat("write", report["inserted"], time.perf_counter() - started)
+        if report["failed"]:
+            raise RuntimeError(f"не удалось сохранить {len(report['failed'])} чанков")
+
+    def add_stat(self, stage : str, count : int, seconds : float):
+        self.stats[stage]["count"] += count
+        self.stats[stage]["seconds"] += seconds
+
+    def open_table(self):
+        self.lance_db.check_and_create_table(self.table_name)
+        self.lance_db.select_table(self.table_name)
+        return self.lance_db.get_table()
+
+    def report(self, elapsed : float):
+        """
+        Выводит пропускную способность этапов относительно общего времени загрузки.
+        """
+        units = {"extract": "док/с", "chunk": "чанков/с", "embed": "эмбеддингов/с", "write": "строк/с"}
+        self.logger.info(f"Загрузка завершена за {elapsed:.1f} с")
+        for stage, stats in self.stats.items():
+            rate = stats["count"] / elapsed if elapsed > 0 else 0.0
+            self.logger.info(f"   {stage}: {stats['count']} за {stats['seconds']:.1f} с работы, {rate:.2f} {units[stage]}")
@@ -1,37 +1,193 @@
-
 from bot.packages.i_classes.i_logger import ILogger
 
 import fitz
 from docx import Document
+import asyncio
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Iterator, List, Optional
 
 ALLOWED_EXTENSIONS = {".pdf", ".docx", ".txt"}
 
+# PDF меньше этого размера читаются в текущем процессе
+PARALLEL_MIN_PAGES = 64
+# Количество страниц в одной задаче пула процессов
+PAGES_PER_TASK = 32
+# Максимальный размер сегмента DOCX и TXT (в символах): форматы без страниц
+# отдаются частями, чтобы потоковое разбиение не держало весь документ в одной строке
+SEGMENT_MAX_CHARS = 64 * 1024
+
+def document_name(path : str | Path, root : Optional[str | Path] = None) -> str:
+    """
+    Название документа в таблице для загруженного файла: путь относительно
+    каталога загрузки без расширения. Файл, отправленный боту, и тот же файл
+    из корня каталога массовой загрузки получают одно название (имя без
+    расширения), а файлы вложенных каталогов сохраняют путь и не совпадают
+    с одноимёнными файлами из других каталогов.
+
+    Args:
+        path: путь к файлу или исходное имя файла
+        root: каталог массовой загрузки (None - учитывается только имя файла)
+    """
+    path = Path(path)
+    relative = path.relative_to(root) if root is not None else Path(path.name)
+    return relative.with_suffix("").as_posix()
+
+def extract_pdf_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """
+    Извлекает текст страниц [start, end) из PDF. Выполняется в дочернем процессе,
+    поэтому документ открывается заново в каждой задаче.
+    """
+    with fitz.open(file_path) as doc:
+        return [doc.load_page(page_num).get_text() for page_num in range(start, end)]
+
 class DocumentProcessor():
 
-    def __init__(self, logger : ILogger):
+    def __init__(
+        self,
+        logger : ILogger,
+        max_workers : Optional[int] = None,
+        pages_per_task : int = PAGES_PER_TASK,
+        parallel_min_pages : int = PARALLEL_MIN_PAGES,
+        segment_max_chars : int = SEGMENT_MAX_CHARS
+    ):
         self.logger = logger
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pages_per_task = pages_per_task
+        self.parallel_min_pages = parallel_min_pages
+        self.segment_max_chars = segment_max_chars
+        self.executor : Optional[ProcessPoolExecutor] = None
 
-    def read_pdf(self, file_path: str) -> str:
-        doc = fitz.open(file_path)
-        text = ""
-        for page_num in range(len(doc)):
-            page = doc.load_page(page_num)
-            text += page.get_text()
-        return text
+    def get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            # spawn вместо fork: бот многопоточный, fork из потоков небезопасен
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self.executor
 
-    def read_docx(self, file_path: str) -> str:
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def count_pages(self, file_path: str) -> Optional[int]:
+        """
+        Количество страниц документа для отображения прогресса загрузки.
+
+        Returns:
+            Количество страниц PDF или None, если оно неизвестно без чтения всего документа
+        """
+        if os.path.splitext(file_path)[1].lower() != ".pdf":
+            return None
+        with fitz.open(file_path) as doc:
+            return len(doc)
+
+    def iter_pdf_pages(self, file_path: str) -> Iterator[tuple[int, str]]:
+        """
+        Постранично отдаёт текст PDF в порядке следования.
+
+        Большие документы делятся на диапазоны страниц, которые обрабатываются
+        параллельно в пуле процессов.
+
+        Args:
+            file_path: путь к PDF файлу
+
+        Returns:
+            Итератор пар (номер страницы начиная с 1, текст страницы)
+        """
+        with fitz.open(file_path) as doc:
+            page_count = len(doc)
+            if page_count < self.parallel_min_pages or self.max_workers < 2:
+                for page_num in range(page_count):
+                    yield page_num + 1, doc.load_page(page_num).get_text()
+                return
+
+        ranges = [(start, min(start + self.pages_per_task, page_count)) for start in range(0, page_count, self.pages_per_task)]
+        self.logger.info(f"Параллельное извлечение текста из {file_path}: {page_count} страниц, {len(ranges)} задач")
+        executor = self.get_executor()
+        futures = [executor.submit(extract_pdf_page_range, str(file_path), start, end) for start, end in ranges]
+        try:
+            for (start, _), future in zip(ranges, futures):
+                for offset, text in enumerate(future.result()):
+                    yield start + offset + 1, text
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def iter_docx_pages(self, file_path: str) -> Iterator[tuple[int, str]]:
+        """
+        DOCX не хранит разбиение на страницы, поэтому абзацы отдаются группами
+        размером до segment_max_chars символов.
+        """
         doc = Document(file_path)
-        text = ""
+        segment_num = 0
+        parts : List[str] = []
+        size = 0
         for para in doc.paragraphs:
-            text += para.text + "\n"
-        return text
+            text = para.text + "\n"
+            parts.append(text)
+            size += len(text)
+            if size >= self.segment_max_chars:
+                segment_num += 1
+                yield segment_num, "".join(parts)
+                parts, size = [], 0
+        if parts or segment_num == 0:
+            yield segment_num + 1, "".join(parts)
+
+    def iter_txt_pages(self, file_path: str) -> Iterator[tuple[int, str]]:
+        """
+        Читает TXT блоками строк размером до segment_max_chars символов.
+        Слишком длинная строка делится на части того же размера.
+        """
+        with open(file_path, "r", encoding="utf-8") as f:
+            segment_num = 0
+            parts : List[str] = []
+            size = 0
+            for line in iter(lambda: f.readline(self.segment_max_chars), ""):
+                parts.append(line)
+                size += len(line)
+                if size >= self.segment_max_chars:
+                    segment_num += 1
+                    yield segment_num, "".join(parts)
+                    parts, size = [], 0
+            if parts or segment_num == 0:
+                yield segment_num + 1, "".join(parts)
+
+    def iter_pages(self, file_path: str) -> Iterator[tuple[int, str]]:
+        """
+        Отдаёт текст документа по страницам (для DOCX и TXT - по сегментам ограниченного размера).
+
+        Args:
+            file_path: путь к файлу PDF/DOCX/TXT
+
+        Returns:
+            Итератор пар (номер страницы, текст страницы)
+        """
+        ext = os.path.splitext(file_path)[1].lower()
+
+        if ext == ".txt":
+            yield from self.iter_txt_pages(file_path)
+        elif ext == ".pdf":
+            yield from self.iter_pdf_pages(file_path)
+        elif ext == ".docx":
+            yield from self.iter_docx_pages(file_path)
+        else:
+            raise ValueError(f"Данный тип файла не поддерживается: {ext}")
+
+    def read_pdf(self, file_path: str) -> str:
+        return "".join(text for _, text in self.iter_pdf_pages(file_path))
+
+    def read_docx(self, file_path: str) -> str:
+        return "".join(text for _, text in self.iter_docx_pages(file_path))
 
     def read_txt(self, file_path: str) -> str:
         with open(file_path, "r", encoding="utf-8") as f:
             return f.read()
-        
+
     def extract_text_from_file(self, file_path: str) -> str:
         ext = os.path.splitext(file_path)[1].lower()
 
@@ -44,4 +200,10 @@ class DocumentProcessor():
         else:
             raise ValueError(f"Данный тип файла не поддерживается: {ext}")
 
-    
\ No newline at end of file
+    async def aextract_text_from_file(self, file_path: str) -> str:
+        """
+        Извлекает текст в отдельном потоке, не блокируя event loop.
+        """
+        return await asyncio.to_thread(self.extract_text_from_file, str(file_path))
+
+
@@ -0,0 +1,288 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from bot.packages.i_classes.i_embedding_generator import IEmbeddingGenerator
+from bot.packages.i_classes.i_logger import ILogger
+
+DEFAULT_MAX_CACHE_BYTES = 512 * 1024 * 1024  # 512 МБ
+# Кэш эмбеддингов поисковых запросов
+DEFAULT_QUERY_CACHE_ENTRIES = 1024
+DEFAULT_QUERY_CACHE_TTL = 3600.0  # секунд
+
+class EmbeddingCache():
+    """
+    Персистентный кэш эмбеддингов на SQLite.
+
+    Ключ - хеш (модель, размерность, текст), вектор хранится в бинарном виде
+    (float32). При превышении max_bytes вытесняются давно не использованные записи.
+    """
+
+    def __init__(self, logger : ILogger, db_path : str | Path, max_bytes : int = DEFAULT_MAX_CACHE_BYTES):
+        self.logger = logger
+        self.db_path = Path(db_path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_access INTEGER NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self.connection.commit()
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def make_key(self, text : str, model : str, dimensions : int) -> str:
+        # Хешируем модель, размерность и текст, как generate_chunk_id в LanceVectorDB
+        combined_string = f"{model}_{dimensions}_{text}"
+        return hashlib.sha256(combined_string.encode('utf-8')).hexdigest()
+
+    def encode_vector(self, vector : List[float]) -> bytes:
+        return array('f', vector).tobytes()
+
+    def decode_vector(self, blob : bytes) -> List[float]:
+        vector = array('f')
+        vector.frombytes(blob)
+        return vector.tolist()
+
+    def get_many(self, keys : List[str]) -> Dict[str, List[float]]:
+        """
+        Возвращает найденные векторы по ключам и обновляет время последнего доступа.
+        """
+        if not keys:
+            return {}
+        found : Dict[str, List[float]] = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self.lock:
+            # SQLite ограничивает количество параметров в запросе
+            for start in range(0, len(unique_keys), 500):
+                part = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self.connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = self.decode_vector(blob)
+            if found:
+                now = time.time_ns()
+                self.connection.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self.connection.commit()
+            hits = sum(1 for key in keys if key in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, items : Dict[str, List[float]]):
+        """
+        Сохраняет векторы в кэш и при необходимости вытесняет старые записи.
+        """
+        if not items:
+            return
+        now = time.time_ns()
+        rows = []
+        for key, vector in items.items():
+            blob = self.encode_vector(vector)
+            rows.append((key, blob, len(blob), now))
+        keys = list(items)
+        with self.lock:
+            # Размер заменяемых записей вычитается из total_bytes: пересчёт суммы по всей таблице дороже записи
+            replaced = 0
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                replaced += self.connection.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchone()[0]
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_access) VALUES (?, ?, ?, ?)", rows
+            )
+            self.connection.commit()
+            self.total_bytes += sum(row[2] for row in rows) - replaced
+            self.evict()
+
+    def evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        to_free = self.total_bytes - self.max_bytes
+        freed = 0
+        keys = []
+        for key, size in self.connection.execute("SELECT key, size FROM embeddings ORDER BY last_access ASC"):
+            keys.append((key,))
+            freed += size
+            if freed >= to_free:
+                break
+        self.connection.executemany("DELETE FROM embeddings WHERE key = ?", keys)
+        self.connection.commit()
+        self.total_bytes -= freed
+        self.logger.info(f"Кэш эмбеддингов: вытеснено {len(keys)} записей ({freed} байт)")
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+            "bytes": self.total_bytes
+        }
+
+class CachedEmbeddingGenerator(IEmbeddingGenerator):
+    """
+    Обёртка над любым IEmbeddingGenerator, которая берёт векторы из EmbeddingCache
+    и обращается к исходному генератору только за отсутствующими текстами.
+    """
+
+    def __init__(self, logger : ILogger, generator : IEmbeddingGenerator, cache : EmbeddingCache):
+        self.logger = logger
+        self.generator = generator
+        self.cache = cache
+        self.model = getattr(generator, "model", type(generator).__name__)
+        self.dimensions = getattr(generator, "dimensions", 0)
+
+    def make_keys(self, texts : List[str]) -> List[str]:
+        return [self.cache.make_key(text, self.model, self.dimensions) for text in texts]
+
+    def create_embedding(self, text : str) -> list[float]:
+        # Одиночные эмбеддинги - поисковые запросы: они кэшируются в QueryEmbeddingCache
+        # и не должны вытеснять из персистентного кэша эмбеддинги чанков
+        return self.generator.create_embedding(text)
+
+    def split_cached(self, texts : List[str]):
+        """
+        Возвращает ключи, заготовку результата с найденными векторами и
+        индексы текстов, которых нет в кэше.
+        """
+        keys = self.make_keys(texts)
+        cached = self.cache.get_many(keys)
+        embeddings : List[Optional[List[float]]] = [cached.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(embeddings) if vector is None]
+        return keys, embeddings, missing
+
+    def store_missing(self, keys : List[str], embeddings : List[Optional[List[float]]], missing : List[int], vectors : List[Optional[List[float]]]):
+        new_items = {}
+        for index, vector in zip(missing, vectors):
+            embeddings[index] = vector
+            if vector is not None:
+                new_items[keys[index]] = vector
+        self.cache.put_many(new_items)
+        self.logger.info(f"Кэш эмбеддингов: {len(keys) - len(missing)} из {len(keys)} найдено, статистика: {self.cache.stats()}")
+
+    def missing_token_counts(self, token_counts : Optional[List[Optional[int]]], missing : List[int]) -> Optional[List[Optional[int]]]:
+        return [token_counts[i] for i in missing] if token_counts is not None else None
+
+    def create_embeddings_batch(self, texts : List[str], token_counts : Optional[List[Optional[int]]] = None) -> List[Optional[List[float]]]:
+        keys, embeddings, missing = self.split_cached(texts)
+        vectors = []
+        if missing:
+            vectors = self.generator.create_embeddings_batch([texts[i] for i in missing], token_counts=self.missing_token_counts(token_counts, missing))
+        self.store_missing(keys, embeddings, missing, vectors)
+        return embeddings
+
+    async def acreate_embeddings_batch(self, texts : List[str], token_counts : Optional[List[Optional[int]]] = None) -> List[Optional[List[float]]]:
+        keys, embeddings, missing = await asyncio.to_thread(self.split_cached, texts)
+        vectors = []
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            missing_counts = self.missing_token_counts(token_counts, missing)
+            if hasattr(self.generator, "acreate_embeddings_batch"):
+                vectors = await self.generator.acreate_embeddings_batch(missing_texts, token_counts=missing_counts)
+            else:
+                vectors = await asyncio.to_thread(self.generator.create_embeddings_batch, missing_texts, token_counts=missing_counts)
+        await asyncio.to_thread(self.store_missing, keys, embeddings, missing, vectors)
+        return embeddings
+
+class QueryEmbeddingCache():
+    """
+    Кэш эмбеддингов поисковых запросов в памяти процесса (LRU + TTL).
+
+    Ключ - нормализованный текст запроса (регистр и пробелы не учитываются),
+    поэтому повторные и почти повторные запросы агента не идут в API.
+    """
+
+    def __init__(self, logger : ILogger, max_entries : int = DEFAULT_QUERY_CACHE_ENTRIES, ttl_seconds : float = DEFAULT_QUERY_CACHE_TTL):
+        self.logger = logger
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries : OrderedDict[str, tuple[float, List[float]]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def normalize(self, text : str) -> str:
+        return " ".join(text.split()).casefold()
+
+    def get(self, text : str) -> Optional[List[float]]:
+        key = self.normalize(text)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, text : str, vector : List[float]):
+        key = self.normalize(text)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl_seconds, vector)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_or_create(self, text : str, create : Callable[[str], List[float]]) -> List[float]:
+        """
+        Возвращает эмбеддинг запроса из кэша или создаёт его функцией create.
+        """
+        vector = self.get(text)
+        if vector is None:
+            vector = create(text)
+            self.put(text, vector)
+        return vector
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries = len(self.entries)
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries
+        }
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Эмбеддинги LangChain поверх IEmbeddingGenerator: запросы проходят через
+    общий QueryEmbeddingCache, поэтому векторное хранилище LangChain и LanceVectorDB
+    используют одну модель и один кэш запросов.
+    """
+
+    def __init__(self, generator : IEmbeddingGenerator, cache : QueryEmbeddingCache):
+        self.generator = generator
+        self.cache = cache
+
+    def embed_query(self, text : str) -> List[float]:
+        return self.cache.get_or_create(text, self.generator.create_embedding)
+
+    def embed_documents(self, texts : List[str]) -> List[List[float]]:
+        return self.generator.create_embeddings_batch(texts)
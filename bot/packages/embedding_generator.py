@@ -3,13 +3,43 @@ from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_excep
 from openai import OpenAI
 import openai
 import os
-from typing import List
+from typing import List, Optional
 
 from bot.packages.i_classes.i_embedding_generator import IEmbeddingGenerator
 from bot.packages.i_classes.i_embedding_generator import ILogger
 
+# Лимиты OpenAI Embeddings API на один запрос
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_REQUEST = 300_000
+EMBEDDING_MODEL = "text-embedding-3-large"
+
+class OpenAITokenizerWrapper():
+    """
+    Токенизатор модели эмбеддингов OpenAI. Если словарь tiktoken недоступен
+    (например, нет сети для скачивания), количество токенов оценивается по символам.
+    """
+
+    def __init__(self, logger : ILogger, model : str = EMBEDDING_MODEL):
+        self.logger = logger
+        self.model = model
+        self.encoding = self.load_encoding()
+
+    def load_encoding(self):
+        try:
+            import tiktoken
+            return tiktoken.encoding_for_model(self.model)
+        except Exception as e:
+            self.logger.warning(f"Токенизатор для {self.model} недоступен, используется оценка по символам. Trace: {e}")
+            return None
+
+    def count_tokens(self, text : str) -> int:
+        if self.encoding is None:
+            # Завышенная оценка: один токен на символ
+            return len(text)
+        return len(self.encoding.encode(text))
+
 class OpenAIEmbeddingGenerator(IEmbeddingGenerator):
-    
+
     def __init__(self, logger : ILogger):
 
         self.logger = logger
@@ -22,7 +52,40 @@ class OpenAIEmbeddingGenerator(IEmbeddingGenerator):
             raise ValueError("OPENAI_API_KEY не найден в .env")
 
         self.client = OpenAI(api_key=api_key)
-        self.max_tokens = 8191  # пока не используется, но может пригодиться
+        self.model = EMBEDDING_MODEL
+        self.dimensions = 1536
+        self.max_tokens = 8191  # лимит токенов на один текст
+        self.max_inputs_per_request = MAX_INPUTS_PER_REQUEST
+        self.max_tokens_per_request = MAX_TOKENS_PER_REQUEST
+        self.encoding = self.load_encoding()
+
+    def load_encoding(self):
+        """
+        Загружает токенизатор модели эмбеддингов.
+
+        Returns:
+            Токенизатор tiktoken или None, если он недоступен (например, нет сети
+            для скачивания словаря). В этом случае используется грубая оценка.
+        """
+        return OpenAITokenizerWrapper(self.logger, self.model).encoding
+
+    def count_tokens(self, text : str) -> int:
+        if self.encoding is None:
+            # Завышенная оценка: один токен на символ
+            return len(text)
+        return len(self.encoding.encode(text))
+
+    def truncate_text(self, text : str) -> str:
+        """
+        Обрезает текст до лимита токенов модели на один вход.
+        """
+        if self.encoding is None:
+            return text[:self.max_tokens] if len(text) > self.max_tokens else text
+        tokens = self.encoding.encode(text)
+        if len(tokens) <= self.max_tokens:
+            return text
+        self.logger.warning(f"Текст длиной {len(tokens)} токенов обрезан до {self.max_tokens}")
+        return self.encoding.decode(tokens[:self.max_tokens])
 
     @retry(
     stop=stop_after_attempt(5),
@@ -32,40 +95,146 @@ class OpenAIEmbeddingGenerator(IEmbeddingGenerator):
     def create_embedding(self, text : str) -> list[float]:
         """
         Создает эмбеддинг для текста с использованием OpenAI API.
-        
+
         Функция использует декоратор retry для автоматического повтора
         при ошибках API (rate limits, timeout и т.д.)
-        
+
         Args:
             text: текст для создания эмбеддинга
-            
+
         Returns:
             Вектор эмбеддинга
         """
         try:
             response = self.client.embeddings.create(
-            model="text-embedding-3-large",
+            model=self.model,
             input=text,
-            dimensions=1536
+            dimensions=self.dimensions
             )
             return response.data[0].embedding
         except Exception as e:
             self.logger.critical(f"Произошла ошибка при создании вектора эмбеддинга, Trace:, {e}")
             raise
 
-    def create_embeddings_for_chunks(self, chunks: List[str]) -> List[List[float]]:
+    def prepare_texts(self, texts : List[str], token_counts : Optional[List[Optional[int]]] = None) -> tuple[List[str], List[int]]:
+        """
+        Обрезает тексты до лимита модели и возвращает количество токенов каждого.
+        Известное количество токенов (token_count чанка) используется без повторной
+        токенизации, токенизатор вызывается только для текстов без него или длиннее лимита.
+
+        Args:
+            texts: список текстов
+            token_counts: количество токенов текстов (None - неизвестно)
+
+        Returns:
+            Подготовленные тексты и количество токенов в них
+        """
+        if token_counts is None:
+            token_counts = [None] * len(texts)
+        prepared = []
+        counts = []
+        for text, count in zip(texts, token_counts):
+            if count is None or count > self.max_tokens:
+                text = self.truncate_text(text)
+                count = self.count_tokens(text)
+            prepared.append(text)
+            counts.append(min(count, self.max_tokens))
+        return prepared, counts
+
+    def split_into_batches(self, texts : List[str], token_counts : Optional[List[int]] = None) -> List[List[int]]:
+        """
+        Разбивает тексты на пакеты, укладывающиеся в лимиты одного запроса
+        (количество входов и суммарное количество токенов).
+
+        Args:
+            texts: список текстов
+            token_counts: количество токенов текстов (None - считается токенизатором)
+
+        Returns:
+            Список пакетов, каждый пакет - список индексов исходных текстов
+        """
+        batches = []
+        current_batch = []
+        current_tokens = 0
+        for i, text in enumerate(texts):
+            tokens = min(token_counts[i] if token_counts is not None else self.count_tokens(text), self.max_tokens)
+            if current_batch and (
+                len(current_batch) >= self.max_inputs_per_request
+                or current_tokens + tokens > self.max_tokens_per_request
+            ):
+                batches.append(current_batch)
+                current_batch = []
+                current_tokens = 0
+            current_batch.append(i)
+            current_tokens += tokens
+        if current_batch:
+            batches.append(current_batch)
+        return batches
+
+    @retry(
+    stop=stop_after_attempt(5),
+    wait=wait_exponential(multiplier=1, min=1, max=60),
+    retry=retry_if_exception_type((openai.RateLimitError, openai.APIError, openai.APIConnectionError))
+    )
+    def embed_batch(self, texts : List[str]) -> List[List[float]]:
+        """
+        Создает эмбеддинги для одного пакета текстов одним запросом к API.
+        При ошибке повторяется только этот пакет.
+
+        Args:
+            texts: тексты пакета
+
+        Returns:
+            Векторы в порядке исходных текстов
+        """
+        response = self.client.embeddings.create(
+            model=self.model,
+            input=texts,
+            dimensions=self.dimensions
+        )
+        # API не гарантирует порядок, поэтому сортируем по индексу входа
+        data = sorted(response.data, key=lambda item: item.index)
+        return [item.embedding for item in data]
+
+    def create_embeddings_batch(self, texts : List[str], token_counts : Optional[List[Optional[int]]] = None) -> List[Optional[List[float]]]:
+        """
+        Создает эмбеддинги для списка текстов, упаковывая их в минимальное
+        количество запросов к API.
+
+        Args:
+            texts: список текстов
+            token_counts: количество токенов текстов, например metadata["token_count"] чанков
+
+        Returns:
+            Список векторов в исходном порядке. Для текстов из пакета, который
+            не удалось обработать после всех повторов, возвращается None.
+        """
+        embeddings : List[Optional[List[float]]] = [None] * len(texts)
+        if not texts:
+            return embeddings
+
+        prepared, counts = self.prepare_texts(texts, token_counts)
+        batches = self.split_into_batches(prepared, counts)
+        self.logger.info(f"Создание {len(texts)} эмбеддингов за {len(batches)} запрос(ов)")
+
+        for batch_num, batch in enumerate(batches):
+            try:
+                vectors = self.embed_batch([prepared[i] for i in batch])
+                for index, vector in zip(batch, vectors):
+                    embeddings[index] = vector
+            except Exception as e:
+                self.logger.critical(f"Ошибка при создании эмбеддингов для пакета {batch_num+1}/{len(batches)} ({len(batch)} текстов), Trace: {e}")
+        return embeddings
+
+    def create_embeddings_for_chunks(self, chunks: List[str]) -> List[Optional[List[float]]]:
         """
         Создает эмбеддинги для списка чанков текста.
-        
+
         Args:
             chunks: Список чанков текста.
 
         Returns:
-            Список эмбеддингов для каждого чанка.
+            Список эмбеддингов для каждого чанка (None для необработанных чанков).
         """
-        embeddings = []
-        for chunk in chunks:
-            embedding = self.create_embedding(chunk)
-            embeddings.append(embedding)
-        return embeddings
-    
\ No newline at end of file
+        return self.create_embeddings_batch(chunks)
+
@@ -1,6 +1,7 @@
-from typing import Protocol
+from typing import Protocol, Optional
 from bot.packages.i_classes.i_logger import ILogger
 
 class IEmbeddingGenerator(Protocol):
     def __init__(self, logger: ILogger) -> None: ...
-    def create_embedding(self, text: str) -> list[float]: ...
\ No newline at end of file
+    def create_embedding(self, text: str) -> list[float]: ...
+    def create_embeddings_batch(self, texts: list[str], token_counts: Optional[list[Optional[int]]] = None) -> list[Optional[list[float]]]: ...
\ No newline at end of file
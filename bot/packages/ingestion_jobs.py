@@ -0,0 +1,361 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, TypedDict
+
+from bot.packages.doc_processor import document_name
+from bot.packages.i_classes.i_logger import ILogger
+from bot.packages.table_registry import DEFAULT_TABLE_NAME, chat_table_name
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+JOB_KIND_FILE = "file"
+JOB_KIND_URL = "url"
+
+DEFAULT_INGEST_WORKERS = 2
+# Минимальный интервал между сообщениями о прогрессе (в секундах)
+PROGRESS_INTERVAL = 3.0
+
+class IngestionJob(TypedDict):
+    """
+    Задача на загрузку документа в базу знаний.
+    """
+    id: str
+    chat_id: Optional[int]
+    # Сообщение, которое редактируется при обновлении прогресса
+    message_id: Optional[int]
+    # JOB_KIND_FILE или JOB_KIND_URL
+    kind: str
+    # Путь к файлу или ссылка
+    source: str
+    # Исходное имя файла (для ссылок совпадает с source)
+    name: str
+    state: str
+    progress_done: int
+    progress_total: int
+    error: Optional[str]
+    created_at: float
+    updated_at: float
+
+class IngestionError(Exception):
+    """
+    Ошибка загрузки, текст которой можно показать пользователю.
+    """
+
+class IngestionJobStore():
+    """
+    Персистентное хранилище задач загрузки на SQLite. Незавершённые задачи
+    переживают перезапуск бота.
+    """
+
+    COLUMNS = ["id", "chat_id", "message_id", "kind", "source", "name", "state",
+               "progress_done", "progress_total", "error", "created_at", "updated_at"]
+
+    def __init__(self, db_path : str | Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, chat_id INTEGER, message_id INTEGER, kind TEXT NOT NULL, "
+            "source TEXT NOT NULL, name TEXT NOT NULL, state TEXT NOT NULL, "
+            "progress_done INTEGER NOT NULL DEFAULT 0, progress_total INTEGER NOT NULL DEFAULT 0, "
+            "error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.connection.commit()
+
+    def row_to_job(self, row) -> IngestionJob:
+        return dict(zip(self.COLUMNS, row))
+
+    def add(self, job : IngestionJob):
+        with self.lock:
+            placeholders = ", ".join("?" * len(self.COLUMNS))
+            self.connection.execute(
+                f"INSERT INTO jobs ({', '.join(self.COLUMNS)}) VALUES ({placeholders})",
+                [job[column] for column in self.COLUMNS]
+            )
+            self.connection.commit()
+
+    def update(self, job_id : str, **fields):
+        fields["updated_at"] = time.time()
+        with self.lock:
+            assignments = ", ".join(f"{column} = ?" for column in fields)
+            self.connection.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", [*fields.values(), job_id])
+            self.connection.commit()
+
+    def get(self, job_id : str) -> Optional[IngestionJob]:
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self.row_to_job(row) if row else None
+
+    def list_by_state(self, states : List[str]) -> List[IngestionJob]:
+        with self.lock:
+            placeholders = ", ".join("?" * len(states))
+            rows = self.connection.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE state IN ({placeholders}) ORDER BY created_at",
+                states
+            ).fetchall()
+        return [self.row_to_job(row) for row in rows]
+
+    def list_for_chat(self, chat_id : int, limit : int = 10) -> List[IngestionJob]:
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE chat_id = ? ORDER BY created_at DESC LIMIT ?",
+                (chat_id, limit)
+            ).fetchall()
+        return [self.row_to_job(row) for row in rows]
+
+class IngestionProcessor():
+    """
+    Выполняет загрузку одного документа: извлечение текста, разбиение на чанки,
+    создание эмбеддингов и запись в LanceDB.
+    """
+
+    def __init__(
+        self,
+        logger : ILogger,
+        html_processor,
+        html_cleaner,
+        document_processor,
+        pipeline,
+        table_registry,
+        table_name : str = DEFAULT_TABLE_NAME,
+        per_chat : bool = False,
+        url_ttl : Optional[float] = None
+    ):
+        self.logger = logger
+        self.html_processor = html_processor
+        self.html_cleaner = html_cleaner
+        self.document_processor = document_processor
+        self.pipeline = pipeline
+        self.table_registry = table_registry
+        self.table_name = table_name
+        # Загружать документы в коллекцию чата, из которого они пришли
+        self.per_chat = per_chat
+        # Срок хранения страниц по ссылкам в секундах (None - бессрочно)
+        self.url_ttl = url_ttl
+
+    async def process(self, job : IngestionJob, progress : Callable[[int, int], Awaitable[None]]) -> str:
+        """
+        Args:
+            job: задача загрузки
+            progress: корутина, принимающая (обработано страниц, всего страниц)
+                или (обработано чанков, 0), если количество страниц неизвестно
+
+        Returns:
+            Сообщение для пользователя об успешной загрузке
+        """
+        if job["kind"] == JOB_KIND_URL:
+            url_raw_text, status = await self.html_processor.download(job["source"])
+            if url_raw_text is None and isinstance(status, str):
+                raise IngestionError(status)
+            text = await asyncio.to_thread(self.html_cleaner.clean, url_raw_text)
+            segments = [text]
+            total_segments = 1
+            doc_name = job["source"]
+            expires_at = time.time() + self.url_ttl if self.url_ttl is not None else None
+            done_message = "Данные из ссылки были получены, обработаны и сохранены"
+        else:
+            segments = (text for _, text in self.document_processor.iter_pages(job["source"]))
+            total_segments = await asyncio.to_thread(self.document_processor.count_pages, job["source"])
+            doc_name = document_name(job["name"])
+            expires_at = None
+            done_message = "Данные из файла были получены, обработаны и сохранены"
+
+        table = await asyncio.to_thread(self.open_table, self.route(job))
+        report = await self.pipeline.aingest(doc_name, segments, table, progress_callback=progress, expires_at=expires_at, total_segments=total_segments)
+        if report["failed"]:
+            total = report["inserted"] + report["skipped"] + len(report["failed"])
+            raise IngestionError(f"Не удалось сохранить {len(report['failed'])} из {total} фрагментов документа, попробуйте загрузить его снова")
+        return done_message
+
+    def route(self, job : IngestionJob) -> str:
+        """
+        Возвращает название коллекции, в которую загружается документ задачи.
+        """
+        if self.per_chat and job["chat_id"] is not None:
+            return chat_table_name(job["chat_id"])
+        return self.table_name
+
+    def open_table(self, table_name : str):
+        return self.table_registry.get_table(table_name)
+
+class IngestionJobQueue():
+    """
+    Очередь фоновых задач загрузки с пулом асинхронных воркеров.
+
+    Обработчики бота только ставят задачу в очередь и сразу возвращают управление,
+    воркеры выполняют загрузку, сохраняют состояние задачи и сообщают прогресс
+    через notifier.
+    """
+
+    def __init__(self, logger : ILogger, store : IngestionJobStore, processor : IngestionProcessor, workers : int = DEFAULT_INGEST_WORKERS):
+        self.logger = logger
+        self.store = store
+        self.processor = processor
+        self.workers = workers
+        self.notifier : Optional[Callable[[IngestionJob, str], Awaitable[None]]] = None
+        self.queue : Optional[asyncio.Queue] = None
+        self.worker_tasks : List[asyncio.Task] = []
+        self.running : Dict[str, asyncio.Task] = {}
+        self.cancel_requested : set[str] = set()
+
+    def set_notifier(self, notifier : Callable[[IngestionJob, str], Awaitable[None]]):
+        self.notifier = notifier
+
+    async def start(self):
+        """
+        Запускает воркеры и возвращает в очередь задачи, не завершённые до перезапуска.
+        """
+        self.queue = asyncio.Queue()
+        for job in self.store.list_by_state([JOB_RUNNING, JOB_QUEUED]):
+            if job["state"] == JOB_RUNNING:
+                self.store.update(job["id"], state=JOB_QUEUED)
+            self.queue.put_nowait(job["id"])
+        self.worker_tasks = [asyncio.create_task(self.worker(i)) for i in range(self.workers)]
+        self.logger.info(f"Очередь загрузки запущена: воркеров {self.workers}, задач в очереди {self.queue.qsize()}")
+
+    async def stop(self):
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks = []
+
+    def new_job_id(self) -> str:
+        return uuid.uuid4().hex[:8]
+
+    def enqueue(self, kind : str, source : str, name : str, chat_id : Optional[int] = None, message_id : Optional[int] = None, job_id : Optional[str] = None) -> IngestionJob:
+        """
+        Сохраняет задачу и ставит её в очередь.
+
+        Args:
+            kind: JOB_KIND_FILE или JOB_KIND_URL
+            source: путь к файлу или ссылка
+            name: имя документа для пользователя
+            chat_id: чат, в который отправляется статус
+            message_id: сообщение со статусом, которое редактируется при обновлении прогресса
+            job_id: заранее выданный номер задачи (new_job_id)
+        """
+        now = time.time()
+        job : IngestionJob = {
+            "id": job_id or self.new_job_id(),
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "kind": kind,
+            "source": source,
+            "name": name,
+            "state": JOB_QUEUED,
+            "progress_done": 0,
+            "progress_total": 0,
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        }
+        self.store.add(job)
+        self.queue.put_nowait(job["id"])
+        self.logger.info(f"Задача загрузки {job['id']} ({kind}: {name}) поставлена в очередь")
+        return job
+
+    def cancel(self, job_id : str) -> bool:
+        """
+        Отменяет задачу в очереди или выполняющуюся задачу.
+
+        Returns:
+            True, если задача была отменена
+        """
+        job = self.store.get(job_id)
+        if job is None or job["state"] not in (JOB_QUEUED, JOB_RUNNING):
+            return False
+        task = self.running.get(job_id)
+        if task is not None:
+            self.cancel_requested.add(job_id)
+            task.cancel()
+        else:
+            self.store.update(job_id, state=JOB_CANCELLED)
+            self.remove_source(job)
+        self.logger.info(f"Задача загрузки {job_id} отменена")
+        return True
+
+    async def notify(self, job_id : str, text : str):
+        if self.notifier is None:
+            return
+        try:
+            await self.notifier(self.store.get(job_id), text)
+        except Exception as e:
+            self.logger.warning(f"Не удалось отправить статус задачи {job_id}: {e}")
+
+    async def worker(self, number : int):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                job = self.store.get(job_id)
+                if job is None or job["state"] != JOB_QUEUED:
+                    continue
+                task = asyncio.create_task(self.run_job(job))
+                self.running[job_id] = task
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    # Остановка воркера оставляет задачу в состоянии running до перезапуска
+                    if job_id not in self.cancel_requested:
+                        raise
+                    self.store.update(job_id, state=JOB_CANCELLED)
+                    self.remove_source(job)
+                    await self.notify(job_id, "🚫 Загрузка отменена")
+            finally:
+                self.running.pop(job_id, None)
+                self.cancel_requested.discard(job_id)
+                self.queue.task_done()
+
+    async def run_job(self, job : IngestionJob):
+        job_id = job["id"]
+        self.store.update(job_id, state=JOB_RUNNING)
+        await self.notify(job_id, f"⏳ Задача {job_id}: обработка...")
+        last_notified = 0.0
+
+        async def progress(done : int, total : int):
+            nonlocal last_notified
+            self.store.update(job_id, progress_done=done, progress_total=total)
+            now = time.monotonic()
+            if (total and done == total) or now - last_notified >= PROGRESS_INTERVAL:
+                last_notified = now
+                if total:
+                    await self.notify(job_id, f"⏳ Задача {job_id}: страница {done}/{total}")
+                else:
+                    await self.notify(job_id, f"⏳ Задача {job_id}: обработано чанков {done}")
+
+        # Отмена при остановке бота (CancelledError) оставляет файл для повторной загрузки после перезапуска
+        try:
+            message = await self.processor.process(job, progress)
+            self.store.update(job_id, state=JOB_DONE)
+            self.remove_source(job)
+            await self.notify(job_id, f"✅ {message}")
+        except asyncio.CancelledError:
+            raise
+        except IngestionError as e:
+            self.store.update(job_id, state=JOB_FAILED, error=str(e))
+            self.remove_source(job)
+            await self.notify(job_id, f"❌ {e}")
+        except Exception as e:
+            self.logger.critical(f"Ошибка при выполнении задачи загрузки {job_id}, Trace: {e}")
+            self.store.update(job_id, state=JOB_FAILED, error=str(e))
+            self.remove_source(job)
+            await self.notify(job_id, "❌ Ошибка при обработке документа")
+
+    def remove_source(self, job : IngestionJob):
+        """
+        Удаляет загруженный файл завершённой или отменённой пользователем задачи.
+        """
+        if job["kind"] == JOB_KIND_FILE and os.path.exists(job["source"]):
+            os.remove(job["source"])
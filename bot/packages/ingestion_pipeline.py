@@ -0,0 +1,116 @@
+import asyncio
+from typing import Awaitable, Callable, Iterable, Iterator, Optional
+
+import lancedb
+
+from bot.packages.i_classes.i_logger import ILogger
+from bot.packages.lance_vector_db import FillReport
+
+DEFAULT_CHUNK_SIZE = 3000
+DEFAULT_CHUNK_OVERLAP = 200
+
+class IngestionPipeline():
+    """
+    Конвейер загрузки в памяти: сегменты текста -> чанки -> эмбеддинги -> таблица.
+
+    Текст не сохраняется на диск перед разбиением. Txt архив пишется как побочный
+    выход конвейера по мере прохождения сегментов и может быть отключён.
+    """
+
+    def __init__(
+        self,
+        logger : ILogger,
+        text_processor,
+        lance_db,
+        file_utilities = None,
+        archive_txt : bool = True,
+        chunk_size : int = DEFAULT_CHUNK_SIZE,
+        chunk_overlap : int = DEFAULT_CHUNK_OVERLAP,
+        by_tokens : bool = False
+    ):
+        self.logger = logger
+        self.text_processor = text_processor
+        self.lance_db = lance_db
+        self.file_utilities = file_utilities
+        self.archive_txt = archive_txt and file_utilities is not None
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        # chunk_size и chunk_overlap заданы в токенах, а не в символах
+        self.by_tokens = by_tokens
+
+    def iter_chunks(self, doc_name : str, segments : Iterable[str], archive : Optional[bool] = None):
+        """
+        Лениво разбивает сегменты на чанки, при необходимости архивируя текст.
+
+        Args:
+            doc_name: название документа в таблице
+            segments: итератор текстовых сегментов
+            archive: писать ли txt архив (по умолчанию - настройка конвейера)
+
+        Returns:
+            Итератор чанков
+        """
+        if archive is None:
+            archive = self.archive_txt
+        if archive and self.file_utilities is not None:
+            segments = self.file_utilities.tee_txt(segments, doc_name)
+        return self.text_processor.iter_chunks(segments, self.chunk_size, self.chunk_overlap, self.by_tokens)
+
+    async def aingest(
+        self,
+        doc_name : str,
+        segments : Iterable[str],
+        current_table : lancedb.db.Table,
+        progress_callback : Optional[Callable[[int, int], Awaitable[None]]] = None,
+        archive : Optional[bool] = None,
+        expires_at : Optional[float] = None,
+        total_segments : Optional[int] = None
+    ) -> FillReport:
+        """
+        Загружает документ в таблицу. Чанки идут в таблицу потоком, прогресс
+        считается по ходу загрузки, без предварительного списка всех чанков.
+
+        Args:
+            doc_name: название документа в таблице
+            segments: итератор текстовых сегментов (страниц, очищенного текста страницы)
+            current_table: объект таблицы для добавления
+            progress_callback: корутина, принимающая (обработано, всего). При известном
+                total_segments - прочитано сегментов из total_segments, иначе
+                записано чанков и 0 (общее количество неизвестно)
+            archive: писать ли txt архив (по умолчанию - настройка конвейера)
+            expires_at: Unix-время, после которого документ удаляется (None - бессрочно)
+            total_segments: количество сегментов документа (например, страниц PDF), если известно
+
+        Returns:
+            Отчёт о загрузке
+        """
+        segments_read = 0
+
+        def count_segments(segments : Iterable[str]) -> Iterator[str]:
+            nonlocal segments_read
+            for segment in segments:
+                segments_read += 1
+                yield segment
+
+        chunks = self.iter_chunks(doc_name, count_segments(segments), archive)
+        on_group = None
+        if progress_callback is not None:
+            async def on_group(processed : int):
+                if total_segments:
+                    await progress_callback(min(segments_read, total_segments), total_segments)
+                else:
+                    await progress_callback(processed, 0)
+
+            await progress_callback(0, total_segments or 0)
+
+        report = await self.lance_db.afill_table_stream(filename=doc_name, chunks=chunks, current_table=current_table, progress_callback=on_group)
+        if progress_callback is not None and total_segments:
+            await progress_callback(total_segments, total_segments)
+        if expires_at is not None:
+            # Срок обновляется и у неизменившихся чанков повторно загруженного документа
+            await asyncio.to_thread(self.lance_db.set_document_expiry, current_table, doc_name, expires_at)
+        self.logger.info(
+            f"Документ {doc_name} загружен: добавлено {report['inserted']}, без изменений {report['skipped']}, "
+            f"удалено {report['deleted']}, ошибок {len(report['failed'])}"
+        )
+        return report
@@ -1,23 +1,272 @@
+import numpy as np
 import pandas as pd
 import pyarrow as pa
 import lancedb
-from typing import List
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from lancedb.index import IvfPq, HnswSq, FTS, BTree, Bitmap
+from typing import List, Optional, Dict, TypedDict, Iterable, Iterator, Set, Callable, Awaitable
+from itertools import islice
 from bot.packages.i_classes.i_logger import ILogger
 from bot.packages.i_classes.i_vector_db import IVEctorDB
 from bot.packages.i_classes.i_embedding_generator import IEmbeddingGenerator
+from bot.packages.memory_search import InMemoryVectorIndex, MEMORY_SEARCH_MAX_ROWS, MEMORY_SEARCH_MAX_BYTES
 
 from langchain_core.documents import Document
 import hashlib
 
+VECTOR_DIMENSIONS = 1536
+MAX_ROWS_PER_WRITE = 5000
+# Количество чанков в одной группе при потоковой загрузке
+STREAM_BATCH_SIZE = 512
+DELETE_BATCH_SIZE = 500
+
+VECTOR_COLUMN = "vector"
+# Короткий префикс эмбеддинга (Matryoshka) для первого этапа поиска
+PREFIX_VECTOR_COLUMN = "vector_short"
+# Допустимые типы хранения векторов: float16 вдвое компактнее float32
+VECTOR_DTYPES = {"float32": pa.float32(), "float16": pa.float16()}
+# Во сколько раз больше кандидатов отбирается по короткому вектору для пересчёта по полному
+RESCORE_FACTOR = 8
+
+# Индекс ANN строится, когда в таблице набирается столько строк; меньшие таблицы быстрее сканировать целиком
+INDEX_MIN_ROWS = 20_000
+# Индекс переобучается, когда строк вне индекса больше этой доли от проиндексированных
+REINDEX_UNINDEXED_RATIO = 0.2
+INDEX_TYPES = ("IVF_PQ", "IVF_HNSW_SQ")
+
+TEXT_COLUMN = "text"
+# Язык стемминга и стоп-слов полнотекстового индекса
+FTS_LANGUAGE = "Russian"
+SEARCH_MODES = ("vector", "hybrid")
+# Константа k в формуле Reciprocal Rank Fusion: score = sum(1 / (k + rank))
+RRF_K = 60
+# Во сколько раз больше кандидатов берётся из каждого поиска перед слиянием
+HYBRID_CANDIDATE_FACTOR = 4
+SEARCH_WORKERS = 4
+# Баланс MMR между релевантностью (1.0) и разнообразием (0.0) выбранных чанков
+MMR_LAMBDA = 0.5
+# Во сколько раз больше кандидатов отбирается перед выбором разнообразных чанков
+MMR_FETCH_FACTOR = 4
+
+# Скалярные индексы колонок метаданных: ускоряют фильтры поиска, удаление и merge-insert по chunk_id
+SCALAR_INDEXES = {"doc_name": "BITMAP", "chunk_id": "BTREE", "token_count": "BTREE", "expires_at": "BTREE"}
+# Колонки, доступные в metadata_filter, и тип их значений
+FILTER_COLUMNS = {"doc_name": str, "token_count": int}
+# Синонимы ключей фильтра, которые часто придумывает модель
+FILTER_ALIASES = {"source": "doc_name", "document": "doc_name", "filename": "doc_name", "tokens": "token_count"}
+FILTER_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+def build_schema(vector_dtype : str = "float32", prefix_dimensions : Optional[int] = None) -> pa.Schema:
+    """
+    Строит схему таблицы чанков.
+
+    Args:
+        vector_dtype: тип хранения векторов ("float32" или "float16")
+        prefix_dimensions: размерность короткого вектора или None, если он не нужен
+
+    Returns:
+        Схема pyarrow
+    """
+    if vector_dtype not in VECTOR_DTYPES:
+        raise ValueError(f"Неподдерживаемый тип векторов: {vector_dtype}, допустимы: {', '.join(VECTOR_DTYPES)}")
+    if prefix_dimensions is not None and not 0 < prefix_dimensions < VECTOR_DIMENSIONS:
+        raise ValueError(f"Размерность короткого вектора должна быть от 1 до {VECTOR_DIMENSIONS - 1}")
+    value_type = VECTOR_DTYPES[vector_dtype]
+    fields = [
+        pa.field("text", pa.string()),
+        pa.field(VECTOR_COLUMN, pa.list_(value_type, VECTOR_DIMENSIONS)),
+        pa.field("doc_name", pa.string()),
+        pa.field("chunk_id", pa.string()),
+        # Количество токенов чанка, чтобы не токенизировать текст повторно при упаковке и учёте стоимости
+        pa.field("token_count", pa.int32()),
+        # Unix-время, после которого документ удаляется при обслуживании; NULL - бессрочно
+        pa.field("expires_at", pa.float64())
+    ]
+    if prefix_dimensions is not None:
+        fields.append(pa.field(PREFIX_VECTOR_COLUMN, pa.list_(value_type, prefix_dimensions)))
+    return pa.schema(fields)
+
+def prefix_vectors(matrix : np.ndarray, dimensions : int) -> np.ndarray:
+    """
+    Обрезает векторы до первых dimensions компонент и заново нормирует их,
+    как требуется для Matryoshka-эмбеддингов text-embedding-3.
+    """
+    prefix = matrix[:, :dimensions]
+    norms = np.linalg.norm(prefix, axis=1, keepdims=True)
+    return prefix / np.where(norms == 0, 1.0, norms)
+
+def mmr_select(query_vector : np.ndarray, candidate_vectors : np.ndarray, k : int, lambda_mult : float = MMR_LAMBDA) -> List[int]:
+    """
+    Выбирает k кандидатов методом Maximal Marginal Relevance: на каждом шаге
+    берётся кандидат с наибольшим lambda * sim(запрос, d) - (1 - lambda) * max sim(d, выбранные).
+    Сходства считаются один раз матричным умножением, шаг выбора - векторная операция над всеми кандидатами.
+
+    Args:
+        query_vector: эмбеддинг запроса
+        candidate_vectors: матрица эмбеддингов кандидатов (строка - кандидат)
+        k: количество выбираемых кандидатов
+        lambda_mult: баланс релевантности и разнообразия
+
+    Returns:
+        Номера выбранных кандидатов в порядке выбора
+    """
+    count = min(k, len(candidate_vectors))
+    if count <= 0:
+        return []
+    candidates = np.asarray(candidate_vectors, dtype=np.float32)
+    norms = np.linalg.norm(candidates, axis=1, keepdims=True)
+    candidates = candidates / np.where(norms == 0, 1.0, norms)
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+    # Наибольшее сходство кандидата с уже выбранными
+    redundancy = np.zeros(len(candidates), dtype=np.float32)
+    available = np.ones(len(candidates), dtype=bool)
+    selected = []
+    for _ in range(count):
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
+
+class FillReport(TypedDict):
+    """
+    Результат добавления чанков в таблицу.
+    """
+    # Количество успешно добавленных чанков
+    inserted: int
+    # Количество чанков, которые уже были в таблице без изменений
+    skipped: int
+    # Количество удалённых устаревших чанков
+    deleted: int
+    # Номер чанка -> текст ошибки
+    failed: Dict[int, str]
+
+class DocumentDiff(TypedDict):
+    """
+    Разница между новыми чанками документа и сохранёнными в таблице.
+    """
+    # Номера чанков, которых ещё нет в таблице
+    new_indices: List[int]
+    # Строки таблицы, которые остаются без изменений
+    kept_rows: pa.Table
+    # Количество строк документа, которых нет среди новых чанков
+    stale_count: int
+    # Количество строк документа в таблице до обновления
+    existing_count: int
+    # В таблице есть повторные копии одних и тех же чанков
+    has_duplicates: bool
+
+class StreamState(TypedDict):
+    """
+    Состояние потоковой загрузки документа.
+    """
+    # chunk_id строк документа, сохранённых до загрузки
+    existing_ids: Set[str]
+    # chunk_id, уже встреченные в потоке
+    seen_ids: Set[str]
+    # _rowid старых строк документа с повторяющимися чанками: удаляются после записи новой копии
+    replaced_row_ids: List[int]
+
+class DocumentInfo(TypedDict):
+    """
+    Документ в таблице.
+    """
+    doc_name: str
+    chunks: int
+    # Unix-время истечения срока хранения или None
+    expires_at: Optional[float]
+
+class IndexState(TypedDict):
+    """
+    Состояние векторного индекса таблицы.
+    """
+    # Индексируемая колонка
+    column: str
+    # Тип индекса или None, если индекса нет
+    index_type: Optional[str]
+    rows: int
+    indexed_rows: int
+    # Строки, добавленные после построения индекса: по ним идёт полный перебор
+    unindexed_rows: int
+
 class LanceVectorDB(IVEctorDB):
-    def __init__(self, logger: ILogger, embedding_generator : IEmbeddingGenerator) -> None:
+    def __init__(
+        self,
+        logger: ILogger,
+        embedding_generator : IEmbeddingGenerator,
+        vector_dtype : str = "float32",
+        prefix_dimensions : Optional[int] = None,
+        rescore_factor : int = RESCORE_FACTOR,
+        index_type : str = "IVF_PQ",
+        index_min_rows : int = INDEX_MIN_ROWS,
+        reindex_ratio : float = REINDEX_UNINDEXED_RATIO,
+        nprobes : Optional[int] = None,
+        refine_factor : Optional[int] = None,
+        search_mode : str = "vector",
+        query_cache = None,
+        mmr_lambda : float = MMR_LAMBDA,
+        memory_search_rows : int = MEMORY_SEARCH_MAX_ROWS,
+        memory_search_bytes : int = MEMORY_SEARCH_MAX_BYTES
+    ) -> None:
         """
         Инициализация базы данных с логгером.
+
+        Args:
+            logger: логгер
+            embedding_generator: генератор эмбеддингов
+            vector_dtype: тип хранения векторов в новых таблицах ("float32" или "float16")
+            prefix_dimensions: размерность короткого вектора для двухэтапного поиска в новых таблицах
+            rescore_factor: во сколько раз больше кандидатов отбирается на первом этапе
+            index_type: тип векторного индекса ("IVF_PQ" или "IVF_HNSW_SQ")
+            index_min_rows: количество строк, начиная с которого строится индекс
+            reindex_ratio: доля строк вне индекса, после которой индекс переобучается
+            nprobes: сколько разделов IVF просматривать при поиске (None - значение LanceDB)
+            refine_factor: во сколько раз больше кандидатов пересчитывать по исходным векторам (None - без пересчёта)
+            search_mode: режим поиска по умолчанию ("vector" или "hybrid" - полнотекстовый + векторный)
+            query_cache: кэш эмбеддингов запросов (QueryEmbeddingCache), None - без кэша
+            mmr_lambda: баланс релевантности и разнообразия при выборе чанков методом MMR
+            memory_search_rows: таблицы до этого размера ищутся точным перебором в памяти (0 - отключено)
+            memory_search_bytes: общий объём векторов и метаданных всех таблиц в памяти
         """
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Неподдерживаемый тип индекса: {index_type}, допустимы: {', '.join(INDEX_TYPES)}")
+        if search_mode not in SEARCH_MODES:
+            raise ValueError(f"Неподдерживаемый режим поиска: {search_mode}, допустимы: {', '.join(SEARCH_MODES)}")
         self.logger = logger
         self.embedding_generator = embedding_generator
+        self.schema = build_schema(vector_dtype, prefix_dimensions)
+        self.rescore_factor = rescore_factor
+        self.index_type = index_type
+        self.index_min_rows = index_min_rows
+        self.reindex_ratio = reindex_ratio
+        self.nprobes = nprobes
+        self.refine_factor = refine_factor
+        self.search_mode = search_mode
+        self.query_cache = query_cache
+        self.mmr_lambda = mmr_lambda
+        self.memory_index = InMemoryVectorIndex(logger, memory_search_rows, VECTOR_COLUMN, memory_search_bytes) if memory_search_rows > 0 else None
+        # Полнотекстовый и векторный поиск гибридного режима выполняются параллельно
+        self.search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="lance-search")
+        # Обслуживание индекса выполняется в одном фоновом потоке
+        self.index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lance-index")
+        self.index_future : Optional[Future] = None
+        # Таблицы (по названию), изменённые во время обслуживания и ожидающие повторной проверки
+        self.index_recheck_tables : Dict[str, lancedb.db.Table] = {}
+        # Прямые вызовы ensure_index не должны конфликтовать с фоновым обслуживанием
+        self.index_lock = threading.Lock()
         self.connection : lancedb.db.DBConnection
         self.current_table : lancedb.db.Table
+        self.max_rows_per_write = MAX_ROWS_PER_WRITE
+        self.stream_batch_size = STREAM_BATCH_SIZE
 
     def get_connection(self) -> lancedb.db.DBConnection:
         if self.connection is None:
@@ -31,15 +280,17 @@ class LanceVectorDB(IVEctorDB):
             raise
         return self.current_table
     
-    def connect_db(self, db_path: str = "data/lancedb"):
+    def connect_db(self, db_path: str = "data/lancedb", read_consistency_interval : Optional[timedelta] = None):
         """
         Создает или подключается к базе данных LanceDB.
         
         Args:
             db_path: путь к базе данных.
+            read_consistency_interval: как часто открытые таблицы проверяют новую версию при чтении
+                (None - только записи через тот же объект таблицы)
         """
         try:
-            self.connection = lancedb.connect(db_path)
+            self.connection = lancedb.connect(db_path, read_consistency_interval=read_consistency_interval)
             if not self.get_connection():
                 '''
                 Метод в случае None вызовет raise, поэтому пока ничего не делаем
@@ -62,11 +313,33 @@ class LanceVectorDB(IVEctorDB):
     def check_and_create_table(self, tablename : str):
         if not self.table_exists(tablename):
             self.create_table(tablename)
+        else:
+            self.migrate_table(tablename)
+
+    def migrate_table(self, table_name : str):
+        """
+        Добавляет в существующую таблицу колонки, появившиеся в схеме позже.
+        Для старых строк значения новых колонок остаются пустыми (NULL).
+        """
+        table = self.connection.open_table(table_name)
+        existing = set(table.schema.names)
+        missing = [field for field in self.get_schema() if field.name not in existing]
+        # Векторные колонки нельзя заполнить пустыми значениями: строки выпали бы из поиска
+        vector_fields = [field for field in missing if pa.types.is_fixed_size_list(field.type)]
+        if vector_fields:
+            self.logger.warning(
+                f"Таблица '{table_name}' создана без колонок {', '.join(field.name for field in vector_fields)}, "
+                f"для их появления таблицу нужно загрузить заново"
+            )
+        missing = [field for field in missing if field not in vector_fields]
+        if not missing:
+            return
+        table.add_columns(pa.schema(missing))
+        self.logger.info(f"В таблицу '{table_name}' добавлены колонки: {', '.join(field.name for field in missing)}")
 
     def table_exists(self, tablename : str) -> bool:
-        if not tablename in self.connection.table_names():
-            return False
-        return True
+        # table_names() возвращает только первые 10 таблиц, а коллекций чатов может быть больше
+        return tablename in self.connection.list_tables().tables
 
     def create_table(self, table_name: str):
         """
@@ -76,27 +349,48 @@ class LanceVectorDB(IVEctorDB):
             table_name: имя таблицы.
         """
         try:
-            schema = pa.schema([
-                pa.field("text", pa.string()),
-                pa.field("vector", pa.list_(pa.float32(), 1536)),
-                pa.field("doc_name", pa.string()),
-                pa.field("chunk_id", pa.string())
-            ])
-            self.current_table = self.connection.create_table(table_name, schema=schema)
+            self.current_table = self.connection.create_table(table_name, schema=self.get_schema())
             self.logger.info(f"Таблица '{table_name}' успешно создана.")
         except Exception as e:
             self.logger.error(f"Ошибка при создании таблицы {table_name}: {e}")
             raise
 
+    def get_schema(self) -> pa.Schema:
+        """
+        Схема для новых таблиц. Запись в существующую таблицу идёт по её собственной схеме.
+        """
+        return self.schema
+
+    def make_record_batch(self, rows : List[dict], schema : pa.Schema) -> pa.RecordBatch:
+        """
+        Собирает строки чанков в RecordBatch по схеме таблицы. Векторы приводятся
+        к типу хранения таблицы, короткий вектор вычисляется из полного.
+        """
+        matrix = np.asarray([row[VECTOR_COLUMN] for row in rows], dtype=np.float32).reshape(len(rows), VECTOR_DIMENSIONS)
+        arrays = []
+        for field in schema:
+            if field.name == VECTOR_COLUMN or field.name == PREFIX_VECTOR_COLUMN:
+                dimensions = field.type.list_size
+                values = matrix if field.name == VECTOR_COLUMN else prefix_vectors(matrix, dimensions)
+                flat = pa.array(values.astype(field.type.value_type.to_pandas_dtype()).ravel(), type=field.type.value_type)
+                arrays.append(pa.FixedSizeListArray.from_arrays(flat, dimensions))
+            else:
+                arrays.append(pa.array([row.get(field.name) for row in rows], type=field.type))
+        return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
     def generate_chunk_id(self, text: str, filename: str) -> str:
         # Хешируем текст и имя файла для уникальности
         combined_string = f"{filename}_{text}"
         return hashlib.sha256(combined_string.encode('utf-8')).hexdigest()
 
-    def fill_table(self, filename : str, chunks: List[Document], current_table : lancedb.db.Table):
+    def fill_table(self, filename : str, chunks: List[Document], current_table : lancedb.db.Table) -> FillReport:
         """
-        Заполняет таблицу векторными данными.
-        
+        Заполняет таблицу векторными данными документа.
+
+        Повторная загрузка документа с тем же filename обновляет его: неизменные
+        чанки (тот же chunk_id) сохраняются, эмбеддинги создаются только для
+        новых чанков, устаревшие чанки удаляются.
+
         Args:
             filename: название источника чанков
             chunks: чанки для добавления
@@ -104,27 +398,455 @@ class LanceVectorDB(IVEctorDB):
         """
 
         self.logger.info(f"Начинаем создание эмбеддингов и добавление в таблицу ({len(chunks)} чанков)...")
+        diff = self.diff_document(filename, chunks, current_table)
+        vectors = self.embed_chunks([chunks[i] for i in diff["new_indices"]])
+        report = self.upsert_document(filename, chunks, vectors, diff, current_table)
+        self.schedule_index_maintenance(current_table)
+        return report
+
+    async def afill_table(self, filename : str, chunks: List[Document], current_table : lancedb.db.Table) -> FillReport:
+        """
+        Асинхронный вариант fill_table: эмбеддинги создаются без блокировки
+        event loop, чтение и запись таблицы выполняются в отдельном потоке.
+
+        Args:
+            filename: название источника чанков
+            chunks: чанки для добавления
+            current_table: объект таблицы для добавления
+        """
+        self.logger.info(f"Начинаем асинхронное создание эмбеддингов и добавление в таблицу ({len(chunks)} чанков)...")
+        diff = await asyncio.to_thread(self.diff_document, filename, chunks, current_table)
+        vectors = await self.aembed_chunks([chunks[i] for i in diff["new_indices"]])
+        report = await asyncio.to_thread(self.upsert_document, filename, chunks, vectors, diff, current_table)
+        self.schedule_index_maintenance(current_table)
+        return report
+
+    def fill_table_stream(self, filename : str, chunks: Iterable[Document], current_table : lancedb.db.Table, progress_callback : Optional[Callable[[int], None]] = None) -> FillReport:
+        """
+        Потоковый вариант fill_table: чанки читаются из генератора группами,
+        для каждой группы создаются эмбеддинги и выполняется запись. В памяти
+        держится только текущая группа и множество chunk_id документа.
+
+        Args:
+            filename: название источника чанков
+            chunks: итератор чанков (например, TextProcessor.iter_chunks)
+            current_table: объект таблицы для добавления
+            progress_callback: вызывается после каждой группы с количеством обработанных чанков
+        """
+        self.logger.info(f"Начинаем потоковое добавление документа {filename} в таблицу...")
+        report : FillReport = {"inserted": 0, "skipped": 0, "deleted": 0, "failed": {}}
+        state = self.begin_stream(filename, current_table)
+        for group in self.iter_chunk_groups(chunks):
+            new_chunks = self.filter_stream_group(filename, group, state, report)
+            if new_chunks:
+                vectors = self.embed_chunks([chunk for _, chunk in new_chunks])
+                self.write_rows(self.build_chunk_rows(filename, new_chunks, vectors, report), current_table, report)
+            if progress_callback is not None:
+                progress_callback(group[-1][0] + 1)
+        self.finish_stream(filename, state, current_table, report)
+        self.schedule_index_maintenance(current_table)
+        return report
+
+    async def afill_table_stream(self, filename : str, chunks: Iterable[Document], current_table : lancedb.db.Table, progress_callback : Optional[Callable[[int], Awaitable[None]]] = None) -> FillReport:
+        """
+        Асинхронный вариант fill_table_stream. Генератор чанков продвигается
+        в отдельном потоке, поэтому извлечение и разбиение текста не блокируют event loop.
+
+        Args:
+            filename: название источника чанков
+            chunks: итератор чанков
+            current_table: объект таблицы для добавления
+            progress_callback: корутина, вызываемая после каждой группы с количеством обработанных чанков
+        """
+        self.logger.info(f"Начинаем асинхронное потоковое добавление документа {filename} в таблицу...")
+        report : FillReport = {"inserted": 0, "skipped": 0, "deleted": 0, "failed": {}}
+        state = await asyncio.to_thread(self.begin_stream, filename, current_table)
+        groups = self.iter_chunk_groups(chunks)
+        while group := await asyncio.to_thread(next, groups, None):
+            new_chunks = self.filter_stream_group(filename, group, state, report)
+            if new_chunks:
+                vectors = await self.aembed_chunks([chunk for _, chunk in new_chunks])
+                rows = self.build_chunk_rows(filename, new_chunks, vectors, report)
+                await asyncio.to_thread(self.write_rows, rows, current_table, report)
+            if progress_callback is not None:
+                await progress_callback(group[-1][0] + 1)
+        await asyncio.to_thread(self.finish_stream, filename, state, current_table, report)
+        self.schedule_index_maintenance(current_table)
+        return report
+
+    def embed_chunks(self, chunks : List[Document]) -> List[Optional[List[float]]]:
+        """
+        Создаёт эмбеддинги чанков. Количество токенов, посчитанное при разбиении
+        (metadata["token_count"]), передаётся генератору для пакетирования и лимитов.
+        """
+        texts = [chunk.page_content for chunk in chunks]
+        token_counts = [chunk.metadata.get("token_count") for chunk in chunks]
+        return self.embedding_generator.create_embeddings_batch(texts, token_counts=token_counts)
+
+    async def aembed_chunks(self, chunks : List[Document]) -> List[Optional[List[float]]]:
+        if not hasattr(self.embedding_generator, "acreate_embeddings_batch"):
+            return await asyncio.to_thread(self.embed_chunks, chunks)
+        texts = [chunk.page_content for chunk in chunks]
+        token_counts = [chunk.metadata.get("token_count") for chunk in chunks]
+        return await self.embedding_generator.acreate_embeddings_batch(texts, token_counts=token_counts)
+
+    def iter_chunk_groups(self, chunks: Iterable[Document]) -> Iterator[List[tuple[int, Document]]]:
+        iterator = enumerate(chunks)
+        while group := list(islice(iterator, self.stream_batch_size)):
+            yield group
+
+    def begin_stream(self, filename : str, current_table : lancedb.db.Table) -> StreamState:
+        """
+        Читает chunk_id уже сохранённых строк документа.
+        """
+        existing_ids = (
+            current_table.search()
+            .where(f"doc_name = {self.quote_sql_string(filename)}")
+            .select(["chunk_id"])
+            .limit(None)
+            .to_arrow()
+            .column("chunk_id")
+            .to_pylist()
+        )
+        existing_set = set(existing_ids)
+        replaced_row_ids = []
+        if len(existing_set) != len(existing_ids):
+            # Повторные копии одних и тех же чанков: документ записывается заново, а старые
+            # строки удаляются в finish_stream, чтобы сбой загрузки не оставил таблицу без документа
+            self.logger.warning(f"Документ {filename} содержит повторяющиеся чанки, старые строки будут удалены после записи")
+            replaced_row_ids = self.get_document_row_ids(filename, current_table)
+            existing_set = set()
+        return {"existing_ids": existing_set, "seen_ids": set(), "replaced_row_ids": replaced_row_ids}
+
+    def filter_stream_group(self, filename : str, group : List[tuple[int, Document]], state : StreamState, report : FillReport) -> List[tuple[int, Document]]:
+        """
+        Оставляет в группе только чанки, которых ещё нет в таблице.
+        """
+        new_chunks = []
+        for i, chunk in group:
+            chunk_id = self.generate_chunk_id(chunk.page_content, filename)
+            if chunk_id in state["seen_ids"]:
+                continue
+            state["seen_ids"].add(chunk_id)
+            if chunk_id in state["existing_ids"]:
+                report["skipped"] += 1
+            else:
+                new_chunks.append((i, chunk))
+        return new_chunks
+
+    def finish_stream(self, filename : str, state : StreamState, current_table : lancedb.db.Table, report : FillReport):
+        """
+        Удаляет строки документа, которые не встретились в новом потоке чанков,
+        и старые копии переписанного документа. Если часть чанков не записалась,
+        старые строки остаются, чтобы документ не потерял содержимое.
+        """
+        if report["failed"]:
+            self.logger.warning(f"Документ {filename} записан с ошибками, старые строки документа сохранены")
+            return
+        if state["replaced_row_ids"]:
+            self.delete_row_ids(filename, state["replaced_row_ids"], current_table)
+            report["deleted"] += len(state["replaced_row_ids"])
+        stale_ids = list(state["existing_ids"] - state["seen_ids"])
+        doc_filter = f"doc_name = {self.quote_sql_string(filename)}"
+        for start in range(0, len(stale_ids), DELETE_BATCH_SIZE):
+            part = stale_ids[start:start + DELETE_BATCH_SIZE]
+            id_list = ", ".join(self.quote_sql_string(chunk_id) for chunk_id in part)
+            try:
+                current_table.delete(f"{doc_filter} AND chunk_id IN ({id_list})")
+                report["deleted"] += len(part)
+            except Exception as e:
+                self.logger.warning(f"Ошибка при удалении устаревших чанков документа {filename}: {str(e)}")
+        self.logger.info(
+            f"Документ {filename} обновлён: добавлено {report['inserted']}, без изменений {report['skipped']}, удалено {report['deleted']}, ошибок {len(report['failed'])}"
+        )
+
+    def quote_sql_string(self, value : str) -> str:
+        return "'" + value.replace("'", "''") + "'"
+
+    def list_documents(self, current_table : lancedb.db.Table) -> List[DocumentInfo]:
+        """
+        Возвращает документы таблицы с количеством чанков и сроком хранения.
+        """
+        columns = [name for name in ("doc_name", "expires_at") if name in current_table.schema.names]
+        rows = current_table.search().select(columns).limit(None).to_arrow()
+        if "expires_at" not in columns:
+            rows = rows.append_column("expires_at", pa.nulls(rows.num_rows, pa.float64()))
+        grouped = rows.group_by("doc_name").aggregate([("doc_name", "count"), ("expires_at", "max")])
+        documents : List[DocumentInfo] = [
+            {"doc_name": row["doc_name"], "chunks": row["doc_name_count"], "expires_at": row["expires_at_max"]}
+            for row in grouped.to_pylist()
+        ]
+        return sorted(documents, key=lambda document: document["doc_name"])
+
+    def set_document_expiry(self, current_table : lancedb.db.Table, filename : str, expires_at : Optional[float]):
+        """
+        Задаёт срок хранения всех чанков документа одним коммитом.
+
+        Args:
+            current_table: таблица чанков
+            filename: название документа
+            expires_at: Unix-время истечения или None - бессрочно
+        """
+        current_table.update(
+            where=f"doc_name = {self.quote_sql_string(filename)}",
+            values_sql={"expires_at": "NULL" if expires_at is None else repr(float(expires_at))}
+        )
+
+    def delete_documents(self, current_table : lancedb.db.Table, filenames : List[str]) -> int:
+        """
+        Удаляет документы целиком. Названия удаляются пакетами по DELETE_BATCH_SIZE,
+        каждый пакет - один коммит. Удалённые строки исключаются из всех индексов
+        сразу, а сами индексы дообновляются в фоне.
+
+        Args:
+            current_table: таблица чанков
+            filenames: названия документов
+
+        Returns:
+            Количество удалённых чанков
+        """
+        deleted = 0
+        for start in range(0, len(filenames), DELETE_BATCH_SIZE):
+            part = filenames[start:start + DELETE_BATCH_SIZE]
+            names = ", ".join(self.quote_sql_string(name) for name in part)
+            deleted += current_table.delete(f"doc_name IN ({names})").num_deleted_rows
+        if deleted:
+            self.logger.info(f"Из таблицы {current_table.name} удалено документов: {len(filenames)}, чанков: {deleted}")
+            self.schedule_index_maintenance(current_table)
+        return deleted
+
+    def delete_expired(self, current_table : lancedb.db.Table, now : Optional[float] = None) -> List[str]:
+        """
+        Удаляет документы с истёкшим сроком хранения.
+
+        Returns:
+            Названия удалённых документов
+        """
+        if "expires_at" not in current_table.schema.names:
+            return []
+        now = time.time() if now is None else now
+        expired = (
+            current_table.search()
+            .where(f"expires_at <= {now!r}")
+            .select(["doc_name"])
+            .limit(None)
+            .to_arrow()
+        )
+        filenames = sorted(set(expired["doc_name"].to_pylist()))
+        if filenames:
+            self.delete_documents(current_table, filenames)
+        return filenames
+
+    def get_document_rows(self, filename : str, current_table : lancedb.db.Table) -> pa.Table:
+        """
+        Возвращает все строки документа из таблицы.
+        """
+        return (
+            current_table.search()
+            .where(f"doc_name = {self.quote_sql_string(filename)}")
+            .select(current_table.schema.names)
+            .limit(None)
+            .to_arrow()
+        )
+
+    def get_document_row_ids(self, filename : str, current_table : lancedb.db.Table) -> List[int]:
+        return (
+            current_table.search()
+            .where(f"doc_name = {self.quote_sql_string(filename)}")
+            .with_row_id(True)
+            .select(["chunk_id"])
+            .limit(None)
+            .to_arrow()["_rowid"]
+            .to_pylist()
+        )
+
+    def delete_row_ids(self, filename : str, row_ids : List[int], current_table : lancedb.db.Table):
+        """
+        Удаляет строки по _rowid пакетами по DELETE_BATCH_SIZE. Ошибка оставляет
+        лишние копии чанков, но не теряет документ: они удалятся при следующей загрузке.
+        """
+        for start in range(0, len(row_ids), DELETE_BATCH_SIZE):
+            part = row_ids[start:start + DELETE_BATCH_SIZE]
+            try:
+                current_table.delete(f"_rowid IN ({', '.join(map(str, part))})")
+            except Exception as e:
+                self.logger.warning(f"Ошибка при удалении старых копий документа {filename}: {str(e)}")
+
+    def diff_document(self, filename : str, chunks: List[Document], current_table : lancedb.db.Table) -> DocumentDiff:
+        """
+        Сравнивает новые чанки документа с уже сохранёнными по chunk_id.
+
+        Args:
+            filename: название источника чанков
+            chunks: новые чанки документа
+            current_table: объект таблицы
+
+        Returns:
+            Индексы новых чанков, сохраняемые строки и количество устаревших строк
+        """
+        existing = self.get_document_rows(filename, current_table)
+        existing_ids = existing.column("chunk_id").to_pylist()
+        existing_set = set(existing_ids)
+
+        chunk_ids = set()
+        new_indices = []
         for i, chunk in enumerate(chunks):
-            chunk_text = chunk.page_content
-            chunk_preview = chunk_text[:30].replace("\n", " ") + "..."
-            self.logger.info(f"    Обработка чанка {i+1}/{len(chunks)}: '{chunk_preview}'")
+            chunk_id = self.generate_chunk_id(chunk.page_content, filename)
+            if chunk_id in chunk_ids:
+                continue
+            chunk_ids.add(chunk_id)
+            if chunk_id not in existing_set:
+                new_indices.append(i)
+
+        # Оставляем по одной строке на каждый сохраняемый chunk_id
+        kept_positions = []
+        seen = set()
+        for position, chunk_id in enumerate(existing_ids):
+            if chunk_id in chunk_ids and chunk_id not in seen:
+                seen.add(chunk_id)
+                kept_positions.append(position)
+
+        diff : DocumentDiff = {
+            "new_indices": new_indices,
+            "kept_rows": existing.take(pa.array(kept_positions, type=pa.int64())),
+            "stale_count": sum(1 for chunk_id in existing_ids if chunk_id not in chunk_ids),
+            "existing_count": len(existing_ids),
+            "has_duplicates": len(existing_ids) != len(existing_set)
+        }
+        self.logger.info(
+            f"Документ {filename}: новых чанков {len(new_indices)}, без изменений {len(kept_positions)}, устаревших {diff['stale_count']}"
+        )
+        return diff
+
+    def upsert_document(self, filename : str, chunks: List[Document], vectors : List[Optional[List[float]]], diff : DocumentDiff, current_table : lancedb.db.Table) -> FillReport:
+        """
+        Применяет результат diff_document к таблице через merge-insert по chunk_id:
+        новые чанки вставляются, устаревшие строки документа удаляются одним коммитом.
+
+        Args:
+            filename: название источника чанков
+            chunks: все чанки документа
+            vectors: векторы новых чанков в порядке diff["new_indices"]
+            diff: результат diff_document
+            current_table: объект таблицы
+
+        Returns:
+            Отчёт о добавленных, пропущенных и удалённых чанках
+        """
+        new_chunks = [(i, chunks[i]) for i in diff["new_indices"]]
+        if diff["existing_count"] == 0:
+            return self.insert_chunks(filename, new_chunks, vectors, current_table)
+
+        report : FillReport = {"inserted": 0, "skipped": diff["kept_rows"].num_rows, "deleted": 0, "failed": {}}
+        rows = self.build_chunk_rows(filename, new_chunks, vectors, report)
+        if not rows and diff["stale_count"] == 0 and not diff["has_duplicates"]:
+            self.logger.info(f"Документ {filename} не изменился, запись не требуется")
+            return report
+
+        schema = current_table.schema
+        new_rows = pa.Table.from_batches([self.make_record_batch([row for _, row in rows], schema)], schema=schema)
+        source = pa.concat_tables([diff["kept_rows"].cast(schema), new_rows])
+        doc_filter = f"doc_name = {self.quote_sql_string(filename)}"
+        try:
+            if diff["has_duplicates"]:
+                # Старые копии с одинаковым chunk_id merge-insert не уберёт, поэтому документ
+                # переписывается: сначала добавляется новая копия, затем по _rowid удаляются старые.
+                # При ошибке добавления документ остаётся прежним, читатели не видят его пропавшим
+                old_row_ids = self.get_document_row_ids(filename, current_table)
+                current_table.add(source)
+                self.delete_row_ids(filename, old_row_ids, current_table)
+                report["deleted"] = diff["existing_count"] - diff["kept_rows"].num_rows
+            else:
+                result = (
+                    current_table.merge_insert("chunk_id")
+                    .when_not_matched_insert_all()
+                    .when_not_matched_by_source_delete(doc_filter)
+                    .execute(source)
+                )
+                report["deleted"] = result.num_deleted_rows
+            report["inserted"] = len(rows)
+        except Exception as e:
+            self.logger.warning(f"Ошибка при обновлении документа {filename}: {str(e)}")
+            for i, _ in rows:
+                report["failed"][i] = str(e)
+
+        self.logger.info(
+            f"Документ {filename} обновлён: добавлено {report['inserted']}, без изменений {report['skipped']}, удалено {report['deleted']}, ошибок {len(report['failed'])}"
+        )
+        return report
+
+    def insert_chunks(self, filename : str, chunks: List[tuple[int, Document]], vectors : List[Optional[List[float]]], current_table : lancedb.db.Table) -> FillReport:
+        """
+        Добавляет чанки с готовыми векторами в таблицу пакетами pyarrow.RecordBatch.
+        Каждый пакет записывается одним коммитом, что не плодит мелкие фрагменты.
+
+        Args:
+            filename: название источника чанков
+            chunks: пары (номер чанка, чанк) для добавления
+            vectors: векторы чанков (None - эмбеддинг не был создан)
+            current_table: объект таблицы для добавления
+
+        Returns:
+            Отчёт с количеством добавленных чанков и ошибками по номерам чанков
+        """
+        report : FillReport = {"inserted": 0, "skipped": 0, "deleted": 0, "failed": {}}
+        rows = self.build_chunk_rows(filename, chunks, vectors, report)
+
+        for start in range(0, len(rows), self.max_rows_per_write):
+            part = rows[start:start + self.max_rows_per_write]
+            self.write_rows(part, current_table, report)
+
+        self.logger.info(f"В таблицу добавлено {report['inserted']} из {len(chunks)} чанков, ошибок: {len(report['failed'])}")
+        return report
+
+    def build_chunk_rows(self, filename : str, chunks: List[tuple[int, Document]], vectors : List[Optional[List[float]]], report : FillReport) -> List[tuple[int, dict]]:
+        rows = []
+        for (i, chunk), vector in zip(chunks, vectors):
             try:
-                (f"    Создание эмбеддинга...")
-                vector = self.embedding_generator.create_embedding(chunk_text)
-                chunk_id = self.generate_chunk_id(chunk_text, filename)
-                
-                chunk_data = {
-                    "text": chunk_text,
-                    "vector": vector,
-                    "doc_name": filename,
-                    "chunk_id": chunk_id
-                }
-                self.logger.info(f"    Добавление в таблицу...")
-                current_table.add([chunk_data])
-                self.logger.info(f"    Чанк {i+1} успешно обработан и добавлен в таблицу.")
+                rows.append((i, self.build_chunk_row(chunk.page_content, vector, filename, chunk.metadata.get("token_count"))))
             except Exception as e:
+                report["failed"][i] = str(e)
                 self.logger.warning(f"Ошибка при обработке чанка {i+1}: {str(e)}")
                 self.logger.warning(f"   Тип ошибки: {type(e).__name__}")
+        return rows
+
+    def build_chunk_row(self, chunk_text : str, vector : Optional[List[float]], filename : str, token_count : Optional[int] = None) -> dict:
+        if vector is None:
+            raise ValueError("Эмбеддинг для чанка не был создан")
+        if len(vector) != VECTOR_DIMENSIONS:
+            raise ValueError(f"Неверная размерность вектора: {len(vector)}, ожидается {VECTOR_DIMENSIONS}")
+        return {
+            "text": chunk_text,
+            VECTOR_COLUMN: vector,
+            "doc_name": filename,
+            "chunk_id": self.generate_chunk_id(chunk_text, filename),
+            "token_count": token_count
+        }
+
+    def write_rows(self, rows : List[tuple[int, dict]], current_table : lancedb.db.Table, report : FillReport):
+        """
+        Записывает строки одним пакетом. Если запись пакета не удалась,
+        строки записываются по одной, чтобы найти проблемные чанки.
+        """
+        if not rows:
+            return
+        schema = current_table.schema
+        try:
+            batch = self.make_record_batch([row for _, row in rows], schema)
+            current_table.add(batch)
+            report["inserted"] += len(rows)
+            return
+        except Exception as e:
+            self.logger.warning(f"Ошибка при пакетной записи {len(rows)} чанков, повтор по одному: {e}")
+
+        for i, row in rows:
+            try:
+                current_table.add(self.make_record_batch([row], schema))
+                report["inserted"] += 1
+            except Exception as e:
+                report["failed"][i] = str(e)
+                self.logger.warning(f"Ошибка при добавлении чанка {i+1}: {str(e)}")
+                self.logger.warning(f"   Тип ошибки: {type(e).__name__}")
 
     def display_search_results(self, results: pd.DataFrame):
         """
@@ -144,11 +866,12 @@ class LanceVectorDB(IVEctorDB):
             self.logger.info(f"Результат #{i+1}:")
             self.logger.info(f"   Источник: {row['doc_name']}")
             self.logger.info(f"   ID чанка: {row['chunk_id']}")
-            self.logger.info(f"   Релевантность: {row['_distance']:.4f}")
+            score = row['_relevance_score'] if '_relevance_score' in row else row['_distance']
+            self.logger.info(f"   Релевантность: {score:.4f}")
             self.logger.info(f"   Текст: {text_preview}...")
             i+=1
 
-    def search_in_table(self, query_text, limit=3):
+    def search_in_table(self, query_text, limit=3, mode : Optional[str] = None, metadata_filter : Optional[dict] = None, diversify : bool = False):
         """
         Поиск в таблице LanceDB по текстовому запросу.
         
@@ -161,21 +884,25 @@ class LanceVectorDB(IVEctorDB):
             query_text (str): Текстовый запрос
             table: Таблица LanceDB для поиска
             limit (int): Количество результатов
+            mode (str): "vector" или "hybrid" (по умолчанию - search_mode)
+            metadata_filter (dict): фильтр по метаданным (см. build_filter)
+            diversify (bool): убрать почти одинаковые чанки методом MMR
             
         Returns:
             pandas.DataFrame: Результаты поиска
         """
         self.logger.info(f"Обрабатываем запрос: '{query_text}'")
+        where = self.build_filter(metadata_filter)
         
         try:
             # Создаем эмбеддинг для запроса
             self.logger.info("Создаем эмбеддинг для запроса...")
-            query_embedding = self.embedding_generator.create_embedding(query_text)
+            query_embedding = self.embed_query(query_text)
             self.logger.info(f"Эмбеддинг создан, размерность: {len(query_embedding)}")
             
             # Выполняем векторный поиск по эмбеддингу
             self.logger.info(f"Ищем {limit} наиболее релевантных чанков...")
-            results = self.current_table.search(query_embedding).limit(limit).to_pandas()
+            results = self.search_table(self.current_table, query_text, query_embedding, limit, where, mode, diversify)
             
             self.logger.info(f"Найдено {len(results)} результатов")
             return results
@@ -183,3 +910,354 @@ class LanceVectorDB(IVEctorDB):
         except Exception as e:
             self.logger.warning(f"Ошибка при поиске, Trace: {e}")
             raise
+
+    def search_table(
+        self,
+        current_table : lancedb.db.Table,
+        query_text : str,
+        query_vector : List[float],
+        limit : int,
+        where : Optional[str] = None,
+        mode : Optional[str] = None,
+        diversify : bool = False
+    ) -> pd.DataFrame:
+        """
+        Поиск чанков в выбранном режиме с необязательным выбором разнообразных результатов.
+
+        Args:
+            current_table: таблица для поиска
+            query_text: текст запроса
+            query_vector: эмбеддинг запроса
+            limit: количество результатов
+            where: SQL-условие предварительной фильтрации (см. build_filter)
+            mode: "vector" или "hybrid" (по умолчанию - search_mode)
+            diversify: отобрать больше кандидатов и выбрать из них limit разнообразных (MMR)
+
+        Returns:
+            DataFrame с результатами
+        """
+        candidates = limit * MMR_FETCH_FACTOR if diversify else limit
+        if (mode or self.search_mode) == "hybrid":
+            results = self.hybrid_search(current_table, query_text, query_vector, candidates, where)
+        else:
+            results = self.search_vectors(current_table, query_vector, candidates, where)
+        if diversify:
+            results = self.diversify(results, query_vector, limit)
+        return results
+
+    def diversify(self, results : pd.DataFrame, query_vector : List[float], limit : int) -> pd.DataFrame:
+        """
+        Оставляет limit результатов, выбранных методом MMR: соседние чанки с
+        перекрывающимся текстом почти совпадают по эмбеддингу и вытесняют друг друга.
+        """
+        if len(results) <= limit:
+            return results
+        vectors = np.stack(results[VECTOR_COLUMN].to_numpy()).astype(np.float32)
+        selected = mmr_select(np.asarray(query_vector, dtype=np.float32), vectors, limit, self.mmr_lambda)
+        self.logger.info(f"MMR: выбрано {len(selected)} из {len(results)} кандидатов")
+        return results.iloc[selected].reset_index(drop=True)
+
+    def search_vectors(self, current_table : lancedb.db.Table, query_vector : List[float], limit : int, where : Optional[str] = None, in_memory : bool = True) -> pd.DataFrame:
+        """
+        Векторный поиск ближайших чанков.
+
+        Небольшие таблицы без фильтра ищутся точным перебором в памяти.
+        Если в таблице есть короткие векторы, поиск двухэтапный: кандидаты
+        отбираются по короткому вектору, затем пересчитываются по полному
+        и сортируются по точному расстоянию (L2, как у LanceDB).
+
+        Args:
+            current_table: таблица для поиска
+            query_vector: эмбеддинг запроса
+            limit: количество результатов
+            where: SQL-условие предварительной фильтрации (см. build_filter)
+            in_memory: разрешить поиск в памяти (False - всегда через LanceDB)
+
+        Returns:
+            DataFrame с результатами и колонкой _distance
+        """
+        if self.memory_index is not None and in_memory and not where:
+            results = self.memory_index.search(current_table, query_vector, limit)
+            if results is not None:
+                return results
+
+        schema = current_table.schema
+        if PREFIX_VECTOR_COLUMN not in schema.names:
+            return self.vector_query(current_table, query_vector, VECTOR_COLUMN, where).limit(limit).to_pandas()
+
+        query = np.asarray([query_vector], dtype=np.float32)
+        short_query = prefix_vectors(query, schema.field(PREFIX_VECTOR_COLUMN).type.list_size)[0]
+        candidates = (
+            self.vector_query(current_table, short_query, PREFIX_VECTOR_COLUMN, where)
+            .limit(limit * self.rescore_factor)
+            .to_pandas()
+            .drop(columns=[PREFIX_VECTOR_COLUMN])
+        )
+        if candidates.empty:
+            return candidates
+        full_vectors = np.stack(candidates[VECTOR_COLUMN].to_numpy()).astype(np.float32)
+        candidates["_distance"] = ((full_vectors - query) ** 2).sum(axis=1)
+        return candidates.sort_values("_distance").head(limit).reset_index(drop=True)
+
+    def embed_query(self, query_text : str) -> List[float]:
+        if self.query_cache is None:
+            return self.embedding_generator.create_embedding(query_text)
+        return self.query_cache.get_or_create(query_text, self.embedding_generator.create_embedding)
+
+    def build_filter(self, metadata_filter : Optional[dict]) -> Optional[str]:
+        """
+        Переводит фильтр по метаданным в SQL-условие LanceDB.
+
+        Значение ключа - число/строка (равенство), список (IN) или словарь
+        операторов $eq, $ne, $gt, $gte, $lt, $lte, $in. Условия объединяются через AND.
+
+        Args:
+            metadata_filter: фильтр, например {"doc_name": "report.pdf", "token_count": {"$lte": 500}}
+
+        Returns:
+            SQL-условие или None для пустого фильтра
+
+        Raises:
+            ValueError: неизвестный ключ, оператор или значение неверного типа
+        """
+        if not metadata_filter:
+            return None
+        if not isinstance(metadata_filter, dict):
+            raise ValueError("Фильтр должен быть словарём {колонка: значение}")
+        conditions = []
+        for key, value in metadata_filter.items():
+            column = FILTER_ALIASES.get(key, key)
+            if column not in FILTER_COLUMNS:
+                raise ValueError(f"Недопустимый ключ фильтра: {key}. Допустимые ключи: {', '.join(FILTER_COLUMNS)}")
+            if isinstance(value, dict):
+                for operator, operand in value.items():
+                    if operator == "$in":
+                        conditions.append(self.filter_in(column, operand))
+                    elif operator in FILTER_OPERATORS:
+                        conditions.append(f"{column} {FILTER_OPERATORS[operator]} {self.filter_literal(column, operand)}")
+                    else:
+                        raise ValueError(f"Недопустимый оператор фильтра: {operator}. Допустимые операторы: {', '.join([*FILTER_OPERATORS, '$in'])}")
+            elif isinstance(value, list):
+                conditions.append(self.filter_in(column, value))
+            else:
+                conditions.append(f"{column} = {self.filter_literal(column, value)}")
+        return " AND ".join(conditions)
+
+    def filter_in(self, column : str, values) -> str:
+        if not isinstance(values, list) or not values:
+            raise ValueError(f"Для {column} ожидается непустой список значений")
+        return f"{column} IN ({', '.join(self.filter_literal(column, value) for value in values)})"
+
+    def filter_literal(self, column : str, value) -> str:
+        expected = FILTER_COLUMNS[column]
+        if expected is int and isinstance(value, int) and not isinstance(value, bool):
+            return str(value)
+        if expected is str and isinstance(value, str):
+            return self.quote_sql_string(value)
+        raise ValueError(f"Неверное значение для {column}: {value!r}, ожидается {'число' if expected is int else 'строка'}")
+
+    def search_text(self, current_table : lancedb.db.Table, query_text : str, limit : int, where : Optional[str] = None) -> pd.DataFrame:
+        """
+        Полнотекстовый поиск BM25. Без полнотекстового индекса или при ошибке
+        разбора запроса возвращает пустой результат.
+        """
+        try:
+            query = current_table.search(query_text, query_type="fts")
+            if where:
+                query = query.where(where, prefilter=True)
+            return query.limit(limit).to_pandas()
+        except Exception as e:
+            self.logger.warning(f"Полнотекстовый поиск недоступен, используются только векторы: {e}")
+            return pd.DataFrame()
+
+    def hybrid_search(self, current_table : lancedb.db.Table, query_text : str, query_vector : List[float], limit : int, where : Optional[str] = None) -> pd.DataFrame:
+        """
+        Гибридный поиск: полнотекстовый (BM25) и векторный выполняются параллельно,
+        ранжирования объединяются методом Reciprocal Rank Fusion.
+
+        Args:
+            current_table: таблица для поиска
+            query_text: текст запроса
+            query_vector: эмбеддинг запроса
+            limit: количество результатов
+            where: SQL-условие предварительной фильтрации (см. build_filter)
+
+        Returns:
+            DataFrame с результатами и колонкой _relevance_score
+        """
+        candidates = limit * HYBRID_CANDIDATE_FACTOR
+        text_future = self.search_executor.submit(self.search_text, current_table, query_text, candidates, where)
+        vector_results = self.search_vectors(current_table, query_vector, candidates, where)
+        return self.fuse_rankings([vector_results, text_future.result()], limit)
+
+    def fuse_rankings(self, rankings : List[pd.DataFrame], limit : int) -> pd.DataFrame:
+        """
+        Объединяет несколько ранжирований чанков по формуле RRF.
+        """
+        scores : Dict[str, float] = {}
+        rows : Dict[str, dict] = {}
+        for ranking in rankings:
+            for rank, row in enumerate(ranking.to_dict("records")):
+                chunk_id = row["chunk_id"]
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+                rows.setdefault(chunk_id, row)
+        best = sorted(scores, key=scores.get, reverse=True)[:limit]
+        return pd.DataFrame([{**rows[chunk_id], "_relevance_score": scores[chunk_id]} for chunk_id in best])
+
+    def vector_query(self, current_table : lancedb.db.Table, query_vector, column : str, where : Optional[str] = None):
+        """
+        Векторный запрос с настройками индекса (nprobes, refine_factor) и предварительной фильтрацией.
+        """
+        query = current_table.search(query_vector, vector_column_name=column)
+        if where:
+            query = query.where(where, prefilter=True)
+        if self.nprobes is not None:
+            query = query.nprobes(self.nprobes)
+        if self.refine_factor is not None:
+            query = query.refine_factor(self.refine_factor)
+        return query
+
+    def index_column(self, current_table : lancedb.db.Table) -> str:
+        # При двухэтапном поиске ANN нужен только первому этапу
+        if PREFIX_VECTOR_COLUMN in current_table.schema.names:
+            return PREFIX_VECTOR_COLUMN
+        return VECTOR_COLUMN
+
+    def get_index_state(self, current_table : lancedb.db.Table, column : Optional[str] = None) -> IndexState:
+        """
+        Возвращает состояние индекса колонки (по умолчанию - векторной колонки поиска).
+        """
+        column = column or self.index_column(current_table)
+        rows = current_table.count_rows()
+        state : IndexState = {"column": column, "index_type": None, "rows": rows, "indexed_rows": 0, "unindexed_rows": rows}
+        for index in current_table.list_indices():
+            if list(index.columns) != [column]:
+                continue
+            stats = current_table.index_stats(index.name)
+            if stats is None:
+                continue
+            state["index_type"] = stats.index_type
+            state["indexed_rows"] = stats.num_indexed_rows
+            state["unindexed_rows"] = stats.num_unindexed_rows
+        return state
+
+    def log_index_state(self, state : IndexState):
+        self.logger.info(
+            f"Индекс {state['index_type'] or 'отсутствует'} по колонке {state['column']}: строк {state['rows']}, "
+            f"в индексе {state['indexed_rows']}, вне индекса {state['unindexed_rows']}"
+        )
+
+    def make_index_config(self):
+        if self.index_type == "IVF_HNSW_SQ":
+            return HnswSq(distance_type="l2")
+        return IvfPq(distance_type="l2")
+
+    def ensure_column_index(self, current_table : lancedb.db.Table, column : str, config) -> IndexState:
+        """
+        Строит индекс колонки и перестраивает его, когда вне индекса
+        накапливается больше reindex_ratio строк.
+        """
+        state = self.get_index_state(current_table, column)
+        if state["rows"] == 0:
+            return state
+        if state["index_type"] is not None and state["unindexed_rows"] <= state["indexed_rows"] * self.reindex_ratio:
+            return state
+        started = time.perf_counter()
+        current_table.create_index(column, config=config, replace=True)
+        self.logger.info(f"Индекс {type(config).__name__} по колонке {column} построен за {time.perf_counter() - started:.1f} с")
+        state = self.get_index_state(current_table, column)
+        self.log_index_state(state)
+        return state
+
+    def ensure_fts_index(self, current_table : lancedb.db.Table) -> IndexState:
+        """
+        Поддерживает полнотекстовый индекс по тексту чанков.
+        """
+        return self.ensure_column_index(current_table, TEXT_COLUMN, FTS(language=FTS_LANGUAGE))
+
+    def ensure_scalar_indexes(self, current_table : lancedb.db.Table):
+        """
+        Поддерживает скалярные индексы колонок метаданных, присутствующих в таблице.
+        """
+        names = current_table.schema.names
+        for column, index_type in SCALAR_INDEXES.items():
+            if column not in names:
+                continue
+            current_type = self.get_index_state(current_table, column)["index_type"]
+            if current_type is not None and current_type.upper() != index_type:
+                self.drop_column_indexes(current_table, column)
+            self.ensure_column_index(current_table, column, Bitmap() if index_type == "BITMAP" else BTree())
+
+    def drop_column_indexes(self, current_table : lancedb.db.Table, column : str):
+        """
+        Удаляет индексы колонки, чтобы перестроить их другим типом:
+        create_index(replace=True) не заменяет индекс другого типа, а добавляет второй.
+        """
+        for index in current_table.list_indices():
+            if list(index.columns) == [column]:
+                current_table.drop_index(index.name)
+                self.logger.info(f"Индекс {index.name} по колонке {column} удален для смены типа")
+
+    def ensure_index(self, current_table : lancedb.db.Table) -> IndexState:
+        """
+        Обслуживает индексы таблицы: полнотекстовый и скалярные индексы поддерживаются всегда,
+        векторный строится, когда таблица достигает index_min_rows строк,
+        и переобучается, когда вне индекса накапливается больше reindex_ratio строк.
+
+        Args:
+            current_table: таблица чанков
+
+        Returns:
+            Состояние векторного индекса после обслуживания
+        """
+        with self.index_lock:
+            return self.maintain_indexes(current_table)
+
+    def maintain_indexes(self, current_table : lancedb.db.Table) -> IndexState:
+        self.ensure_fts_index(current_table)
+        self.ensure_scalar_indexes(current_table)
+        state = self.get_index_state(current_table)
+        if state["rows"] < self.index_min_rows:
+            return state
+        if state["index_type"] is None:
+            action = "Построение"
+        elif state["unindexed_rows"] > state["indexed_rows"] * self.reindex_ratio:
+            action = "Переобучение"
+        else:
+            return state
+
+        self.logger.info(f"{action} индекса {self.index_type} по колонке {state['column']} ({state['rows']} строк)...")
+        started = time.perf_counter()
+        current_table.create_index(state["column"], config=self.make_index_config(), replace=True)
+        self.logger.info(f"{action} индекса завершено за {time.perf_counter() - started:.1f} с")
+        state = self.get_index_state(current_table)
+        self.log_index_state(state)
+        return state
+
+    def schedule_index_maintenance(self, current_table : lancedb.db.Table) -> Optional[Future]:
+        """
+        Запускает ensure_index в фоновом потоке. Если обслуживание уже идёт,
+        повторная проверка выполняется сразу после его завершения.
+        """
+        if self.index_future is not None and not self.index_future.done():
+            self.index_recheck_tables[current_table.name] = current_table
+            return None
+        self.index_future = self.index_executor.submit(self.ensure_index, current_table)
+        self.index_future.add_done_callback(self.on_index_maintenance_done)
+        return self.index_future
+
+    def on_index_maintenance_done(self, future : Future):
+        if not future.cancelled() and future.exception() is not None:
+            self.logger.warning(f"Ошибка при обслуживании векторного индекса: {future.exception()}")
+        if self.index_recheck_tables:
+            current_table = self.index_recheck_tables.pop(next(iter(self.index_recheck_tables)))
+            try:
+                self.index_future = self.index_executor.submit(self.ensure_index, current_table)
+                self.index_future.add_done_callback(self.on_index_maintenance_done)
+            except RuntimeError:
+                # Пул уже остановлен
+                pass
+
+    def close(self):
+        self.index_executor.shutdown(wait=True, cancel_futures=True)
+        self.search_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,182 @@
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import lancedb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from bot.packages.i_classes.i_logger import ILogger
+
+# Таблицы до такого количества строк ищутся в памяти точным перебором
+MEMORY_SEARCH_MAX_ROWS = 5000
+# Сколько новых строк догружается одним запросом при обновлении
+FETCH_BATCH_SIZE = 500
+# Общий объём снимков всех таблиц в памяти; давно не использованные снимки вытесняются
+MEMORY_SEARCH_MAX_BYTES = 256 * 2**20
+
+class TableSnapshot():
+    """
+    Векторы и метаданные одной версии таблицы в памяти.
+    """
+
+    def __init__(self, version : int, columns : Dict[str, np.ndarray], matrix : np.ndarray, result_columns : List[str]):
+        self.version = version
+        # Колонки таблицы, кроме векторных
+        self.columns = columns
+        self.matrix = matrix
+        # Порядок колонок результата, как у векторного поиска LanceDB
+        self.result_columns = result_columns
+        # Квадраты норм строк: L2 расстояние считается одним умножением матрицы на вектор
+        self.squared_norms = np.einsum("ij,ij->i", matrix, matrix)
+        self.nbytes = matrix.nbytes + self.squared_norms.nbytes + sum(
+            values.nbytes + (sum(sys.getsizeof(value) for value in values) if values.dtype == object else 0)
+            for values in columns.values()
+        )
+
+class InMemoryVectorIndex():
+    """
+    Точный векторный поиск по небольшим таблицам без обращения к LanceDB.
+
+    Векторы таблицы хранятся в памяти матрицей float32. Запрос - одно умножение
+    матрицы на вектор и argpartition. При смене версии таблицы из неё читаются
+    только chunk_id, удалённые строки убираются из матрицы, а новые догружаются.
+    Суммарный размер снимков ограничен max_bytes: при превышении вытесняются
+    снимки таблиц, по которым дольше всего не искали.
+    """
+
+    def __init__(
+        self,
+        logger : ILogger,
+        max_rows : int = MEMORY_SEARCH_MAX_ROWS,
+        vector_column : str = "vector",
+        max_bytes : int = MEMORY_SEARCH_MAX_BYTES
+    ):
+        self.logger = logger
+        self.max_rows = max_rows
+        self.vector_column = vector_column
+        self.max_bytes = max_bytes
+        # Путь таблицы -> снимок, в порядке последнего использования
+        self.snapshots : OrderedDict[str, TableSnapshot] = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def search(self, current_table : lancedb.db.Table, query_vector : List[float], limit : int) -> Optional[pd.DataFrame]:
+        """
+        Ищет ближайшие по L2 чанки, как векторный поиск LanceDB без индекса.
+
+        Args:
+            current_table: таблица для поиска
+            query_vector: эмбеддинг запроса
+            limit: количество результатов
+
+        Returns:
+            DataFrame с колонками таблицы и _distance или None, если таблица слишком большая
+        """
+        snapshot = self.get_snapshot(current_table)
+        if snapshot is None:
+            return None
+        query = np.asarray(query_vector, dtype=np.float32)
+        distances = snapshot.squared_norms - 2 * (snapshot.matrix @ query) + query @ query
+        count = min(limit, len(distances))
+        top = np.argpartition(distances, count - 1)[:count] if count > 0 else np.zeros(0, dtype=np.int64)
+        top = top[np.argsort(distances[top])]
+        # DataFrame собирается один раз из готовых колонок: поэлементная сборка дороже самого поиска
+        results = {name: values[top] for name, values in snapshot.columns.items()}
+        results[self.vector_column] = list(snapshot.matrix[top])
+        results["_distance"] = distances[top]
+        return pd.DataFrame(results, columns=snapshot.result_columns)
+
+    def get_snapshot(self, current_table : lancedb.db.Table) -> Optional[TableSnapshot]:
+        key = current_table.uri
+        version = current_table.version
+        with self.lock:
+            snapshot = self.snapshots.get(key)
+            if snapshot is not None and snapshot.version == version:
+                self.snapshots.move_to_end(key)
+                return snapshot
+            rows = current_table.count_rows()
+            if rows > self.max_rows:
+                if self.remove(key) is not None:
+                    self.logger.info(f"Таблица {current_table.name} выросла до {rows} строк, поиск в памяти отключён")
+                return None
+            snapshot = self.refresh(current_table, snapshot, version, rows)
+            self.remove(key)
+            self.snapshots[key] = snapshot
+            self.total_bytes += snapshot.nbytes
+            self.evict(keep=key)
+            return snapshot
+
+    def remove(self, key : str) -> Optional[TableSnapshot]:
+        snapshot = self.snapshots.pop(key, None)
+        if snapshot is not None:
+            self.total_bytes -= snapshot.nbytes
+        return snapshot
+
+    def evict(self, keep : str):
+        """
+        Вытесняет давно не использованные снимки, пока общий размер больше max_bytes.
+        """
+        while self.total_bytes > self.max_bytes and len(self.snapshots) > 1:
+            key = next(iter(self.snapshots))
+            if key == keep:
+                break
+            snapshot = self.remove(key)
+            self.logger.info(f"Снимок таблицы {key} вытеснен из памяти ({snapshot.nbytes / 2**20:.1f} МБ)")
+
+    def refresh(self, current_table : lancedb.db.Table, snapshot : Optional[TableSnapshot], version : int, rows : int) -> TableSnapshot:
+        """
+        Строит снимок новой версии таблицы на основе предыдущего.
+        """
+        schema = current_table.schema
+        columns = [field.name for field in schema if not pa.types.is_fixed_size_list(field.type)]
+        # Схема без коротких векторов и с _distance
+        result_columns = [field.name for field in schema if field.name in columns or field.name == self.vector_column] + ["_distance"]
+        # После миграции схемы снимок собирается заново
+        if snapshot is None or rows == 0 or list(snapshot.columns) != columns:
+            data = current_table.search().select([*columns, self.vector_column]).limit(max(rows, 1)).to_arrow()
+            snapshot = TableSnapshot(version, self.to_columns(data, columns), self.to_matrix(data), result_columns)
+            self.logger.info(f"Векторы таблицы {current_table.name} загружены в память: {len(snapshot.matrix)} строк")
+            return snapshot
+
+        ids = current_table.search().select(["chunk_id"]).limit(rows).to_arrow()["chunk_id"].to_pylist()
+        current_ids = set(ids)
+        known_ids = snapshot.columns["chunk_id"]
+        keep = np.fromiter((chunk_id in current_ids for chunk_id in known_ids), dtype=bool, count=len(known_ids))
+        new_ids = list(current_ids - set(known_ids))
+        parts = [{name: values[keep] for name, values in snapshot.columns.items()}]
+        matrices = [snapshot.matrix[keep]]
+        for start in range(0, len(new_ids), FETCH_BATCH_SIZE):
+            batch = new_ids[start:start + FETCH_BATCH_SIZE]
+            quoted = ", ".join("'" + chunk_id.replace("'", "''") + "'" for chunk_id in batch)
+            data = (
+                current_table.search()
+                .where(f"chunk_id IN ({quoted})")
+                .select([*columns, self.vector_column])
+                .limit(len(batch))
+                .to_arrow()
+            )
+            parts.append(self.to_columns(data, columns))
+            matrices.append(self.to_matrix(data))
+        snapshot = TableSnapshot(
+            version,
+            {name: np.concatenate([part[name] for part in parts]) for name in columns},
+            np.concatenate(matrices),
+            result_columns
+        )
+        self.logger.info(
+            f"Векторы таблицы {current_table.name} в памяти обновлены: удалено {int((~keep).sum())}, "
+            f"добавлено {len(new_ids)}, всего {len(snapshot.matrix)}"
+        )
+        return snapshot
+
+    def to_columns(self, data : pa.Table, columns : List[str]) -> Dict[str, np.ndarray]:
+        return {name: data[name].to_numpy(zero_copy_only=False) for name in columns}
+
+    def to_matrix(self, data : pa.Table) -> np.ndarray:
+        column = data[self.vector_column].combine_chunks()
+        dimensions = data.schema.field(self.vector_column).type.list_size
+        values = column.flatten().to_numpy(zero_copy_only=False)
+        return values.reshape(-1, dimensions).astype(np.float32)
@@ -8,21 +8,52 @@ from langchain_openai import ChatOpenAI
 # Импорт компонентов для работы с векторным хранилищем
 from langchain_community.vectorstores import LanceDB
 from langchain_openai import OpenAIEmbeddings
+from langchain_core.embeddings import Embeddings
 
 # Импорт компонентов LangGraph
 from langgraph.graph import StateGraph, START
 from langgraph.graph.message import add_messages
-from typing import Annotated, Optional, Sequence, TypedDict, List, Dict, Any
+from typing import Annotated, Optional, Sequence, TypedDict, List, Dict, Any, Tuple
 
 import os
 from bot.packages.my_logger import ILogger
+from bot.packages.lance_vector_db import LanceVectorDB, build_schema
+from bot.packages.answer_cache import SemanticAnswerCache
+from bot.packages.table_registry import LanceTableRegistry, DEFAULT_TABLE_NAME, chat_table_name
+from langchain_core.documents import Document
 
 # Инструменты для ReAct агента
-from langchain_core.tools import Tool
+from langchain_core.tools import Tool, StructuredTool
 
 import json
+import re
+from collections import OrderedDict
+import threading
 import pyarrow as pa
 
+# Модели для выбора инструментов и ответа и для анализа документов
+AGENT_MODEL = "gpt-4o-mini"
+AGENT_TEMPERATURE = 0.2
+ANALYSIS_TEMPERATURE = 0
+
+# Маршруты запроса: сразу поиск и один вызов модели или полный ReAct граф
+FAST_ROUTE = "fast"
+AGENT_ROUTE = "agent"
+# Признаки запросов, которым нужен выбор инструмента или фильтр по метаданным:
+# ссылка, имя файла, название в кавычках, упоминание конкретного документа или источника
+AGENT_ROUTE_PATTERNS = [
+    re.compile(r"https?://|www\."),
+    re.compile(r"\b[\w\-]+\.(txt|pdf|docx?|md|html?)\b", re.IGNORECASE),
+    re.compile(r"[\"«“'][^\"»”']{3,}[\"»”']"),
+    re.compile(r"\b(документ|файл|источник|ссылк|сайт|статья|стать[еию])\w*", re.IGNORECASE),
+    re.compile(r"\b(document|file|source|link|article)s?\b", re.IGNORECASE),
+    re.compile(r"\b(сравн|проанализир|анализ)\w*", re.IGNORECASE),
+]
+# Длинные составные вопросы тоже отправляются в граф
+FAST_ROUTE_MAX_WORDS = 40
+# Сколько коллекций чатов держать подключёнными вместе с их кэшами ответов
+MAX_CHAT_ROUTES = 128
+
 class SearchAgentState(TypedDict):
     """
     Состояние поискового агента на основе ReAct.
@@ -36,10 +67,82 @@ class SearchAgentState(TypedDict):
     # История поисковых запросов
     search_history: List[str]
 
+class SharedTableLanceDB(LanceDB):
+    """
+    Векторное хранилище LangChain поверх общего реестра таблиц.
+
+    Стандартный LanceDB заново открывает таблицу при каждом поиске, этот класс
+    берёт уже открытый объект таблицы из LanceTableRegistry. Кроме основной
+    таблицы (коллекции чата) поиск может охватывать общие коллекции.
+    """
+
+    def __init__(self, registry : LanceTableRegistry, table_name : str, embedding : Embeddings, shared_tables : Sequence[str] = ()):
+        self.registry = registry
+        self.table_name = table_name
+        self.shared_tables = [name for name in shared_tables if name != table_name]
+        table = registry.get_table(table_name)
+        super().__init__(connection=registry.get_connection(), table_name=table_name, embedding=embedding, table=table)
+
+    def get_table(self, name : Optional[str] = None, set_default : Optional[bool] = False) -> Any:
+        if name is not None and set_default:
+            self._table_name = name
+        return self.registry.get_table(name or self._table_name)
+
+    def get_tables(self) -> List[Any]:
+        """
+        Таблицы, по которым выполняется поиск: основная и общие.
+        """
+        return [self.get_table(), *(self.registry.get_table(name) for name in self.shared_tables)]
+
 class RAGAgent():
 
-    def __init__(self, logger : ILogger):
+    def __init__(
+        self,
+        logger : ILogger,
+        schema : Optional[pa.Schema] = None,
+        lance_db : Optional[LanceVectorDB] = None,
+        search_mode : str = "vector",
+        embeddings : Optional[Embeddings] = None,
+        table_registry : Optional[LanceTableRegistry] = None,
+        diversify : bool = False,
+        fast_path : bool = True
+    ):
         self.logger = logger
+        # Эмбеддинги запросов; должны совпадать с моделью, которой создавались эмбеддинги чанков
+        self.embeddings = embeddings
+        # Схема для создания отсутствующей таблицы, должна совпадать со схемой LanceVectorDB
+        self.schema = schema if schema is not None else build_schema()
+        # Гибридный поиск (полнотекстовый + векторный) выполняется через LanceVectorDB
+        self.lance_db = lance_db
+        self.search_mode = search_mode
+        # Общий с загрузкой реестр таблиц; без него подключение открывается отдельно
+        self.table_registry = table_registry
+        # Выбирать разнообразные чанки (MMR), если модель не указала diverse явно
+        self.diversify = diversify
+        # Простые запросы отвечаются без анализа запроса и выбора инструмента
+        self.fast_path = fast_path
+        # Клиенты моделей создаются при первом запросе и переиспользуются
+        self.agent_model : Optional[ChatOpenAI] = None
+        self.analysis_model : Optional[ChatOpenAI] = None
+        # Хранилище -> скомпилированный граф агента. Инструменты графа ссылаются на хранилище,
+        # поэтому запись удаляется явно через release_search_graph при закрытии маршрута
+        self.search_graphs : Dict[LanceDB, Any] = {}
+        self.lock = threading.Lock()
+
+    def get_agent_model(self) -> ChatOpenAI:
+        """
+        Общий клиент модели для узлов графа: одно HTTP-соединение на все запросы.
+        """
+        with self.lock:
+            if self.agent_model is None:
+                self.agent_model = ChatOpenAI(model=AGENT_MODEL, temperature=AGENT_TEMPERATURE)
+            return self.agent_model
+
+    def get_analysis_model(self) -> ChatOpenAI:
+        with self.lock:
+            if self.analysis_model is None:
+                self.analysis_model = ChatOpenAI(model=AGENT_MODEL, temperature=ANALYSIS_TEMPERATURE)
+            return self.analysis_model
 
     def create_empty_state(self) -> SearchAgentState:
         """
@@ -65,6 +168,9 @@ class RAGAgent():
         """
         self.logger.info(f"Подключение к базе данных LanceDB по пути: {db_path}")
 
+        if self.table_registry is not None:
+            return self.connect_to_registry(table_name)
+
         try:
             # Пытаемся импортировать lancedb
             import lancedb
@@ -82,13 +188,7 @@ class RAGAgent():
                 self.logger.warning(f"Таблица {table_name} не найдена. Доступные таблицы: {table_names}")
 
                 try:
-                    schema = pa.schema([
-                        pa.field("text", pa.string()),
-                        pa.field("vector", pa.list_(pa.float32(), 1536)),
-                        pa.field("doc_name", pa.string()),
-                        pa.field("chunk_id", pa.string())
-                    ])
-                    db.create_table(table_name, schema=schema)
+                    db.create_table(table_name, schema=self.schema)
                     self.logger.info(f"Создана новая таблица: {table_name}")
                 except Exception as e:
                     self.logger.error(f"Ошибка при создании таблицы {table_name}: {e}")
@@ -102,7 +202,7 @@ class RAGAgent():
             self.logger.info(f"Количество документов в базе: {table.count_rows()}")
 
             # Создаем модель эмбеддингов
-            embeddings = OpenAIEmbeddings()
+            embeddings = self.embeddings if self.embeddings is not None else OpenAIEmbeddings()
             
             # Создаем экземпляр LanceDB для LangChain
             vector_store = LanceDB(
@@ -119,7 +219,25 @@ class RAGAgent():
             self.logger.critical(f"Ошибка при подключении к базе данных: {str(e)}")
             return None
 
-    def raw_search_documents(self, query : str, vector_store : LanceDB, k=3):
+    def connect_to_registry(self, table_name="from_txt", shared_tables : Sequence[str] = ()) -> Optional[LanceDB]:
+        """
+        Подключение к таблице из общего реестра: загрузка и поиск работают с одним
+        объектом таблицы, новые строки видны без переподключения.
+
+        Args:
+            table_name: основная таблица (коллекция чата)
+            shared_tables: общие коллекции, результаты которых объединяются с основной
+        """
+        try:
+            embeddings = self.embeddings if self.embeddings is not None else OpenAIEmbeddings()
+            vector_store = SharedTableLanceDB(self.table_registry, table_name, embeddings, shared_tables)
+            self.logger.info(f"Успешное подключение к таблице: {table_name}")
+            return vector_store
+        except Exception as e:
+            self.logger.critical(f"Ошибка при подключении к базе данных: {str(e)}")
+            return None
+
+    def raw_search_documents(self, query : str, vector_store : LanceDB, k=3, diverse : Optional[bool] = None):
         """
         Чистая функция поиска документов без зависимостей от инструментов LangChain.
         Эта функция предотвращает конфликты между объектом vector_store и системой обратных вызовов.
@@ -128,13 +246,21 @@ class RAGAgent():
             query (str): Текстовый запрос для поиска
             vector_store: Векторное хранилище LanceDB для поиска (LanceDB)
             k (int): Количество документов для возврата
+            diverse (bool): исключить почти одинаковые чанки методом MMR (по умолчанию - настройка агента)
         
         Returns:
             str: Отформатированная строка с найденными документами и их метаданными
         """
+        if diverse is None:
+            diverse = self.diversify
         try:
+            if self.lance_db is not None and (self.search_mode == "hybrid" or diverse or len(self.get_search_tables(vector_store)) > 1):
+                results = self.lance_search_documents(query, vector_store, k, diverse=diverse)
+            elif diverse:
+                results = vector_store.max_marginal_relevance_search(query, k=k)
+            else:
                 # Выполнение поиска через LangChain API - семантический поиск по векторам
-            results = vector_store.similarity_search(query, k=k)
+                results = vector_store.similarity_search(query, k=k)
             
             # Форматирование результатов в читаемый вид
             output = f'По запросу "{query}" найдено {len(results)} документов:\n\n'
@@ -149,6 +275,30 @@ class RAGAgent():
         except Exception as e:
             return f"Ошибка при выполнении поиска: {str(e)}"
 
+    def lance_search_documents(self, query : str, vector_store : LanceDB, k=3, where : Optional[str] = None, diverse : bool = False) -> List[Document]:
+        """
+        Поиск по таблице векторного хранилища через LanceVectorDB с предварительной
+        фильтрацией. В гибридном режиме BM25 по тексту и векторный поиск
+        выполняются параллельно и объединяются методом RRF. С diverse из
+        увеличенного набора кандидатов выбираются k разнообразных методом MMR.
+        Результаты коллекции чата и общей коллекции также объединяются методом RRF.
+        """
+        query_vector = vector_store.embeddings.embed_query(query)
+        rankings = [
+            self.lance_db.search_table(table, query, query_vector, k, where, self.search_mode, diverse)
+            for table in self.get_search_tables(vector_store)
+        ]
+        results = rankings[0] if len(rankings) == 1 else self.lance_db.fuse_rankings(rankings, k)
+        return [
+            Document(page_content=row["text"], metadata={"doc_name": row["doc_name"]})
+            for row in results.to_dict("records")
+        ]
+
+    def get_search_tables(self, vector_store : LanceDB) -> List[Any]:
+        if isinstance(vector_store, SharedTableLanceDB):
+            return vector_store.get_tables()
+        return [vector_store.get_table()]
+
     def raw_search_with_filter(self, query, metadata_filter, vector_store : LanceDB, k=3):
         """
         Чистая функция поиска документов с применением фильтра по метаданным.
@@ -164,11 +314,18 @@ class RAGAgent():
             str: Отформатированная строка с найденными документами и их метаданными
         """
         try:
-            results = vector_store.similarity_search(
-                query=query, 
-                k=k,
-                filter=metadata_filter
-            )
+            if self.lance_db is not None:
+                try:
+                    where = self.lance_db.build_filter(metadata_filter)
+                except ValueError as e:
+                    return f"Недопустимый фильтр {metadata_filter}: {str(e)}"
+                results = self.lance_search_documents(query, vector_store, k, where, self.diversify)
+            else:
+                results = vector_store.similarity_search(
+                    query=query, 
+                    k=k,
+                    filter=metadata_filter
+                )
             
             # Форматирование результатов в читаемый вид
             output = f'По запросу "{query}" с фильтром {metadata_filter} найдено {len(results)} документов:\n\n'
@@ -206,8 +363,8 @@ class RAGAgent():
             ("user", "{documents}")
         ])
         
-        # Используем модель GPT-4o-mini для анализа документов
-        model = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+        # Используем общую модель GPT-4o-mini для анализа документов
+        model = self.get_analysis_model()
         chain = prompt | model | StrOutputParser()
         
         return chain.invoke({"documents": documents})
@@ -222,13 +379,13 @@ class RAGAgent():
         Returns:
             Словарь с узлами графа
         """
-        # Инициализация модели
-        model = ChatOpenAI(model="gpt-4o-mini", temperature=0.2)
+        # Общий для всех графов клиент модели
+        model = self.get_agent_model()
         
         # Вспомогательные функции для работы с чистыми функциями поиска
-        def _search_func(query_str):
+        def _search_func(query : str, diverse : Optional[bool] = None):
             """Прямая реализация поиска без вызова инструмента"""
-            return self.raw_search_documents(query_str, vector_store)
+            return self.raw_search_documents(query, vector_store, diverse=diverse)
         
         def _filter_search_func(args_str):
             """Прямая реализация поиска с фильтром без вызова инструмента"""
@@ -246,15 +403,15 @@ class RAGAgent():
             return self.raw_analyze_documents(docs)
         
         # Определяем инструменты, используя наши функции напрямую
-        search_tool = Tool(
+        search_tool = StructuredTool.from_function(
             name="search_documents",
-            description="Поиск документов по текстовому запросу",
+            description="Поиск документов по текстовому запросу. diverse=true исключает почти одинаковые соседние фрагменты и возвращает разные части документов",
             func=_search_func
         )
         
         filtered_search_tool = Tool(
             name="search_with_filter",
-            description="Поиск документов с фильтрацией по метаданным",
+            description='Поиск документов с фильтрацией по метаданным. Допустимые ключи metadata_filter: doc_name (название документа или ссылка), token_count (размер чанка в токенах). Пример: {"doc_name": "report"}',
             func=_filter_search_func
         )
         
@@ -289,11 +446,11 @@ class RAGAgent():
             Вы - поисковый ассистент, который должен выбрать наиболее подходящий инструмент для поиска.
             
             У вас есть следующие инструменты:
-            1. search_documents - стандартный поиск по запросу
-            2. search_with_filter - поиск с фильтрацией по метаданным (например, фильтр по категории, дате, автору)
+            1. search_documents - стандартный поиск по запросу (diverse=true, если нужны разные части документов, а не соседние фрагменты)
+            2. search_with_filter - поиск с фильтрацией по метаданным (doc_name - название документа или ссылка, token_count - размер чанка в токенах)
             
             Выберите инструмент на основе запроса пользователя и выполните поиск.
-            Если запрос содержит указание на фильтрацию или категорию, используйте search_with_filter.
+            Если запрос явно указывает конкретный документ или источник, используйте search_with_filter.
             В противном случае используйте search_documents.
             """)
             
@@ -343,18 +500,21 @@ class RAGAgent():
                         # Вызов инструмента search_documents
                         if tool_name == "search_documents":
                             search_query = query
+                            diverse = None
                             if isinstance(tool_args, dict) and 'query' in tool_args:
                                 search_query = tool_args['query']
+                                diverse = tool_args.get('diverse')
                             elif isinstance(tool_args, str):
                                 import json
                                 try:
                                     args_dict = json.loads(tool_args)
                                     search_query = args_dict.get('query', query)
+                                    diverse = args_dict.get('diverse')
                                 except:
                                     search_query = query
                             
                             # Прямой вызов функции поиска
-                            tool_result = _search_func(search_query)
+                            tool_result = _search_func(search_query, diverse)
                             
                         # Вызов инструмента search_with_filter
                         elif tool_name == "search_with_filter":
@@ -434,58 +594,18 @@ class RAGAgent():
                 "search_history": state["search_history"]
             }
         
-        def generate_response(state: SearchAgentState) -> SearchAgentState:
-            """Формирует ответ на основе результатов поиска."""
-            # Если нет результатов поиска, возвращаем сообщение об этом
-            if not state["search_results"]:
-                response = AIMessage(content="Извините, я не смог найти релевантную информацию по вашему запросу. Пожалуйста, попробуйте сформулировать запрос иначе.")
-                return {
-                    "messages": state["messages"] + [response],
-                    "status": "completed",
-                    "search_results": state["search_results"],
-                    "search_history": state["search_history"]
-                }
-            
-            # Системное сообщение для формирования ответа
-            system_message = SystemMessage(content="""
-            Вы - поисковый ассистент. Используйте результаты поиска для формирования
-            информативного и полезного ответа на запрос пользователя.
-            
-            Структурируйте свой ответ следующим образом:
-            1. Краткое резюме найденной информации
-            2. Детальный ответ на вопрос, опираясь на найденные документы
-            
-            Основывайтесь только на предоставленных результатах поиска.
-            Если информации недостаточно, честно укажите на это.
-            Если запрос не относится к темам найденных документов укажите на это написав "Извините, я не смог найти релевантную информацию по вашему запросу." и продолжите кратко описав содержимое документов
-            """)
-            
-            # Создание контекста с результатами поиска
-            search_context = "\n\n".join(state["search_results"])
-            search_context_message = SystemMessage(content=f"Результаты поиска:\n{search_context}")
-            
-            # Получение последнего запроса пользователя
-            user_messages = [msg for msg in state["messages"] if isinstance(msg, HumanMessage)]
-            last_user_message = user_messages[-1] if user_messages else None
-            
-            # Если нет запроса, возвращаем состояние без изменений
-            if not last_user_message:
-                return state
-            
-            # Создание запроса для формирования ответа
-            query_for_response = f"Запрос пользователя: {last_user_message.content}. Сформируйте ответ на основе результатов поиска."
-            
-            # Сообщения для модели
-            messages = [
-                system_message,
-                search_context_message,
-                HumanMessage(content=query_for_response)
-            ]
-            
-            # Вызов модели для формирования ответа
-            response = model.invoke(messages)
-            
-            # Обновление состояния
+        # Возвращаем словарь с узлами
+        return {
+            "analyze_query": analyze_query,
+            "execute_search": execute_search,
+            "generate_response": self.generate_response
+        }
+
+    def generate_response(self, state: SearchAgentState) -> SearchAgentState:
+        """Формирует ответ на основе результатов поиска."""
+        # Если нет результатов поиска, возвращаем сообщение об этом
+        if not state["search_results"]:
+            response = AIMessage(content="Извините, я не смог найти релевантную информацию по вашему запросу. Пожалуйста, попробуйте сформулировать запрос иначе.")
             return {
                 "messages": state["messages"] + [response],
                 "status": "completed",
@@ -493,11 +613,51 @@ class RAGAgent():
                 "search_history": state["search_history"]
             }
         
-        # Возвращаем словарь с узлами
+        # Системное сообщение для формирования ответа
+        system_message = SystemMessage(content="""
+        Вы - поисковый ассистент. Используйте результаты поиска для формирования
+        информативного и полезного ответа на запрос пользователя.
+        
+        Структурируйте свой ответ следующим образом:
+        1. Краткое резюме найденной информации
+        2. Детальный ответ на вопрос, опираясь на найденные документы
+        
+        Основывайтесь только на предоставленных результатах поиска.
+        Если информации недостаточно, честно укажите на это.
+        Если запрос не относится к темам найденных документов укажите на это написав "Извините, я не смог найти релевантную информацию по вашему запросу." и продолжите кратко описав содержимое документов
+        """)
+        
+        # Создание контекста с результатами поиска
+        search_context = "\n\n".join(state["search_results"])
+        search_context_message = SystemMessage(content=f"Результаты поиска:\n{search_context}")
+        
+        # Получение последнего запроса пользователя
+        user_messages = [msg for msg in state["messages"] if isinstance(msg, HumanMessage)]
+        last_user_message = user_messages[-1] if user_messages else None
+        
+        # Если нет запроса, возвращаем состояние без изменений
+        if not last_user_message:
+            return state
+        
+        # Создание запроса для формирования ответа
+        query_for_response = f"Запрос пользователя: {last_user_message.content}. Сформируйте ответ на основе результатов поиска."
+        
+        # Сообщения для модели
+        messages = [
+            system_message,
+            search_context_message,
+            HumanMessage(content=query_for_response)
+        ]
+        
+        # Вызов модели для формирования ответа
+        response = self.get_agent_model().invoke(messages)
+        
+        # Обновление состояния
         return {
-            "analyze_query": analyze_query,
-            "execute_search": execute_search,
-            "generate_response": generate_response
+            "messages": state["messages"] + [response],
+            "status": "completed",
+            "search_results": state["search_results"],
+            "search_history": state["search_history"]
         }
 
     def create_search_agent_graph(self, vector_store):
@@ -538,10 +698,74 @@ class RAGAgent():
         
         return graph
 
+    def get_search_agent_graph(self, vector_store):
+        """
+        Скомпилированный граф агента для хранилища. Граф, модель и инструменты
+        создаются при первом запросе, состояние каждого запроса передаётся при вызове.
+
+        Args:
+            vector_store: Векторное хранилище для поиска
+
+        Returns:
+            Скомпилированный граф
+        """
+        if vector_store is None:
+            return self.create_search_agent_graph(vector_store)
+        graph = self.search_graphs.get(vector_store)
+        if graph is None:
+            graph = self.create_search_agent_graph(vector_store)
+            # При одновременной сборке остаётся первый граф
+            with self.lock:
+                graph = self.search_graphs.setdefault(vector_store, graph)
+        return graph
+
+    def route_query(self, question : str) -> str:
+        """
+        Локальный маршрутизатор без вызова модели: запросы с упоминанием
+        документа, источника или ссылки и длинные составные вопросы идут
+        через ReAct граф, остальные - сразу в поиск.
+
+        Returns:
+            FAST_ROUTE или AGENT_ROUTE
+        """
+        if not self.fast_path:
+            return AGENT_ROUTE
+        if len(question.split()) > FAST_ROUTE_MAX_WORDS:
+            return AGENT_ROUTE
+        if any(pattern.search(question) for pattern in AGENT_ROUTE_PATTERNS):
+            return AGENT_ROUTE
+        return FAST_ROUTE
+
+    def run_fast_search(self, question : str, vector_store : LanceDB) -> SearchAgentState:
+        """
+        Быстрый путь: поиск по запросу пользователя и один вызов модели для ответа.
+
+        Args:
+            question: запрос пользователя
+            vector_store: Векторное хранилище для поиска
+
+        Returns:
+            Конечное состояние в том же виде, что и у графа
+        """
+        state = self.create_empty_state()
+        state["messages"].append(HumanMessage(content=question))
+        state["search_results"].append(self.raw_search_documents(question, vector_store))
+        state["search_history"].append(question)
+        state["status"] = "search_executed"
+        return self.generate_response(state)
+
+    def release_search_graph(self, vector_store : LanceDB):
+        """
+        Удаляет граф хранилища, которое больше не используется.
+        """
+        with self.lock:
+            self.search_graphs.pop(vector_store, None)
+
     def run_search_agent(self, question, vector_store=None):
         """
         Поисковой агент на основе ReAct.
         Показывает полный цикл обработки запроса: анализ, поиск и формирование ответа.
+        Простые запросы (см. route_query) обрабатываются быстрым путём без графа.
         
         Args:
             vector_store: Векторное хранилище для поиска
@@ -549,62 +773,133 @@ class RAGAgent():
         Returns:
             dict: Конечное состояние агента после обработки всех запросов
         """
-        # Создание графа для ReAct агента
-        graph = self.create_search_agent_graph(vector_store)
-        
-        # Начальное состояние
-        state = self.create_empty_state()
-        
-        # Добавление запроса пользователя в состояние
-        state["messages"].append(HumanMessage(content=question))
-        
-        # Вызов графа для обработки запроса
-        state = graph.invoke(state)
+        route = self.route_query(question)
+        if route == FAST_ROUTE:
+            state = self.run_fast_search(question, vector_store)
+        else:
+            # Граф ReAct агента, собранный для этого хранилища
+            graph = self.get_search_agent_graph(vector_store)
+            
+            # Начальное состояние
+            state = self.create_empty_state()
+            
+            # Добавление запроса пользователя в состояние
+            state["messages"].append(HumanMessage(content=question))
+            
+            # Вызов графа для обработки запроса
+            state = graph.invoke(state)
 
         # Вывод информации о процессе обработки
         self.logger.info(f"{'='*50}\n")
         self.logger.info(f"СТАТИСТИКА:")
+        self.logger.info(f"• Маршрут: {'быстрый поиск' if route == FAST_ROUTE else 'ReAct граф'}")
         self.logger.info(f"• Статус: {state['status']}")
         self.logger.info(f"• Найдено документов: {len(state['search_results'])}")
         self.logger.info(f"• Выполнено поисков: {len(state['search_history'])}")
+        query_cache = getattr(self.embeddings, "cache", None)
+        if query_cache is not None:
+            stats = query_cache.stats()
+            self.logger.info(f"• Кэш эмбеддингов запросов: попаданий {stats['hits']}, промахов {stats['misses']}, hit rate {stats['hit_rate']:.0%}")
         self.logger.info(f"{'='*50}\n")
         
         return state
 
 class RAGBotHandler():
 
-        def __init__(self, agent : RAGAgent, logger : ILogger , db_path : str):
+        def __init__(
+            self,
+            agent : RAGAgent,
+            logger : ILogger,
+            db_path : str,
+            answer_cache : Optional[SemanticAnswerCache] = None,
+            per_chat : bool = False,
+            max_chat_routes : int = MAX_CHAT_ROUTES
+        ):
             self.db_path = db_path
             self.agent = agent
             self.logger = logger
+            self.answer_cache = answer_cache
+            # Поиск по коллекции чата вместе с общей коллекцией вместо одной общей
+            self.per_chat = per_chat and agent.table_registry is not None
+            # Название коллекции чата -> (хранилище, кэш ответов этой коллекции), в порядке последнего
+            # использования. Маршруты давно не писавших чатов удаляются вместе с кэшем ответов
+            self.chat_routes : OrderedDict[str, Tuple[LanceDB, Optional[SemanticAnswerCache]]] = OrderedDict()
+            self.max_chat_routes = max_chat_routes
+            self.routes_lock = threading.Lock()
             self.vector_db: Optional[LanceDB] = self.connect_to_vector_db()
 
         def connect_to_vector_db(self) -> Optional[LanceDB]:
 
-            if not os.path.exists(self.db_path):
+            if self.agent.table_registry is None and not os.path.exists(self.db_path):
                 self.logger.critical(f"Путь к базе данных не существует: {self.db_path}")
                 return None
             else:
                 try:
                     # Подключаемся к базе данных
-                    vector_db = self.agent.connect_to_lancedb(db_path=self.db_path, table_name="from_txt")
+                    vector_db = self.agent.connect_to_lancedb(db_path=self.db_path, table_name=DEFAULT_TABLE_NAME)
                     self.logger.info("Успешное подключение к базе данных")
                     return vector_db
                 except Exception as e:
                     self.logger.warning(f"Ошибка при подключении к базе данных: {str(e)}, используем vector_db = None")
                     return None
 
-        def handle_question(self, question):
-            if not self.vector_db:
+        def route(self, chat_id : Optional[int]) -> Tuple[Optional[LanceDB], Optional[SemanticAnswerCache]]:
+            """
+            Выбирает хранилище и кэш ответов для чата.
+
+            Returns:
+                Хранилище коллекции чата с общей коллекцией, а если чат ещё ничего
+                не загружал - хранилище общей коллекции
+            """
+            if not self.per_chat or chat_id is None:
+                return self.vector_db, self.answer_cache
+            table_name = chat_table_name(chat_id)
+            with self.routes_lock:
+                route = self.chat_routes.get(table_name)
+                if route is not None:
+                    self.chat_routes.move_to_end(table_name)
+                    return route
+            if not self.agent.table_registry.has_table(table_name):
+                return self.vector_db, self.answer_cache
+            vector_db = self.agent.connect_to_registry(table_name, shared_tables=[DEFAULT_TABLE_NAME])
+            if vector_db is None:
+                return self.vector_db, self.answer_cache
+            answer_cache = self.answer_cache.empty_copy() if self.answer_cache is not None else None
+            with self.routes_lock:
+                route = self.chat_routes.setdefault(table_name, (vector_db, answer_cache))
+                self.chat_routes.move_to_end(table_name)
+                while len(self.chat_routes) > self.max_chat_routes:
+                    evicted, (evicted_db, _) = self.chat_routes.popitem(last=False)
+                    self.agent.release_search_graph(evicted_db)
+                    self.agent.table_registry.release_table(evicted)
+                    self.logger.info(f"Коллекция {evicted} давно не использовалась, подключение и кэш ответов освобождены")
+            return route
+
+        def get_version(self, vector_db : LanceDB) -> Tuple[int, ...]:
+            return tuple(table.version for table in self.agent.get_search_tables(vector_db))
+
+        def handle_question(self, question, chat_id : Optional[int] = None):
+            vector_db, answer_cache = self.route(chat_id)
+            if not vector_db:
                 self.logger.critical("vector_db не инициализирован")
                 return "⚠️ База данных недоступна. Попробуйте позже."
             try:
-                state = self.agent.run_search_agent(question, self.vector_db)
+                query_vector, version = None, None
+                if answer_cache is not None:
+                    query_vector = vector_db.embeddings.embed_query(question)
+                    version = self.get_version(vector_db)
+                    cached = answer_cache.get(query_vector, version)
+                    if cached is not None:
+                        return cached
+                state = self.agent.run_search_agent(question, vector_db)
                 ai_messages = [msg for msg in state["messages"] if isinstance(msg, AIMessage)]
                 last_message = ai_messages[-1] if ai_messages else None
                 response = last_message.content
+                if answer_cache is not None and response:
+                    answer_cache.put(query_vector, response, version)
+                    stats = answer_cache.stats()
+                    self.logger.info(f"Кэш ответов: попаданий {stats['hits']}, промахов {stats['misses']}, записей {stats['entries']}")
                 return response
             except Exception as e:
                 self.logger.critical(f"Ошибка при работе поискового агента: {str(e)}")
                 return "⚠️ Ошибка при обработке запроса. Попробуйте снова."
-
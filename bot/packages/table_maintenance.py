@@ -0,0 +1,223 @@
+import asyncio
+import os
+import statistics
+import time
+from datetime import timedelta
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, TypedDict
+
+import lancedb
+
+from bot.packages.i_classes.i_logger import ILogger
+from bot.packages.lance_vector_db import VECTOR_COLUMN
+
+# Как часто выполняется обслуживание таблицы (в секундах)
+DEFAULT_MAINTENANCE_INTERVAL = 6 * 3600
+# Обслуживание начинается, только если столько секунд не было запросов и загрузок
+DEFAULT_IDLE_SECONDS = 300
+# Версии таблицы старше этого срока удаляются с диска
+DEFAULT_VERSION_RETENTION = timedelta(days=1)
+# Как часто планировщик проверяет, пора ли обслуживать таблицы (в секундах)
+POLL_INTERVAL = 60
+# Количество пробных запросов для замера задержки поиска
+PROBE_QUERIES = 5
+PROBE_LIMIT = 10
+
+class MaintenanceReport(TypedDict):
+    """
+    Результат обслуживания одной таблицы.
+    """
+    table: str
+    version_before: int
+    version_after: int
+    fragments_before: int
+    fragments_after: int
+    # Размер каталога таблицы на диске (все версии и индексы)
+    bytes_before: int
+    bytes_after: int
+    # Медианная задержка пробного векторного поиска, None для пустой таблицы
+    latency_before_ms: Optional[float]
+    latency_after_ms: Optional[float]
+    seconds: float
+
+def directory_size(path : Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                # Файл удалён параллельной операцией
+                pass
+    return total
+
+class TableMaintenanceScheduler():
+    """
+    Фоновое обслуживание таблиц LanceDB в процессе бота.
+
+    Каждая запись создаёт новую версию и фрагмент таблицы. Планировщик во время
+    простоя удаляет документы с истёкшим сроком хранения, объединяет мелкие
+    фрагменты, удаляет версии старше срока хранения, дообновляет индексы и пишет
+    в лог освобождённое место и задержку поиска до и после обслуживания.
+    """
+
+    def __init__(
+        self,
+        logger : ILogger,
+        table_registry,
+        lance_db,
+        interval : float = DEFAULT_MAINTENANCE_INTERVAL,
+        idle_seconds : float = DEFAULT_IDLE_SECONDS,
+        retention : timedelta = DEFAULT_VERSION_RETENTION,
+        busy : Optional[Callable[[], bool]] = None
+    ):
+        """
+        Args:
+            logger: логгер
+            table_registry: общий реестр таблиц (LanceTableRegistry)
+            lance_db: LanceVectorDB для обслуживания индексов и пробного поиска
+            interval: период обслуживания в секундах
+            idle_seconds: сколько секунд без активности считается простоем
+            retention: срок хранения старых версий таблицы
+            busy: функция, возвращающая True, пока идёт загрузка документов
+        """
+        self.logger = logger
+        self.table_registry = table_registry
+        self.lance_db = lance_db
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+        self.retention = retention
+        self.busy = busy
+        self.last_activity = time.monotonic()
+        self.last_run : Optional[float] = None
+        # Версия таблицы после последнего обслуживания: без новых записей обслуживание пропускается
+        self.maintained_versions : Dict[str, int] = {}
+        self.task : Optional[asyncio.Task] = None
+
+    def record_activity(self):
+        """
+        Отмечает запрос пользователя, чтобы обслуживание не мешало ответам.
+        """
+        self.last_activity = time.monotonic()
+
+    def is_idle(self) -> bool:
+        if self.busy is not None and self.busy():
+            return False
+        return time.monotonic() - self.last_activity >= self.idle_seconds
+
+    def is_due(self) -> bool:
+        return self.last_run is None or time.monotonic() - self.last_run >= self.interval
+
+    async def start(self):
+        self.task = asyncio.create_task(self.run())
+        self.logger.info(
+            f"Обслуживание таблиц запущено: раз в {self.interval / 3600:.1f} ч при простое {self.idle_seconds:.0f} с, "
+            f"версии хранятся {self.retention}"
+        )
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(min(POLL_INTERVAL, self.interval))
+            if not self.is_due() or not self.is_idle():
+                continue
+            await asyncio.to_thread(self.maintain_all)
+
+    def maintain_all(self) -> List[MaintenanceReport]:
+        """
+        Обслуживает все таблицы базы.
+        """
+        self.last_run = time.monotonic()
+        reports = []
+        for name, table in self.table_registry.open_all_tables().items():
+            try:
+                expired = self.lance_db.delete_expired(table)
+                if expired:
+                    self.logger.info(f"Из таблицы '{name}' удалены документы с истёкшим сроком: {', '.join(expired)}")
+                report = self.maintain_table(name, table)
+            except Exception as e:
+                # Конфликт с параллельной записью: таблица будет обслужена в следующий раз
+                self.logger.warning(f"Ошибка при обслуживании таблицы '{name}': {e}")
+                continue
+            if report is not None:
+                reports.append(report)
+        return reports
+
+    def maintain_table(self, name : str, table : lancedb.db.Table) -> Optional[MaintenanceReport]:
+        """
+        Объединяет фрагменты, удаляет старые версии и обновляет индексы таблицы.
+
+        Args:
+            name: название таблицы
+            table: объект таблицы
+
+        Returns:
+            Отчёт или None, если таблица не менялась с прошлого обслуживания
+        """
+        version_before = table.version
+        if self.maintained_versions.get(name) == version_before:
+            return None
+
+        path = Path(table.uri)
+        fragments_before = table.stats()["fragment_stats"]["num_fragments"]
+        bytes_before = directory_size(path)
+        latency_before = self.probe_latency(table)
+
+        self.logger.info(f"Обслуживание таблицы '{name}': версия {version_before}, фрагментов {fragments_before}...")
+        started = time.perf_counter()
+        # Создание индекса и оптимизация не должны коммитить одновременно
+        with self.lance_db.index_lock:
+            table.optimize(cleanup_older_than=self.retention)
+            self.lance_db.maintain_indexes(table)
+        seconds = time.perf_counter() - started
+
+        report : MaintenanceReport = {
+            "table": name,
+            "version_before": version_before,
+            "version_after": table.version,
+            "fragments_before": fragments_before,
+            "fragments_after": table.stats()["fragment_stats"]["num_fragments"],
+            "bytes_before": bytes_before,
+            "bytes_after": directory_size(path),
+            "latency_before_ms": latency_before,
+            "latency_after_ms": self.probe_latency(table),
+            "seconds": seconds
+        }
+        self.maintained_versions[name] = report["version_after"]
+        self.log_report(report)
+        return report
+
+    def probe_latency(self, table : lancedb.db.Table) -> Optional[float]:
+        """
+        Медианная задержка векторного поиска по вектору первой строки таблицы (в мс).
+        """
+        rows = table.search().select([VECTOR_COLUMN]).limit(1).to_list()
+        if not rows:
+            return None
+        probe = list(rows[0][VECTOR_COLUMN])
+        timings = []
+        for _ in range(PROBE_QUERIES):
+            started = time.perf_counter()
+            # Замеряется поиск LanceDB: снимок в памяти не зависит от обслуживания и не должен загружаться
+            self.lance_db.search_vectors(table, probe, PROBE_LIMIT, in_memory=False)
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    def log_report(self, report : MaintenanceReport):
+        reclaimed = report["bytes_before"] - report["bytes_after"]
+        self.logger.info(
+            f"Таблица '{report['table']}' обслужена за {report['seconds']:.1f} с: "
+            f"фрагментов {report['fragments_before']} -> {report['fragments_after']}, "
+            f"на диске {report['bytes_before'] / 2**20:.1f} -> {report['bytes_after'] / 2**20:.1f} МБ "
+            f"(освобождено {reclaimed / 2**20:.1f} МБ)"
+        )
+        if report["latency_before_ms"] is not None:
+            self.logger.info(
+                f"   Задержка поиска: {report['latency_before_ms']:.1f} -> {report['latency_after_ms']:.1f} мс"
+            )
@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Dict, Optional
+
+import lancedb
+
+from bot.packages.i_classes.i_logger import ILogger
+
+DEFAULT_DB_PATH = "data/lancedb"
+# Общая коллекция, доступная во всех чатах
+DEFAULT_TABLE_NAME = "from_txt"
+CHAT_TABLE_PREFIX = "chat_"
+# Как часто открытая таблица проверяет наличие новой версии при чтении (в секундах)
+DEFAULT_REFRESH_INTERVAL = 1.0
+# Сколько таблиц реестр держит открытыми: коллекции 128 маршрутов чатов и общая коллекция.
+# Давно не использованные таблицы закрываются, общая коллекция - никогда
+MAX_OPEN_TABLES = 129
+
+def chat_table_name(chat_id : Optional[int]) -> str:
+    """
+    Название коллекции чата. Для групп chat_id отрицательный, минус заменяется на "m".
+    Без chat_id возвращается общая коллекция.
+    """
+    if chat_id is None:
+        return DEFAULT_TABLE_NAME
+    return f"{CHAT_TABLE_PREFIX}{str(chat_id).replace('-', 'm')}"
+
+class LanceTableRegistry():
+    """
+    Общий реестр открытых таблиц LanceDB для загрузки и поиска.
+
+    Соединение создаётся один раз, каждая таблица открывается (и при необходимости
+    создаётся или мигрирует) при первом обращении и дальше переиспользуется, пока
+    не вытеснена более свежими таблицами сверх max_tables или не освобождена release_table.
+    Записи через объект таблицы видны сразу, а записи других процессов (ingest.py)
+    подхватываются при чтении не позже чем через refresh_interval секунд.
+    """
+
+    def __init__(self, logger : ILogger, lance_db, db_path : str = DEFAULT_DB_PATH, refresh_interval : float = DEFAULT_REFRESH_INTERVAL, max_tables : int = MAX_OPEN_TABLES):
+        self.logger = logger
+        self.lance_db = lance_db
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        self.connection : Optional[lancedb.db.DBConnection] = None
+        # Название -> объект таблицы, в порядке последнего использования
+        self.tables : OrderedDict[str, lancedb.db.Table] = OrderedDict()
+        self.max_tables = max_tables
+        self.lock = threading.Lock()
+
+    def get_connection(self) -> lancedb.db.DBConnection:
+        with self.lock:
+            return self.connect()
+
+    def connect(self) -> lancedb.db.DBConnection:
+        # Вызывается под self.lock
+        if self.connection is None:
+            self.lance_db.connect_db(self.db_path, read_consistency_interval=timedelta(seconds=self.refresh_interval))
+            self.connection = self.lance_db.get_connection()
+        return self.connection
+
+    def get_table(self, table_name : str = DEFAULT_TABLE_NAME) -> lancedb.db.Table:
+        """
+        Возвращает общий объект таблицы, открывая её при первом обращении.
+
+        Args:
+            table_name: название таблицы
+
+        Returns:
+            Объект таблицы, читающий последнюю версию данных
+        """
+        with self.lock:
+            table = self.tables.get(table_name)
+            if table is not None:
+                self.tables.move_to_end(table_name)
+                return table
+            connection = self.connect()
+            self.lance_db.check_and_create_table(table_name)
+            table = connection.open_table(table_name)
+            self.tables[table_name] = table
+            self.logger.info(f"Таблица '{table_name}' открыта в общем реестре, строк: {table.count_rows()}")
+            self.evict()
+            return table
+
+    def evict(self):
+        # Вызывается под self.lock
+        stale = [name for name in self.tables if name != DEFAULT_TABLE_NAME]
+        for name in stale[:max(0, len(self.tables) - self.max_tables)]:
+            del self.tables[name]
+            self.logger.info(f"Таблица '{name}' давно не использовалась и закрыта в общем реестре")
+
+    def release_table(self, table_name : str):
+        """
+        Убирает таблицу из реестра, например когда закрыт маршрут чата.
+        Общая коллекция остаётся открытой.
+        """
+        if table_name == DEFAULT_TABLE_NAME:
+            return
+        with self.lock:
+            self.tables.pop(table_name, None)
+
+    def has_table(self, table_name : str) -> bool:
+        """
+        Проверяет, существует ли таблица, не создавая её.
+        """
+        with self.lock:
+            if table_name in self.tables:
+                return True
+            self.connect()
+            return self.lance_db.table_exists(table_name)
+
+    def open_all_tables(self) -> Dict[str, lancedb.db.Table]:
+        """
+        Открывает все таблицы базы, включая ещё не использованные после запуска.
+        Уже открытые таблицы берутся из реестра, остальные открываются без сохранения
+        в нём, чтобы обслуживание не держало открытыми коллекции всех чатов.
+        """
+        with self.lock:
+            connection = self.connect()
+            names = connection.list_tables().tables
+            cached = dict(self.tables)
+        return {name: cached[name] if name in cached else connection.open_table(name) for name in names}
+
+    def open_tables(self) -> Dict[str, lancedb.db.Table]:
+        """
+        Возвращает уже открытые таблицы (название -> объект таблицы).
+        """
+        with self.lock:
+            return dict(self.tables)
@@ -1,36 +1,100 @@
-from docling_core.transforms.chunker.hybrid_chunker import HybridChunker
-#from bot.packages.embedding_generator import OpenAITokenizerWrapper
+from bot.packages.embedding_generator import OpenAITokenizerWrapper
 from bot.packages.i_classes.i_logger import ILogger
 from pathlib import Path
-from typing import List
+from typing import Callable, Iterable, Iterator, List, Optional
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 
+# Размер блока при потоковом чтении файла (в символах)
+READ_BLOCK_SIZE = 64 * 1024
+# Сколько чанков накапливается в буфере перед разбиением
+STREAM_WINDOW_CHUNKS = 8
+# Верхняя оценка количества символов на токен, задаёт размер буфера в режиме токенов
+MAX_CHARS_PER_TOKEN = 4
+# Перекрытие чанков по умолчанию для разбиения по токенам
+DEFAULT_CHUNK_OVERLAP_TOKENS = 80
+
 class TextProcessor():
-    def __init__(self, logger : ILogger):
+    def __init__(self, logger : ILogger, tokenizer : Optional[OpenAITokenizerWrapper] = None):
         self.logger = logger
+        self.tokenizer = tokenizer
 
-    def chunk_text(self, filepath : str | Path, chunk_size : int, chunk_overlap : int)-> List[Document] | None:
-        try:
-            text : str
-            with open(file=filepath, mode="r", encoding='utf-8') as f:
-                text = f.read()
-            text_splitter = text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,  # Размер чанка в символах
-            chunk_overlap=chunk_overlap,  # Перекрытие 200 символов для сохранения контекста
+    def get_tokenizer(self) -> OpenAITokenizerWrapper:
+        # Загружается при первом использовании: словарь tiktoken может скачиваться по сети
+        if self.tokenizer is None:
+            self.tokenizer = OpenAITokenizerWrapper(self.logger)
+        return self.tokenizer
+
+    def count_tokens(self, text : str) -> int:
+        return self.get_tokenizer().count_tokens(text)
+
+    def create_splitter(self, chunk_size : int, chunk_overlap : int, length_function : Callable[[str], int] = len) -> RecursiveCharacterTextSplitter:
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,  # Размер чанка в символах или токенах (см. length_function)
+            chunk_overlap=chunk_overlap,  # Перекрытие для сохранения контекста
+            length_function=length_function,
             separators=[".", "\n", ", "],  # Разделители по точке, новой строке и запятой
             keep_separator="end",  # Сохраняем разделители в конце чанков
-            is_separator_regex=False  # Без использования регулярных выражений
-            )
-            chunks = text_splitter.create_documents([text])
+            is_separator_regex=False,  # Без использования регулярных выражений
+            add_start_index=True  # Позиция чанка нужна для потокового разбиения
+        )
+
+    def iter_file_segments(self, filepath : str | Path) -> Iterator[str]:
+        with open(file=filepath, mode="r", encoding='utf-8') as f:
+            for block in iter(lambda: f.read(READ_BLOCK_SIZE), ""):
+                yield block
+
+    def iter_chunks(self, segments : Iterable[str], chunk_size : int, chunk_overlap : int, by_tokens : bool = False) -> Iterator[Document]:
+        """
+        Лениво разбивает поток текстовых сегментов (страниц, абзацев, блоков файла) на чанки.
+
+        Сегменты склеиваются в буфер ограниченного размера. После разбиения буфера
+        все чанки, кроме последнего, отдаются наружу, а буфер продолжается с начала
+        последнего чанка - так размер чанков и перекрытие сохраняются на границах сегментов.
+
+        Каждый чанк получает в metadata["token_count"] количество токенов модели эмбеддингов.
+
+        Args:
+            segments: итератор текстовых сегментов
+            chunk_size: размер чанка в символах (в токенах при by_tokens)
+            chunk_overlap: перекрытие чанков в символах (в токенах при by_tokens)
+            by_tokens: считать размер чанков в токенах вместо символов
+
+        Returns:
+            Итератор чанков
+        """
+        if by_tokens:
+            text_splitter = self.create_splitter(chunk_size, chunk_overlap, length_function=self.count_tokens)
+            window = chunk_size * STREAM_WINDOW_CHUNKS * MAX_CHARS_PER_TOKEN
+        else:
+            text_splitter = self.create_splitter(chunk_size, chunk_overlap)
+            window = chunk_size * STREAM_WINDOW_CHUNKS
+        buffer = ""
+        for segment in segments:
+            buffer += segment
+            if len(buffer) < window:
+                continue
+            chunks = text_splitter.create_documents([buffer])
+            last_start = chunks[-1].metadata.get("start_index", -1) if chunks else -1
+            if len(chunks) < 2 or last_start <= 0:
+                continue
+            for chunk in chunks[:-1]:
+                yield self.make_chunk(chunk.page_content)
+            buffer = buffer[last_start:]
+
+        if buffer:
+            for chunk in text_splitter.create_documents([buffer]):
+                yield self.make_chunk(chunk.page_content)
+
+    def make_chunk(self, text : str) -> Document:
+        return Document(page_content=text, metadata={"token_count": self.count_tokens(text)})
+
+    def chunk_text(self, filepath : str | Path, chunk_size : int, chunk_overlap : int, by_tokens : bool = False)-> List[Document] | None:
+        try:
+            chunks = list(self.iter_chunks(self.iter_file_segments(filepath), chunk_size, chunk_overlap, by_tokens))
             self.logger.info(f"Текст из директории: {filepath} был успешно разделён на чанки, размером {len(chunks)} элементов")
             return chunks
         except Exception as e:
             self.logger.critical(f"Ошибка при разбиении текста на чанки, Trace: {e}")
             return None
-        
-            
-
-            
-
@@ -1,5 +1,6 @@
 import base64
 from pathlib import Path
+from typing import Iterable, Iterator
 from common.paths import TXT_DIR
 from bot.packages.i_classes.i_logger import ILogger
 
@@ -25,3 +26,38 @@ class FileUtilities():
         except Exception as e:
             self.logger.critical(f"Произошла ошибка при сохранении txt файла, Trace: {e}")
             return None
+
+    def tee_txt(self, segments : Iterable[str], filename : str) -> Iterator[str]:
+        """
+        Пропускает сегменты текста дальше по конвейеру, попутно дописывая их в txt архив.
+        Ошибка записи архива не прерывает загрузку: архив просто перестаёт писаться.
+
+        Args:
+            segments: итератор текстовых сегментов
+            filename: имя документа, из которого строится имя архива
+
+        Returns:
+            Итератор тех же сегментов
+        """
+        file_path = TXT_DIR / f"{self.encode_filename_base64(filename)}.txt"
+        f = None
+        written = 0
+        try:
+            f = open(file=file_path, mode="w", encoding="utf-8")
+        except Exception as e:
+            self.logger.critical(f"Произошла ошибка при сохранении txt файла, Trace: {e}")
+        try:
+            for segment in segments:
+                if f is not None:
+                    try:
+                        written += f.write(segment)
+                    except Exception as e:
+                        self.logger.critical(f"Произошла ошибка при сохранении txt файла, Trace: {e}")
+                        f.close()
+                        f = None
+                yield segment
+            if f is not None:
+                self.logger.info(f"Файл с названием: {filename} и размером в {written} символов был успешно сохранён, путь -> {file_path}")
+        finally:
+            if f is not None:
+                f.close()
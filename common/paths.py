@@ -12,4 +12,6 @@ LOG_DIR = BASE_DIR / "logs"
 PDF_FILES = PDF_DIR.glob("*.pdf")
 
 DATA_DIR = BASE_DIR / "data"
-VECTOR_DB = DATA_DIR / "lancedb"
\ No newline at end of file
+VECTOR_DB = DATA_DIR / "lancedb"
+EMBEDDING_CACHE = DATA_DIR / "embedding_cache.sqlite"
+INGESTION_JOBS = DATA_DIR / "ingestion_jobs.sqlite"
\ No newline at end of file
@@ -0,0 +1,76 @@
+# Массовая загрузка каталога документов в базу знаний
+import argparse
+import asyncio
+import os
+from dotenv import load_dotenv
+
+from common.paths import PDF_DIR, VECTOR_DB, DATA_DIR, EMBEDDING_CACHE, LOG_DIR
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Загрузка каталога PDF/DOCX/TXT файлов в LanceDB")
+    parser.add_argument("root", nargs="?", default=str(PDF_DIR), help="Каталог с документами (по умолчанию bank_data_output/pdf)")
+    parser.add_argument("--table", default="from_txt", help="Таблица LanceDB")
+    parser.add_argument("--workers", type=int, default=None, help="Количество процессов для извлечения текста")
+    parser.add_argument("--chunk-size", type=int, default=3000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--chunk-tokens", type=int, default=None, help="Размер чанка в токенах (вместо --chunk-size в символах)")
+    parser.add_argument("--chunk-overlap-tokens", type=int, default=80, help="Перекрытие чанков в токенах при --chunk-tokens")
+    parser.add_argument("--vector-dtype", choices=["float32", "float16"], default="float32", help="Тип хранения векторов в новой таблице")
+    parser.add_argument("--prefix-dims", type=int, default=None, help="Размерность короткого вектора для двухэтапного поиска в новой таблице")
+    parser.add_argument("--index-type", choices=["IVF_PQ", "IVF_HNSW_SQ"], default="IVF_PQ", help="Тип векторного индекса")
+    parser.add_argument("--index-min-rows", type=int, default=20_000, help="Количество строк, начиная с которого строится индекс")
+    parser.add_argument("--state-file", default=str(DATA_DIR / "bulk_ingest_state.json"), help="Файл с уже загруженными документами")
+    parser.add_argument("--restart", action="store_true", help="Игнорировать сохранённое состояние и загрузить всё заново")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    path = os.path.join(os.path.dirname(__file__), "..\\.env")
+    load_dotenv(path)
+
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    VECTOR_DB.mkdir(parents=True, exist_ok=True)
+
+    from bot.packages.my_logger import StandardLogger
+    from bot.packages.async_embedding_generator import AsyncOpenAIEmbeddingGenerator
+    from bot.packages.embedding_cache import EmbeddingCache, CachedEmbeddingGenerator
+    from bot.packages.lance_vector_db import LanceVectorDB
+    from bot.packages.bulk_ingestor import BulkIngestor
+
+    logger = StandardLogger(name="BulkIngest")
+    embedding_generator = CachedEmbeddingGenerator(
+        logger=logger,
+        generator=AsyncOpenAIEmbeddingGenerator(logger),
+        cache=EmbeddingCache(logger, EMBEDDING_CACHE)
+    )
+    lance_db = LanceVectorDB(
+        logger,
+        embedding_generator,
+        vector_dtype=args.vector_dtype,
+        prefix_dimensions=args.prefix_dims,
+        index_type=args.index_type,
+        index_min_rows=args.index_min_rows
+    )
+    lance_db.connect_db(db_path=str(VECTOR_DB))
+
+    ingestor = BulkIngestor(
+        logger=logger,
+        lance_db=lance_db,
+        table_name=args.table,
+        state_path=args.state_file,
+        workers=args.workers,
+        chunk_size=args.chunk_tokens or args.chunk_size,
+        chunk_overlap=args.chunk_overlap_tokens if args.chunk_tokens else args.chunk_overlap,
+        by_tokens=args.chunk_tokens is not None
+    )
+    if args.restart:
+        ingestor.reset_state()
+
+    try:
+        asyncio.run(ingestor.run(args.root))
+    finally:
+        lance_db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import pytest
+from unittest.mock import MagicMock
+
+from bot.packages.answer_cache import SemanticAnswerCache
+from bot.packages.my_logger import StandardLogger
+
+@pytest.fixture
+def mock_logger():
+    return MagicMock(StandardLogger)
+
+def test_similar_question_hits_cache(mock_logger):
+    cache = SemanticAnswerCache(mock_logger, threshold=0.95)
+    cache.put([1.0, 0.0, 0.1], "Лимит 100 000 рублей", version=3)
+
+    assert cache.get([0.99, 0.0, 0.12], version=3) == "Лимит 100 000 рублей"
+    assert cache.get([0.0, 1.0, 0.0], version=3) is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "entries": 1}
+
+def test_new_table_version_invalidates_answers(mock_logger):
+    cache = SemanticAnswerCache(mock_logger)
+    cache.put([1.0, 0.0], "Старый ответ", version=3)
+
+    assert cache.get([1.0, 0.0], version=4) is None
+    cache.put([1.0, 0.0], "Ответ на старой версии", version=3)
+    assert cache.stats()["entries"] == 0
+
+def test_least_recently_used_answer_is_evicted(mock_logger):
+    cache = SemanticAnswerCache(mock_logger, max_entries=2)
+    cache.put([1.0, 0.0, 0.0], "первый", version=1)
+    cache.put([0.0, 1.0, 0.0], "второй", version=1)
+    cache.get([1.0, 0.0, 0.0], version=1)
+    cache.put([0.0, 0.0, 1.0], "третий", version=1)
+
+    assert cache.get([0.0, 1.0, 0.0], version=1) is None
+    assert cache.get([1.0, 0.0, 0.0], version=1) == "первый"
@@ -0,0 +1,50 @@
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+from bot.packages.async_embedding_generator import AsyncOpenAIEmbeddingGenerator, TokenBucket
+from bot.packages.my_logger import StandardLogger
+
+@pytest.fixture
+def mock_logger():
+    return MagicMock(StandardLogger)
+
+@pytest.fixture
+def generator(mock_logger, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(AsyncOpenAIEmbeddingGenerator, "load_encoding", lambda self: None)
+    generator = AsyncOpenAIEmbeddingGenerator(mock_logger, max_concurrency=2)
+    generator.async_client = MagicMock()
+    return generator
+
+def test_token_bucket_wait_time():
+    bucket = TokenBucket(rate_per_minute=60)
+    bucket.tokens = 0
+
+    assert bucket.wait_time(1) == pytest.approx(1.0, abs=0.05)
+    # Запрос больше ёмкости ограничивается ёмкостью
+    assert bucket.wait_time(1000) == pytest.approx(60.0, abs=0.05)
+
+def test_rate_limit_backoff_grows_and_decays(generator):
+    generator.register_rate_limit(retry_after=None)
+    generator.register_rate_limit(retry_after=None)
+    assert generator.backoff == 2.0
+
+    generator.register_success()
+    generator.register_success()
+    assert generator.backoff == 0.0
+
+@pytest.mark.asyncio
+async def test_acreate_embeddings_batch_keeps_order(generator):
+    generator.max_inputs_per_request = 2
+
+    async def create(model, input, dimensions):
+        data = [SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+        return SimpleNamespace(data=list(reversed(data)))
+
+    generator.async_client.embeddings.create = AsyncMock(side_effect=create)
+
+    vectors = await generator.acreate_embeddings_batch(["a", "bb", "ccc", "dddd", "eeeee"])
+
+    assert vectors == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert generator.async_client.embeddings.create.await_count == 3
@@ -0,0 +1,44 @@
+import pytest
+from unittest.mock import MagicMock
+
+from bot.packages.bulk_ingestor import BulkIngestor
+from bot.packages.lance_vector_db import LanceVectorDB, VECTOR_DIMENSIONS
+from bot.packages.my_logger import StandardLogger
+
+@pytest.fixture
+def mock_logger():
+    return MagicMock(StandardLogger)
+
+@pytest.fixture
+def lance_db(tmp_path, mock_logger):
+    generator = MagicMock(spec=["create_embeddings_batch"])
+    generator.create_embeddings_batch.side_effect = lambda texts, token_counts=None: [[0.1] * VECTOR_DIMENSIONS for _ in texts]
+    lance_db = LanceVectorDB(mock_logger, generator)
+    lance_db.connect_db(db_path=str(tmp_path / "lancedb"))
+    return lance_db
+
+@pytest.fixture
+def documents(tmp_path):
+    root = tmp_path / "docs"
+    (root / "nested").mkdir(parents=True)
+    (root / "first.txt").write_text("Первый документ. " * 50, encoding="utf-8")
+    (root / "nested" / "second.txt").write_text("Второй документ. " * 50, encoding="utf-8")
+    (root / "image.png").write_bytes(b"not a document")
+    return root
+
+@pytest.mark.asyncio
+async def test_bulk_ingest_directory_and_resume(tmp_path, mock_logger, lance_db, documents):
+    state_path = tmp_path / "state.json"
+    ingestor = BulkIngestor(mock_logger, lance_db, "from_txt", state_path, workers=1, chunk_size=300, chunk_overlap=50)
+
+    stats = await ingestor.run(documents)
+
+    table = lance_db.get_table()
+    assert sorted(set(table.to_pandas()["doc_name"])) == ["first", "nested/second"]
+    assert stats["extract"]["count"] == 2
+    assert stats["embed"]["count"] == table.count_rows()
+
+    (documents / "nested" / "second.txt").write_text("Изменённый документ. " * 10, encoding="utf-8")
+    resumed = BulkIngestor(mock_logger, lance_db, "from_txt", state_path, workers=1, chunk_size=300, chunk_overlap=50)
+
+    assert resumed.find_documents(documents) == [documents / "nested" / "second.txt"]
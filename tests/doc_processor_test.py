@@ -0,0 +1,79 @@
+import pytest
+import fitz
+from unittest.mock import MagicMock
+
+from bot.packages.doc_processor import DocumentProcessor, document_name
+from bot.packages.my_logger import StandardLogger
+
+@pytest.fixture
+def mock_logger():
+    return MagicMock(StandardLogger)
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = tmp_path / "document.pdf"
+    doc = fitz.open()
+    for i in range(10):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Page {i + 1}")
+    doc.save(path)
+    doc.close()
+    return str(path)
+
+def test_iter_pdf_pages_sequential(mock_logger, pdf_path):
+    processor = DocumentProcessor(mock_logger, max_workers=1)
+
+    pages = list(processor.iter_pdf_pages(pdf_path))
+
+    assert [number for number, _ in pages] == list(range(1, 11))
+    assert [text.strip() for _, text in pages] == [f"Page {i}" for i in range(1, 11)]
+
+def test_iter_pdf_pages_parallel_keeps_order(mock_logger, pdf_path):
+    processor = DocumentProcessor(mock_logger, max_workers=2, pages_per_task=3, parallel_min_pages=2)
+    try:
+        pages = list(processor.iter_pdf_pages(pdf_path))
+    finally:
+        processor.close()
+
+    assert [number for number, _ in pages] == list(range(1, 11))
+    assert [text.strip() for _, text in pages] == [f"Page {i}" for i in range(1, 11)]
+
+@pytest.mark.asyncio
+async def test_aextract_text_from_file(mock_logger, pdf_path):
+    processor = DocumentProcessor(mock_logger, max_workers=1)
+
+    text = await processor.aextract_text_from_file(pdf_path)
+
+    assert text.split() == [word for i in range(1, 11) for word in ("Page", str(i))]
+
+def test_iter_txt_pages_bounded_segments(mock_logger, tmp_path):
+    path = tmp_path / "notes.txt"
+    text = "".join(f"строка {i}\n" for i in range(100)) + "x" * 50
+    path.write_text(text, encoding="utf-8")
+    processor = DocumentProcessor(mock_logger, segment_max_chars=30)
+
+    segments = [segment for _, segment in processor.iter_pages(str(path))]
+
+    assert "".join(segments) == text
+    assert len(segments) > 1
+    assert max(len(segment) for segment in segments) < 60
+
+def test_iter_docx_pages_groups_paragraphs(mock_logger, tmp_path):
+    from docx import Document as DocxDocument
+    path = tmp_path / "report.docx"
+    doc = DocxDocument()
+    for i in range(50):
+        doc.add_paragraph(f"Абзац {i}")
+    doc.save(path)
+    processor = DocumentProcessor(mock_logger, segment_max_chars=40)
+
+    pages = list(processor.iter_pages(str(path)))
+
+    assert [number for number, _ in pages] == list(range(1, len(pages) + 1))
+    assert len(pages) > 1
+    assert "".join(text for _, text in pages).split("\n")[:50] == [f"Абзац {i}" for i in range(50)]
+
+def test_document_name_matches_for_bot_and_bulk_uploads(tmp_path):
+    assert document_name("report.pdf") == document_name(tmp_path / "report.pdf", tmp_path) == "report"
+    assert document_name(tmp_path / "sub" / "report.pdf", tmp_path) == "sub/report"
+    assert document_name("v1.2 notes.txt") == "v1.2 notes"
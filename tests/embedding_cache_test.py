@@ -0,0 +1,109 @@
+import pytest
+from unittest.mock import MagicMock
+
+from bot.packages import embedding_cache
+from bot.packages.embedding_cache import EmbeddingCache, CachedEmbeddingGenerator, QueryEmbeddingCache, CachedQueryEmbeddings
+from bot.packages.my_logger import StandardLogger
+
+@pytest.fixture
+def mock_logger():
+    return MagicMock(StandardLogger)
+
+@pytest.fixture
+def mock_generator():
+    generator = MagicMock()
+    generator.model = "test-model"
+    generator.dimensions = 2
+    generator.create_embeddings_batch.side_effect = lambda texts, token_counts=None: [[float(len(text)), 0.5] for text in texts]
+    return generator
+
+def test_cached_generator_calls_api_only_for_misses(tmp_path, mock_logger, mock_generator):
+    cache = EmbeddingCache(mock_logger, tmp_path / "cache.sqlite")
+    cached_generator = CachedEmbeddingGenerator(mock_logger, mock_generator, cache)
+
+    first = cached_generator.create_embeddings_batch(["a", "bb"])
+    second = cached_generator.create_embeddings_batch(["bb", "ccc", "a"])
+
+    assert first == [[1.0, 0.5], [2.0, 0.5]]
+    assert second == [[2.0, 0.5], [3.0, 0.5], [1.0, 0.5]]
+    assert mock_generator.create_embeddings_batch.call_args_list[1].args[0] == ["ccc"]
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 3
+
+def test_cache_persists_between_instances(tmp_path, mock_logger):
+    EmbeddingCache(mock_logger, tmp_path / "cache.sqlite").put_many({"key": [0.25, -1.0]})
+
+    cache = EmbeddingCache(mock_logger, tmp_path / "cache.sqlite")
+
+    assert cache.get_many(["key"]) == {"key": [0.25, -1.0]}
+
+def test_cache_evicts_least_recently_used(tmp_path, mock_logger):
+    # Один вектор из двух float32 занимает 8 байт
+    cache = EmbeddingCache(mock_logger, tmp_path / "cache.sqlite", max_bytes=16)
+    cache.put_many({"old": [1.0, 1.0]})
+    cache.put_many({"recent": [2.0, 2.0]})
+    cache.get_many(["old"])
+
+    cache.put_many({"new": [3.0, 3.0]})
+
+    assert set(cache.get_many(["old", "recent", "new"])) == {"old", "new"}
+    assert cache.stats()["bytes"] == 16
+
+def test_cache_tracks_size_when_replacing_entries(tmp_path, mock_logger):
+    cache = EmbeddingCache(mock_logger, tmp_path / "cache.sqlite")
+    cache.put_many({"a": [1.0, 1.0], "b": [2.0, 2.0]})
+
+    cache.put_many({"a": [3.0, 3.0, 3.0], "c": [4.0, 4.0]})
+
+    assert cache.stats()["bytes"] == 28
+    assert EmbeddingCache(mock_logger, tmp_path / "cache.sqlite").total_bytes == 28
+
+def test_query_embeddings_bypass_persistent_cache(tmp_path, mock_logger, mock_generator):
+    cache = EmbeddingCache(mock_logger, tmp_path / "cache.sqlite")
+    mock_generator.create_embedding.return_value = [1.0, 0.0]
+    cached_generator = CachedEmbeddingGenerator(mock_logger, mock_generator, cache)
+
+    assert cached_generator.create_embedding("вопрос") == [1.0, 0.0]
+    assert cache.stats()["entries"] == 0
+
+def test_cache_key_depends_on_model_and_dimensions(tmp_path, mock_logger):
+    cache = EmbeddingCache(mock_logger, tmp_path / "cache.sqlite")
+
+    assert cache.make_key("text", "model-a", 256) != cache.make_key("text", "model-a", 1536)
+    assert cache.make_key("text", "model-a", 256) != cache.make_key("text", "model-b", 256)
+
+def test_query_cache_normalizes_text_and_counts_hits(mock_logger):
+    cache = QueryEmbeddingCache(mock_logger)
+    create = MagicMock(return_value=[0.1, 0.2])
+
+    cache.get_or_create("Какой  лимит по карте?", create)
+    vector = cache.get_or_create("  какой лимит по карте? ", create)
+
+    assert vector == [0.1, 0.2]
+    assert create.call_count == 1
+    assert cache.stats()["hit_rate"] == 0.5
+
+def test_query_cache_expires_and_evicts(mock_logger, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(embedding_cache.time, "monotonic", lambda: now[0])
+    cache = QueryEmbeddingCache(mock_logger, max_entries=2, ttl_seconds=60)
+    cache.put("a", [1.0])
+    cache.put("b", [2.0])
+    cache.get("a")
+    cache.put("c", [3.0])
+
+    assert cache.get("b") is None
+    assert cache.get("a") == [1.0]
+    now[0] += 61
+    assert cache.get("c") is None
+
+def test_langchain_embeddings_share_query_cache(mock_logger, mock_generator):
+    cache = QueryEmbeddingCache(mock_logger)
+    mock_generator.create_embedding.return_value = [1.0, 0.0]
+    embeddings = CachedQueryEmbeddings(mock_generator, cache)
+
+    cache.put("запрос", [0.5, 0.5])
+
+    assert embeddings.embed_query("Запрос") == [0.5, 0.5]
+    assert embeddings.embed_query("другой") == [1.0, 0.0]
+    mock_generator.create_embedding.assert_called_once_with("другой")
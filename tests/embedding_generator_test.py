@@ -0,0 +1,88 @@
+import pytest
+import openai
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from bot.packages.embedding_generator import OpenAIEmbeddingGenerator
+from bot.packages.my_logger import StandardLogger
+
+@pytest.fixture
+def mock_logger():
+    return MagicMock(StandardLogger)
+
+@pytest.fixture
+def generator(mock_logger, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(OpenAIEmbeddingGenerator, "load_encoding", lambda self: None)
+    # Отключаем ожидание между повторами
+    monkeypatch.setattr(OpenAIEmbeddingGenerator.embed_batch.retry, "sleep", lambda seconds: None)
+    generator = OpenAIEmbeddingGenerator(mock_logger)
+    generator.client = MagicMock()
+    return generator
+
+def make_response(inputs):
+    # Возвращаем данные в обратном порядке, как это может сделать API
+    data = [SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(inputs)]
+    return SimpleNamespace(data=list(reversed(data)))
+
+def test_split_into_batches_respects_limits(generator):
+    generator.max_inputs_per_request = 3
+    generator.max_tokens_per_request = 10
+
+    batches = generator.split_into_batches(["aaaa", "bbbb", "ccc", "d", "e", "f", "gggggggggg"])
+
+    assert batches == [[0, 1], [2, 3, 4], [5], [6]]
+
+def test_create_embeddings_batch_keeps_order(generator):
+    generator.max_inputs_per_request = 2
+    generator.client.embeddings.create.side_effect = lambda model, input, dimensions: make_response(input)
+
+    vectors = generator.create_embeddings_batch(["a", "bb", "ccc", "dddd", "eeeee"])
+
+    assert vectors == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert generator.client.embeddings.create.call_count == 3
+
+def test_only_failed_batch_is_retried(generator):
+    generator.max_inputs_per_request = 2
+    calls = []
+
+    def create(model, input, dimensions):
+        calls.append(list(input))
+        if input == ["ccc"] and calls.count(["ccc"]) == 1:
+            raise openai.APIConnectionError(request=MagicMock())
+        return make_response(input)
+
+    generator.client.embeddings.create.side_effect = create
+
+    vectors = generator.create_embeddings_batch(["a", "bb", "ccc"])
+
+    assert vectors == [[1.0], [2.0], [3.0]]
+    assert calls == [["a", "bb"], ["ccc"], ["ccc"]]
+
+def test_failed_batch_returns_none(generator, mock_logger):
+    generator.max_inputs_per_request = 1
+
+    def create(model, input, dimensions):
+        if input == ["bad"]:
+            raise ValueError("bad input")
+        return make_response(input)
+
+    generator.client.embeddings.create.side_effect = create
+
+    vectors = generator.create_embeddings_batch(["ok", "bad"])
+
+    assert vectors == [[2.0], None]
+    mock_logger.critical.assert_called_once()
+
+def test_known_token_counts_skip_tokenizer(generator, monkeypatch):
+    generator.max_tokens_per_request = 10
+    generator.client.embeddings.create.side_effect = lambda model, input, dimensions: make_response(input)
+    counted = []
+    monkeypatch.setattr(generator, "count_tokens", lambda text: counted.append(text) or len(text))
+
+    vectors = generator.create_embeddings_batch(["a", "b", "c"], token_counts=[6, 4, None])
+
+    assert vectors == [[1.0], [1.0], [1.0]]
+    # Пакеты собраны по переданным количествам токенов, токенизатор вызван только для текста без него
+    assert [call.kwargs["input"] for call in generator.client.embeddings.create.call_args_list] == [["a", "b"], ["c"]]
+    assert counted == ["c"]
@@ -0,0 +1,153 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from bot.packages.ingestion_jobs import (
+    IngestionJobStore, IngestionJobQueue, IngestionProcessor, IngestionError,
+    JOB_KIND_FILE, JOB_KIND_URL, JOB_DONE, JOB_FAILED, JOB_CANCELLED, JOB_RUNNING
+)
+from bot.packages.ingestion_pipeline import IngestionPipeline
+from bot.packages.lance_vector_db import LanceVectorDB
+from bot.packages.my_logger import StandardLogger
+from bot.packages.table_registry import LanceTableRegistry
+from bot.packages.text_pocessor import TextProcessor
+
+@pytest.fixture
+def mock_logger():
+    return MagicMock(StandardLogger)
+
+@pytest.fixture
+def store(tmp_path):
+    return IngestionJobStore(tmp_path / "jobs.sqlite")
+
+async def wait_for_state(store, job_id, state):
+    for _ in range(200):
+        if store.get(job_id)["state"] == state:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Задача {job_id} не перешла в состояние {state}")
+
+@pytest.mark.asyncio
+async def test_job_runs_in_background_and_reports_progress(mock_logger, store):
+    async def process(job, progress):
+        await progress(1, 2)
+        await progress(2, 2)
+        return "Готово"
+
+    processor = MagicMock()
+    processor.process = AsyncMock(side_effect=process)
+    queue = IngestionJobQueue(mock_logger, store, processor, workers=1)
+    notifier = AsyncMock()
+    queue.set_notifier(notifier)
+    await queue.start()
+
+    job = queue.enqueue(kind=JOB_KIND_URL, source="https://example.com", name="https://example.com", chat_id=1)
+    await wait_for_state(store, job["id"], JOB_DONE)
+    await queue.stop()
+
+    saved = store.get(job["id"])
+    assert (saved["progress_done"], saved["progress_total"]) == (2, 2)
+    texts = [call.args[1] for call in notifier.await_args_list]
+    assert texts[-2:] == [f"⏳ Задача {job['id']}: страница 2/2", "✅ Готово"]
+
+@pytest.mark.asyncio
+async def test_failed_job_stores_error(mock_logger, store):
+    processor = MagicMock()
+    processor.process = AsyncMock(side_effect=IngestionError("Ссылка не информативна"))
+    queue = IngestionJobQueue(mock_logger, store, processor, workers=1)
+    await queue.start()
+
+    job = queue.enqueue(kind=JOB_KIND_URL, source="https://example.com", name="https://example.com")
+    await wait_for_state(store, job["id"], JOB_FAILED)
+    await queue.stop()
+
+    assert store.get(job["id"])["error"] == "Ссылка не информативна"
+
+@pytest.mark.asyncio
+async def test_running_job_can_be_cancelled(mock_logger, store):
+    started = asyncio.Event()
+
+    async def process(job, progress):
+        started.set()
+        await asyncio.sleep(10)
+
+    processor = MagicMock()
+    processor.process = AsyncMock(side_effect=process)
+    queue = IngestionJobQueue(mock_logger, store, processor, workers=1)
+    await queue.start()
+
+    job = queue.enqueue(kind=JOB_KIND_URL, source="https://example.com", name="https://example.com")
+    await started.wait()
+    assert queue.cancel(job["id"])
+    await wait_for_state(store, job["id"], JOB_CANCELLED)
+    await queue.stop()
+
+@pytest.mark.asyncio
+async def test_unfinished_jobs_resume_after_restart(mock_logger, store):
+    processor = MagicMock()
+    processor.process = AsyncMock(return_value="Готово")
+    queue = IngestionJobQueue(mock_logger, store, processor, workers=1)
+    queue.queue = asyncio.Queue()
+    queued = queue.enqueue(kind=JOB_KIND_URL, source="https://a.com", name="https://a.com")
+    interrupted = queue.enqueue(kind=JOB_KIND_URL, source="https://b.com", name="https://b.com")
+    store.update(interrupted["id"], state=JOB_RUNNING)
+
+    restarted = IngestionJobQueue(mock_logger, store, processor, workers=1)
+    await restarted.start()
+    await wait_for_state(store, queued["id"], JOB_DONE)
+    await wait_for_state(store, interrupted["id"], JOB_DONE)
+    await restarted.stop()
+
+@pytest.mark.asyncio
+async def test_file_job_survives_shutdown_mid_job(mock_logger, store, tmp_path):
+    source = tmp_path / "report.txt"
+    source.write_text("текст", encoding="utf-8")
+    started = asyncio.Event()
+
+    async def interrupted(job, progress):
+        started.set()
+        await asyncio.sleep(10)
+
+    async def completed(job, progress):
+        assert source.exists()
+        return "Готово"
+
+    processor = MagicMock()
+    processor.process = AsyncMock(side_effect=interrupted)
+    queue = IngestionJobQueue(mock_logger, store, processor, workers=1)
+    await queue.start()
+    job = queue.enqueue(kind=JOB_KIND_FILE, source=str(source), name="report.txt")
+    await started.wait()
+    await queue.stop()
+
+    assert store.get(job["id"])["state"] == JOB_RUNNING
+    assert source.exists()
+
+    processor.process = AsyncMock(side_effect=completed)
+    restarted = IngestionJobQueue(mock_logger, store, processor, workers=1)
+    await restarted.start()
+    await wait_for_state(store, job["id"], JOB_DONE)
+    await restarted.stop()
+
+    assert not source.exists()
+
+@pytest.mark.asyncio
+async def test_job_with_failed_chunks_is_not_done(mock_logger, store, tmp_path):
+    generator = MagicMock(spec=["create_embeddings_batch"])
+    generator.create_embeddings_batch.side_effect = lambda texts, token_counts=None: [None for _ in texts]
+    lance_db = LanceVectorDB(mock_logger, generator)
+    registry = LanceTableRegistry(mock_logger, lance_db, db_path=str(tmp_path / "lancedb"))
+    html_processor = MagicMock()
+    html_processor.download = AsyncMock(return_value=("<p>Текст страницы.</p>", 200))
+    html_cleaner = MagicMock()
+    html_cleaner.clean.return_value = "Текст страницы."
+    pipeline = IngestionPipeline(mock_logger, TextProcessor(mock_logger), lance_db)
+    processor = IngestionProcessor(mock_logger, html_processor, html_cleaner, MagicMock(), pipeline, registry)
+    queue = IngestionJobQueue(mock_logger, store, processor, workers=1)
+    await queue.start()
+
+    job = queue.enqueue(kind=JOB_KIND_URL, source="https://example.com", name="https://example.com")
+    await wait_for_state(store, job["id"], JOB_FAILED)
+    await queue.stop()
+
+    assert store.get(job["id"])["error"].startswith("Не удалось сохранить 1 из 1")
@@ -0,0 +1,79 @@
+import pytest
+from unittest.mock import MagicMock
+
+from bot.packages.ingestion_pipeline import IngestionPipeline
+from bot.packages.lance_vector_db import LanceVectorDB, VECTOR_DIMENSIONS
+from bot.packages.my_logger import StandardLogger
+from bot.packages.text_pocessor import TextProcessor
+from common import file_utils
+from common.file_utils import FileUtilities
+
+@pytest.fixture
+def mock_logger():
+    return MagicMock(StandardLogger)
+
+@pytest.fixture
+def lance_db(tmp_path, mock_logger):
+    generator = MagicMock(spec=["create_embeddings_batch"])
+    generator.create_embeddings_batch.side_effect = lambda texts, token_counts=None: [[1.0] * VECTOR_DIMENSIONS for _ in texts]
+    lance_db = LanceVectorDB(mock_logger, generator)
+    lance_db.connect_db(db_path=str(tmp_path / "lancedb"))
+    lance_db.check_and_create_table("from_txt")
+    lance_db.select_table("from_txt")
+    return lance_db
+
+@pytest.fixture
+def txt_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_utils, "TXT_DIR", tmp_path)
+    return tmp_path
+
+@pytest.mark.asyncio
+async def test_pipeline_ingests_segments_and_archives_text(mock_logger, lance_db, txt_dir):
+    file_utilities = FileUtilities(mock_logger)
+    pipeline = IngestionPipeline(mock_logger, TextProcessor(mock_logger), lance_db, file_utilities, chunk_size=50, chunk_overlap=0)
+    segments = ["".join(f"Предложение {i} первой страницы. " for i in range(5)), "".join(f"Предложение {i} второй страницы. " for i in range(5))]
+    progress = []
+
+    async def on_progress(done, total):
+        progress.append((done, total))
+
+    report = await pipeline.aingest("doc.pdf", iter(segments), lance_db.get_table(), progress_callback=on_progress)
+
+    assert report["inserted"] == lance_db.get_table().count_rows() > 0
+    assert progress[0] == (0, 0)
+    assert progress[-1] == (report["inserted"], 0)
+    archive = txt_dir / f"{file_utilities.encode_filename_base64('doc.pdf')}.txt"
+    assert archive.read_text(encoding="utf-8") == "".join(segments)
+
+@pytest.mark.asyncio
+async def test_pipeline_reports_pages_without_listing_chunks(mock_logger, lance_db, txt_dir):
+    pipeline = IngestionPipeline(mock_logger, TextProcessor(mock_logger), lance_db, chunk_size=50, chunk_overlap=0)
+    lance_db.stream_batch_size = 2
+    pulled = []
+
+    def pages():
+        for i in range(4):
+            pulled.append(i)
+            yield "".join(f"Предложение {j} страницы {i}. " for j in range(20))
+
+    progress = []
+
+    async def on_progress(done, total):
+        # Страницы читаются по мере загрузки, а не все до первого отчёта
+        progress.append((done, total, len(pulled)))
+
+    await pipeline.aingest("doc.pdf", pages(), lance_db.get_table(), progress_callback=on_progress, total_segments=4)
+
+    assert progress[0] == (0, 4, 0)
+    assert progress[1][2] < 4
+    assert progress[-1][:2] == (4, 4)
+    assert [done for done, _, _ in progress] == sorted(done for done, _, _ in progress)
+
+@pytest.mark.asyncio
+async def test_pipeline_without_archive_writes_no_files(mock_logger, lance_db, txt_dir):
+    pipeline = IngestionPipeline(mock_logger, TextProcessor(mock_logger), lance_db, FileUtilities(mock_logger), archive_txt=False)
+
+    await pipeline.aingest("https://example.com", ["Текст страницы."], lance_db.get_table())
+
+    assert lance_db.get_table().count_rows() == 1
+    assert list(txt_dir.glob("*.txt")) == []
@@ -0,0 +1,335 @@
+import numpy as np
+import pytest
+from unittest.mock import MagicMock
+
+from langchain_core.documents import Document
+from lancedb.index import BTree
+
+from bot.packages.lance_vector_db import LanceVectorDB, VECTOR_DIMENSIONS, mmr_select
+from bot.packages.my_logger import StandardLogger
+
+@pytest.fixture
+def mock_logger():
+    return MagicMock(StandardLogger)
+
+@pytest.fixture
+def mock_generator():
+    generator = MagicMock()
+    generator.create_embeddings_batch.side_effect = lambda texts, token_counts=None: [
+        None if text == "broken" else [float(len(text))] * VECTOR_DIMENSIONS for text in texts
+    ]
+    return generator
+
+@pytest.fixture
+def lance_db(tmp_path, mock_logger, mock_generator):
+    lance_db = LanceVectorDB(mock_logger, mock_generator)
+    lance_db.connect_db(db_path=str(tmp_path / "lancedb"))
+    lance_db.check_and_create_table("from_txt")
+    lance_db.select_table("from_txt")
+    return lance_db
+
+def test_fill_table_commits_chunks_in_one_write(lance_db):
+    table = lance_db.get_table()
+    version = table.version
+    chunks = [Document(page_content=f"chunk {i}") for i in range(10)]
+
+    report = lance_db.fill_table(filename="doc", chunks=chunks, current_table=table)
+
+    assert report == {"inserted": 10, "skipped": 0, "deleted": 0, "failed": {}}
+    assert table.count_rows() == 10
+    assert table.version == version + 1
+
+def test_fill_table_splits_writes_by_size(lance_db):
+    table = lance_db.get_table()
+    version = table.version
+    lance_db.max_rows_per_write = 4
+    chunks = [Document(page_content=f"chunk {i}") for i in range(10)]
+
+    lance_db.fill_table(filename="doc", chunks=chunks, current_table=table)
+
+    assert table.count_rows() == 10
+    assert table.version == version + 3
+
+def test_fill_table_reports_failed_chunks(lance_db):
+    table = lance_db.get_table()
+    chunks = [Document(page_content="first"), Document(page_content="broken"), Document(page_content="third")]
+
+    report = lance_db.fill_table(filename="doc", chunks=chunks, current_table=table)
+
+    assert report["inserted"] == 2
+    assert list(report["failed"]) == [1]
+    assert sorted(table.to_pandas()["text"]) == ["first", "third"]
+
+def test_reingest_embeds_only_changed_chunks(lance_db, mock_generator):
+    table = lance_db.get_table()
+    lance_db.fill_table(filename="doc", chunks=[Document(page_content=t) for t in ["a", "b", "c"]], current_table=table)
+    lance_db.fill_table(filename="other", chunks=[Document(page_content="a")], current_table=table)
+    mock_generator.create_embeddings_batch.reset_mock()
+
+    report = lance_db.fill_table(filename="doc", chunks=[Document(page_content=t) for t in ["b", "c", "d"]], current_table=table)
+
+    mock_generator.create_embeddings_batch.assert_called_once_with(["d"], token_counts=[None])
+    assert report == {"inserted": 1, "skipped": 2, "deleted": 1, "failed": {}}
+    rows = table.to_pandas()
+    assert sorted(rows[rows["doc_name"] == "doc"]["text"]) == ["b", "c", "d"]
+    assert list(rows[rows["doc_name"] == "other"]["text"]) == ["a"]
+
+def test_reingest_unchanged_document_does_not_write(lance_db):
+    table = lance_db.get_table()
+    chunks = [Document(page_content=t) for t in ["a", "b"]]
+    lance_db.fill_table(filename="doc's page", chunks=chunks, current_table=table)
+    # Фоновое построение индексов тоже создаёт версии таблицы
+    lance_db.index_future.result()
+    version = table.version
+
+    report = lance_db.fill_table(filename="doc's page", chunks=chunks, current_table=table)
+
+    assert report["skipped"] == 2
+    assert table.version == version
+    assert table.count_rows() == 2
+
+def test_reingest_removes_duplicate_copies(lance_db):
+    table = lance_db.get_table()
+    chunks = [Document(page_content=t) for t in ["a", "b"]]
+    # Старое поведение: повторная загрузка дописывала копии
+    for _ in range(2):
+        lance_db.insert_chunks("doc", list(enumerate(chunks)), [[0.0] * VECTOR_DIMENSIONS] * 2, table)
+
+    lance_db.fill_table(filename="doc", chunks=chunks, current_table=table)
+
+    assert sorted(table.to_pandas()["text"]) == ["a", "b"]
+
+def test_failed_rewrite_keeps_document(lance_db, monkeypatch):
+    table = lance_db.get_table()
+    chunks = [Document(page_content=t) for t in ["a", "b"]]
+    for _ in range(2):
+        lance_db.insert_chunks("doc", list(enumerate(chunks)), [[0.0] * VECTOR_DIMENSIONS] * 2, table)
+
+    def failing_add(*args, **kwargs):
+        raise OSError("диск заполнен")
+    monkeypatch.setattr(table, "add", failing_add)
+    report = lance_db.fill_table(filename="doc", chunks=chunks + [Document(page_content="c")], current_table=table)
+
+    assert list(report["failed"]) == [2]
+    assert sorted(table.to_pandas()["text"]) == ["a", "a", "b", "b"]
+
+def test_failed_streamed_rewrite_keeps_document(lance_db, monkeypatch):
+    table = lance_db.get_table()
+    chunks = [Document(page_content=t) for t in ["a", "b"]]
+    for _ in range(2):
+        lance_db.insert_chunks("doc", list(enumerate(chunks)), [[0.0] * VECTOR_DIMENSIONS] * 2, table)
+
+    def failing_add(*args, **kwargs):
+        raise OSError("диск заполнен")
+    monkeypatch.setattr(table, "add", failing_add)
+    report = lance_db.fill_table_stream(filename="doc", chunks=iter(chunks), current_table=table)
+
+    assert sorted(report["failed"]) == [0, 1]
+    assert sorted(table.to_pandas()["text"]) == ["a", "a", "b", "b"]
+
+    monkeypatch.undo()
+    lance_db.fill_table_stream(filename="doc", chunks=iter(chunks), current_table=table)
+
+    assert sorted(table.to_pandas()["text"]) == ["a", "b"]
+
+def test_fill_table_stream_consumes_generator_in_groups(lance_db, mock_generator):
+    table = lance_db.get_table()
+    lance_db.fill_table(filename="doc", chunks=[Document(page_content=t) for t in ["a", "b", "stale"]], current_table=table)
+    mock_generator.create_embeddings_batch.reset_mock()
+    lance_db.stream_batch_size = 2
+
+    chunks = (Document(page_content=t) for t in ["a", "b", "c", "d", "e"])
+    report = lance_db.fill_table_stream(filename="doc", chunks=chunks, current_table=table)
+
+    assert [call.args[0] for call in mock_generator.create_embeddings_batch.call_args_list] == [["c", "d"], ["e"]]
+    assert report == {"inserted": 3, "skipped": 2, "deleted": 1, "failed": {}}
+    assert sorted(table.to_pandas()["text"]) == ["a", "b", "c", "d", "e"]
+
+def test_fill_table_stores_token_count(lance_db):
+    table = lance_db.get_table()
+    chunks = [Document(page_content="first", metadata={"token_count": 7}), Document(page_content="second")]
+
+    lance_db.fill_table(filename="doc", chunks=chunks, current_table=table)
+
+    rows = table.to_arrow().sort_by("text").to_pylist()
+    assert [(row["text"], row["token_count"]) for row in rows] == [("first", 7), ("second", None)]
+
+def test_existing_table_gets_new_columns(tmp_path, mock_logger, mock_generator):
+    import lancedb
+    import pyarrow as pa
+    old_schema = pa.schema([field for field in LanceVectorDB(mock_logger, mock_generator).get_schema() if field.name != "token_count"])
+    lancedb.connect(str(tmp_path / "lancedb")).create_table("from_txt", schema=old_schema)
+
+    lance_db = LanceVectorDB(mock_logger, mock_generator)
+    lance_db.connect_db(db_path=str(tmp_path / "lancedb"))
+    lance_db.check_and_create_table("from_txt")
+    lance_db.select_table("from_txt")
+
+    assert "token_count" in lance_db.get_table().schema.names
+
+def unit_vector(**components):
+    vector = [0.0] * VECTOR_DIMENSIONS
+    for index, value in components.items():
+        vector[int(index.lstrip("d"))] = value
+    return vector
+
+def test_two_stage_search_rescores_with_full_vectors(tmp_path, mock_logger):
+    vectors = {
+        "prefix match": unit_vector(d0=1.0),
+        "full match": unit_vector(d0=0.9, d1=0.1, d5=1.0)
+    }
+    generator = MagicMock()
+    generator.create_embeddings_batch.side_effect = lambda texts, token_counts=None: [vectors[text] for text in texts]
+    generator.create_embedding.return_value = unit_vector(d0=1.0, d5=1.0)
+    lance_db = LanceVectorDB(mock_logger, generator, vector_dtype="float16", prefix_dimensions=2, memory_search_rows=0)
+    lance_db.connect_db(db_path=str(tmp_path / "lancedb"))
+    lance_db.check_and_create_table("from_txt")
+    lance_db.select_table("from_txt")
+    table = lance_db.get_table()
+
+    lance_db.fill_table(filename="doc", chunks=[Document(page_content=text) for text in vectors], current_table=table)
+    results = lance_db.search_in_table("query", limit=1)
+
+    assert str(table.schema.field("vector").type.value_type) == "halffloat"
+    assert table.schema.field("vector_short").type.list_size == 2
+    assert list(results["text"]) == ["full match"]
+    assert "vector_short" not in results.columns
+
+def test_index_is_built_only_above_threshold(tmp_path, mock_logger):
+    generator = MagicMock()
+    generator.create_embeddings_batch.side_effect = lambda texts, token_counts=None: [[float(i % 7), float(i % 5)] + [0.5] * (VECTOR_DIMENSIONS - 2) for i in range(len(texts))]
+    lance_db = LanceVectorDB(mock_logger, generator, index_min_rows=300)
+    lance_db.connect_db(db_path=str(tmp_path / "lancedb"))
+    lance_db.check_and_create_table("from_txt")
+    lance_db.select_table("from_txt")
+    table = lance_db.get_table()
+
+    lance_db.fill_table(filename="first", chunks=[Document(page_content=f"first {i}") for i in range(200)], current_table=table)
+    lance_db.index_future.result()
+    assert lance_db.get_index_state(table)["index_type"] is None
+
+    lance_db.fill_table(filename="second", chunks=[Document(page_content=f"second {i}") for i in range(200)], current_table=table)
+    lance_db.index_future.result()
+    lance_db.close()
+
+    state = lance_db.get_index_state(table)
+    assert state["index_type"] == "IVF_PQ"
+    assert (state["indexed_rows"], state["unindexed_rows"]) == (400, 0)
+
+def test_hybrid_search_finds_exact_terms(tmp_path, mock_logger):
+    vectors = {
+        "Оплата банковской картой": unit_vector(d0=1.0),
+        "Ошибка E-1042 при переводе": unit_vector(d1=1.0),
+        "Кредитный лимит": unit_vector(d2=1.0)
+    }
+    generator = MagicMock()
+    generator.create_embeddings_batch.side_effect = lambda texts, token_counts=None: [vectors[text] for text in texts]
+    generator.create_embedding.return_value = unit_vector(d0=1.0)
+    lance_db = LanceVectorDB(mock_logger, generator)
+    lance_db.connect_db(db_path=str(tmp_path / "lancedb"))
+    lance_db.check_and_create_table("from_txt")
+    lance_db.select_table("from_txt")
+    table = lance_db.get_table()
+
+    lance_db.fill_table(filename="doc", chunks=[Document(page_content=text) for text in vectors], current_table=table)
+    lance_db.index_future.result()
+
+    assert list(lance_db.search_in_table("E-1042", limit=1, mode="vector")["text"]) == ["Оплата банковской картой"]
+    assert list(lance_db.search_in_table("E-1042", limit=1, mode="hybrid")["text"]) == ["Ошибка E-1042 при переводе"]
+    assert lance_db.get_index_state(table, "text")["index_type"] == "FTS"
+    lance_db.close()
+
+def test_build_filter_translates_and_rejects_keys(mock_logger, mock_generator):
+    lance_db = LanceVectorDB(mock_logger, mock_generator)
+
+    where = lance_db.build_filter({"source": "O'Reilly", "token_count": {"$gte": 10, "$lt": 500}})
+
+    assert where == "doc_name = 'O''Reilly' AND token_count >= 10 AND token_count < 500"
+    assert lance_db.build_filter({"doc_name": ["a", "b"]}) == "doc_name IN ('a', 'b')"
+    assert lance_db.build_filter({}) is None
+    with pytest.raises(ValueError, match="category"):
+        lance_db.build_filter({"category": "finance"})
+    with pytest.raises(ValueError):
+        lance_db.build_filter({"token_count": "много"})
+
+def test_filtered_search_uses_scalar_indexes(lance_db):
+    table = lance_db.get_table()
+    lance_db.fill_table(filename="first", chunks=[Document(page_content=f"first {i}") for i in range(5)], current_table=table)
+    lance_db.fill_table(filename="second", chunks=[Document(page_content=f"second {i}") for i in range(5)], current_table=table)
+    lance_db.index_future.result()
+    lance_db.ensure_index(table)
+    lance_db.embedding_generator.create_embedding.return_value = [1.0] * VECTOR_DIMENSIONS
+
+    results = lance_db.search_in_table("query", limit=10, mode="vector", metadata_filter={"doc_name": "second"})
+
+    assert set(results["doc_name"]) == {"second"}
+    assert len(results) == 5
+    assert lance_db.get_index_state(table, "doc_name")["index_type"] == "BITMAP"
+    assert lance_db.get_index_state(table, "chunk_id")["index_type"] == "BTREE"
+    lance_db.close()
+
+def test_scalar_index_type_change_replaces_old_index(lance_db):
+    table = lance_db.get_table()
+    lance_db.fill_table(filename="first", chunks=[Document(page_content=f"first {i}") for i in range(5)], current_table=table)
+    lance_db.index_future.result()
+    table.drop_index(next(index.name for index in table.list_indices() if list(index.columns) == ["doc_name"]))
+    table.create_index("doc_name", config=BTree(), replace=True)
+
+    lance_db.ensure_index(table)
+
+    doc_indexes = [index for index in table.list_indices() if list(index.columns) == ["doc_name"]]
+    assert len(doc_indexes) == 1
+    assert lance_db.get_index_state(table, "doc_name")["index_type"] == "BITMAP"
+    lance_db.close()
+
+def test_mmr_select_skips_near_duplicates():
+    query = np.array([1.0, 0.0, 0.0])
+    candidates = np.array([
+        [0.9, 0.1, 0.0],
+        [0.9, 0.11, 0.0],
+        [0.6, 0.0, 0.8]
+    ])
+
+    assert mmr_select(query, candidates, 2) == [0, 2]
+    assert mmr_select(query, candidates, 2, lambda_mult=1.0) == [0, 1]
+
+def test_search_table_diversifies_neighbouring_chunks(tmp_path, mock_logger):
+    vectors = {
+        "первый фрагмент": unit_vector(d0=1.0),
+        "соседний фрагмент": unit_vector(d0=1.0, d1=0.01),
+        "другой раздел": unit_vector(d0=1.0, d2=0.9)
+    }
+    generator = MagicMock()
+    generator.create_embeddings_batch.side_effect = lambda texts, token_counts=None: [vectors[text] for text in texts]
+    lance_db = LanceVectorDB(mock_logger, generator)
+    lance_db.connect_db(db_path=str(tmp_path / "lancedb"))
+    lance_db.check_and_create_table("from_txt")
+    lance_db.select_table("from_txt")
+    table = lance_db.get_table()
+    lance_db.fill_table(filename="doc", chunks=[Document(page_content=text) for text in vectors], current_table=table)
+
+    plain = lance_db.search_table(table, "запрос", unit_vector(d0=1.0, d2=0.3), 2)
+    diverse = lance_db.search_table(table, "запрос", unit_vector(d0=1.0, d2=0.3), 2, diversify=True)
+
+    assert list(plain["text"]) == ["первый фрагмент", "соседний фрагмент"]
+    assert list(diverse["text"]) == ["первый фрагмент", "другой раздел"]
+
+def test_delete_documents_and_list_sources(lance_db):
+    table = lance_db.get_table()
+    for name in ["first", "second", "third"]:
+        lance_db.fill_table(filename=name, chunks=[Document(page_content=f"{name} {i}") for i in range(2)], current_table=table)
+
+    deleted = lance_db.delete_documents(table, ["first", "third", "missing"])
+
+    assert deleted == 4
+    assert lance_db.list_documents(table) == [{"doc_name": "second", "chunks": 2, "expires_at": None}]
+
+def test_delete_expired_documents(lance_db):
+    table = lance_db.get_table()
+    lance_db.fill_table(filename="https://example.com/page", chunks=[Document(page_content="страница")], current_table=table)
+    lance_db.fill_table(filename="report", chunks=[Document(page_content="отчёт")], current_table=table)
+    lance_db.set_document_expiry(table, "https://example.com/page", 100.0)
+
+    assert lance_db.delete_expired(table, now=99.0) == []
+    assert lance_db.delete_expired(table, now=100.0) == ["https://example.com/page"]
+    assert [document["doc_name"] for document in lance_db.list_documents(table)] == ["report"]
@@ -0,0 +1,77 @@
+import pytest
+from unittest.mock import MagicMock
+
+from langchain_core.documents import Document
+
+from bot.packages.lance_vector_db import LanceVectorDB, VECTOR_DIMENSIONS
+from bot.packages.memory_search import InMemoryVectorIndex
+from bot.packages.my_logger import StandardLogger
+
+@pytest.fixture
+def mock_logger():
+    return MagicMock(StandardLogger)
+
+@pytest.fixture
+def lance_db(tmp_path, mock_logger):
+    generator = MagicMock()
+    generator.create_embeddings_batch.side_effect = lambda texts, token_counts=None: [
+        [float(len(text)), float(sum(map(ord, text)) % 17)] + [0.1] * (VECTOR_DIMENSIONS - 2) for text in texts
+    ]
+    lance_db = LanceVectorDB(mock_logger, generator, memory_search_rows=0)
+    lance_db.connect_db(db_path=str(tmp_path / "lancedb"))
+    lance_db.check_and_create_table("from_txt")
+    lance_db.select_table("from_txt")
+    return lance_db
+
+def query_vector():
+    return [5.0, 3.0] + [0.1] * (VECTOR_DIMENSIONS - 2)
+
+def test_memory_search_matches_lancedb(lance_db, mock_logger):
+    table = lance_db.get_table()
+    lance_db.fill_table(filename="doc", chunks=[Document(page_content=f"чанк {'x' * i}") for i in range(30)], current_table=table)
+    index = InMemoryVectorIndex(mock_logger)
+
+    expected = lance_db.search_vectors(table, query_vector(), 5)
+    results = index.search(table, query_vector(), 5)
+
+    assert list(results["chunk_id"]) == list(expected["chunk_id"])
+    assert results["_distance"].to_numpy() == pytest.approx(expected["_distance"].to_numpy(), rel=1e-4)
+    assert list(results.columns) == list(expected.columns)
+
+def test_memory_search_refreshes_after_changes(lance_db, mock_logger):
+    table = lance_db.get_table()
+    lance_db.fill_table(filename="first", chunks=[Document(page_content="первый")], current_table=table)
+    lance_db.fill_table(filename="second", chunks=[Document(page_content="второй")], current_table=table)
+    index = InMemoryVectorIndex(mock_logger)
+    assert len(index.search(table, query_vector(), 10)) == 2
+
+    lance_db.fill_table(filename="third", chunks=[Document(page_content="третий")], current_table=table)
+    table.delete("doc_name = 'first'")
+
+    assert sorted(index.search(table, query_vector(), 10)["doc_name"]) == ["second", "third"]
+
+def test_memory_search_skips_large_tables(lance_db, mock_logger):
+    table = lance_db.get_table()
+    lance_db.fill_table(filename="doc", chunks=[Document(page_content=f"чанк {i}") for i in range(3)], current_table=table)
+
+    assert InMemoryVectorIndex(mock_logger, max_rows=2).search(table, query_vector(), 1) is None
+
+def test_memory_search_evicts_least_recently_used_tables(lance_db, mock_logger):
+    tables = []
+    for name in ["chat_1", "chat_2", "chat_3"]:
+        lance_db.check_and_create_table(name)
+        lance_db.select_table(name)
+        table = lance_db.get_table()
+        lance_db.fill_table(filename="doc", chunks=[Document(page_content=f"{name} чанк {i}") for i in range(3)], current_table=table)
+        tables.append(table)
+    index = InMemoryVectorIndex(mock_logger)
+    index.search(tables[0], query_vector(), 1)
+    # Бюджет вмещает два снимка, но не три
+    index.max_bytes = int(2.5 * index.total_bytes)
+
+    index.search(tables[1], query_vector(), 1)
+    index.search(tables[0], query_vector(), 1)
+    index.search(tables[2], query_vector(), 1)
+
+    assert list(index.snapshots) == [tables[0].uri, tables[2].uri]
+    assert index.total_bytes == sum(snapshot.nbytes for snapshot in index.snapshots.values())
@@ -0,0 +1,86 @@
+import pytest
+from unittest.mock import MagicMock, patch
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from bot.packages.my_logger import StandardLogger
+from bot.packages.rag_bot import RAGAgent, RAGBotHandler
+
+@pytest.fixture
+def mock_logger():
+    return MagicMock(StandardLogger)
+
+@patch("bot.packages.rag_bot.ChatOpenAI")
+def test_search_graph_built_once_per_store(chat_openai, mock_logger):
+    agent = RAGAgent(mock_logger)
+    first_store, second_store = MagicMock(), MagicMock()
+
+    graph = agent.get_search_agent_graph(first_store)
+
+    assert agent.get_search_agent_graph(first_store) is graph
+    assert agent.get_search_agent_graph(second_store) is not graph
+    # Клиент модели общий для всех хранилищ
+    assert chat_openai.call_count == 1
+
+@patch("bot.packages.rag_bot.ChatOpenAI")
+def test_analysis_model_reused(chat_openai, mock_logger):
+    chat_openai.return_value = FakeListChatModel(responses=["анализ"])
+    agent = RAGAgent(mock_logger)
+
+    agent.raw_analyze_documents("первый")
+    agent.raw_analyze_documents("второй")
+
+    assert chat_openai.call_count == 1
+
+@pytest.mark.parametrize("question, route", [
+    ("Что такое векторный индекс?", "fast"),
+    ("Как настроить бота", "fast"),
+    ("Что написано в документе report?", "agent"),
+    ("Кратко перескажи notes.txt", "agent"),
+    ("О чём статья https://example.com/post", "agent"),
+    ("Сравни два подхода к поиску", "agent"),
+])
+def test_route_query(mock_logger, question, route):
+    assert RAGAgent(mock_logger).route_query(question) == route
+
+def test_route_query_without_fast_path(mock_logger):
+    assert RAGAgent(mock_logger, fast_path=False).route_query("Что такое векторный индекс?") == "agent"
+
+@patch("bot.packages.rag_bot.ChatOpenAI")
+def test_fast_path_searches_and_answers_with_one_call(chat_openai, mock_logger):
+    chat_openai.return_value = FakeListChatModel(responses=["ответ"])
+    agent = RAGAgent(mock_logger)
+    agent.raw_search_documents = MagicMock(return_value="Документ 1: индекс")
+
+    state = agent.run_search_agent("Что такое векторный индекс?", MagicMock())
+
+    agent.raw_search_documents.assert_called_once()
+    assert state["messages"][-1].content == "ответ"
+    assert state["status"] == "completed"
+    assert len(agent.search_graphs) == 0
+
+def test_chat_routes_evict_least_recently_used(mock_logger):
+    agent = MagicMock()
+    agent.connect_to_registry.side_effect = lambda *args, **kwargs: MagicMock()
+    answer_cache = MagicMock()
+    answer_cache.empty_copy.side_effect = lambda: MagicMock()
+    handler = RAGBotHandler(agent, mock_logger, "./data/lancedb", answer_cache=answer_cache, per_chat=True, max_chat_routes=2)
+
+    first = handler.route(1)
+    handler.route(2)
+    assert handler.route(1) is first
+    handler.route(3)
+
+    assert list(handler.chat_routes) == ["chat_1", "chat_3"]
+    agent.release_search_graph.assert_called_once()
+    agent.table_registry.release_table.assert_called_once_with("chat_2")
+
+@patch("bot.packages.rag_bot.ChatOpenAI")
+def test_released_store_drops_its_graph(chat_openai, mock_logger):
+    agent = RAGAgent(mock_logger)
+    store = MagicMock()
+    agent.get_search_agent_graph(store)
+
+    agent.release_search_graph(store)
+
+    assert agent.search_graphs == {}
@@ -0,0 +1,55 @@
+import pytest
+from datetime import timedelta
+from unittest.mock import MagicMock
+
+from langchain_core.documents import Document
+
+from bot.packages.lance_vector_db import LanceVectorDB, VECTOR_DIMENSIONS
+from bot.packages.my_logger import StandardLogger
+from bot.packages.table_maintenance import TableMaintenanceScheduler
+from bot.packages.table_registry import LanceTableRegistry
+
+@pytest.fixture
+def mock_logger():
+    return MagicMock(StandardLogger)
+
+@pytest.fixture
+def registry(tmp_path, mock_logger):
+    generator = MagicMock()
+    generator.create_embeddings_batch.side_effect = lambda texts, token_counts=None: [[float(len(text))] * VECTOR_DIMENSIONS for text in texts]
+    lance_db = LanceVectorDB(mock_logger, generator)
+    return LanceTableRegistry(mock_logger, lance_db, db_path=str(tmp_path / "lancedb"))
+
+def test_maintenance_compacts_fragments_and_prunes_versions(registry, mock_logger):
+    table = registry.get_table("from_txt")
+    for i in range(5):
+        registry.lance_db.fill_table(filename=f"doc {i}", chunks=[Document(page_content=f"чанк {i}")], current_table=table)
+    registry.lance_db.index_future.result()
+    scheduler = TableMaintenanceScheduler(mock_logger, registry, registry.lance_db, retention=timedelta(0))
+
+    with pytest.warns(UserWarning):
+        [report] = scheduler.maintain_all()
+
+    assert report["fragments_before"] == 5
+    assert report["fragments_after"] == 1
+    assert report["bytes_after"] < report["bytes_before"]
+    assert report["latency_after_ms"] is not None
+    # Пробный поиск идёт через LanceDB и не загружает таблицу в память
+    assert registry.lance_db.memory_index.snapshots == {}
+    assert len(table.list_versions()) == 1
+    assert table.count_rows() == 5
+
+def test_maintenance_skips_unchanged_tables(registry, mock_logger):
+    registry.get_table("from_txt")
+    scheduler = TableMaintenanceScheduler(mock_logger, registry, registry.lance_db)
+
+    assert len(scheduler.maintain_all()) == 1
+    assert scheduler.maintain_all() == []
+
+def test_maintenance_waits_for_idle(registry, mock_logger):
+    loading = True
+    scheduler = TableMaintenanceScheduler(mock_logger, registry, registry.lance_db, idle_seconds=0, busy=lambda: loading)
+
+    assert not scheduler.is_idle()
+    loading = False
+    assert scheduler.is_idle()
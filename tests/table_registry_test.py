@@ -0,0 +1,94 @@
+import pytest
+from unittest.mock import MagicMock
+
+from langchain_core.documents import Document
+
+from bot.packages.lance_vector_db import LanceVectorDB, VECTOR_DIMENSIONS
+from bot.packages.my_logger import StandardLogger
+from bot.packages.rag_bot import SharedTableLanceDB
+from bot.packages.table_registry import LanceTableRegistry, DEFAULT_TABLE_NAME, chat_table_name
+
+@pytest.fixture
+def mock_logger():
+    return MagicMock(StandardLogger)
+
+@pytest.fixture
+def lance_db(mock_logger):
+    generator = MagicMock()
+    generator.create_embeddings_batch.side_effect = lambda texts, token_counts=None: [[float(len(text))] * VECTOR_DIMENSIONS for text in texts]
+    return LanceVectorDB(mock_logger, generator)
+
+def test_registry_opens_table_once(tmp_path, mock_logger, lance_db):
+    registry = LanceTableRegistry(mock_logger, lance_db, db_path=str(tmp_path / "lancedb"))
+
+    table = registry.get_table("from_txt")
+
+    assert registry.get_table("from_txt") is table
+    assert table.count_rows() == 0
+
+def test_registry_table_sees_writes_from_other_connections(tmp_path, mock_logger, lance_db):
+    db_path = str(tmp_path / "lancedb")
+    registry = LanceTableRegistry(mock_logger, lance_db, db_path=db_path, refresh_interval=0)
+    table = registry.get_table("from_txt")
+
+    # Отдельный процесс загрузки (ingest.py) пишет через своё соединение
+    writer = LanceVectorDB(mock_logger, lance_db.embedding_generator)
+    writer.connect_db(db_path)
+    writer.select_table("from_txt")
+    writer.fill_table(filename="doc", chunks=[Document(page_content="новый чанк")], current_table=writer.get_table())
+
+    assert table.count_rows() == 1
+
+def test_shared_vector_store_uses_registry_table(tmp_path, mock_logger, lance_db):
+    registry = LanceTableRegistry(mock_logger, lance_db, db_path=str(tmp_path / "lancedb"))
+
+    vector_store = SharedTableLanceDB(registry, "from_txt", MagicMock())
+
+    assert vector_store.get_table() is registry.get_table("from_txt")
+
+def test_chat_table_name():
+    assert chat_table_name(None) == "from_txt"
+    assert chat_table_name(42) == "chat_42"
+    assert chat_table_name(-100123) == "chat_m100123"
+
+def test_registry_finds_tables_beyond_first_page(tmp_path, mock_logger, lance_db):
+    registry = LanceTableRegistry(mock_logger, lance_db, db_path=str(tmp_path / "lancedb"))
+    for chat_id in range(12):
+        registry.get_table(chat_table_name(chat_id))
+
+    assert all(registry.lance_db.table_exists(chat_table_name(chat_id)) for chat_id in range(12))
+    assert not registry.has_table(chat_table_name(99))
+
+def test_chat_store_searches_chat_and_shared_collections(tmp_path, mock_logger, lance_db):
+    registry = LanceTableRegistry(mock_logger, lance_db, db_path=str(tmp_path / "lancedb"))
+
+    vector_store = SharedTableLanceDB(registry, "chat_1", MagicMock(), shared_tables=["from_txt"])
+
+    assert [table.name for table in vector_store.get_tables()] == ["chat_1", "from_txt"]
+
+def test_registry_evicts_least_recently_used_tables(tmp_path, mock_logger, lance_db):
+    registry = LanceTableRegistry(mock_logger, lance_db, db_path=str(tmp_path / "lancedb"), max_tables=3)
+    registry.get_table(DEFAULT_TABLE_NAME)
+    registry.get_table("chat_1")
+    registry.get_table("chat_2")
+    registry.get_table("chat_1")
+    registry.get_table("chat_3")
+
+    assert list(registry.open_tables()) == [DEFAULT_TABLE_NAME, "chat_1", "chat_3"]
+
+    registry.release_table("chat_1")
+    registry.release_table(DEFAULT_TABLE_NAME)
+
+    assert list(registry.open_tables()) == [DEFAULT_TABLE_NAME, "chat_3"]
+
+def test_open_all_tables_does_not_cache_tables(tmp_path, mock_logger, lance_db):
+    registry = LanceTableRegistry(mock_logger, lance_db, db_path=str(tmp_path / "lancedb"))
+    shared = registry.get_table(DEFAULT_TABLE_NAME)
+    registry.get_table("chat_1")
+    registry.release_table("chat_1")
+
+    tables = registry.open_all_tables()
+
+    assert set(tables) == {DEFAULT_TABLE_NAME, "chat_1"}
+    assert tables[DEFAULT_TABLE_NAME] is shared
+    assert list(registry.open_tables()) == [DEFAULT_TABLE_NAME]
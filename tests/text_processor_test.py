@@ -0,0 +1,63 @@
+import pytest
+from unittest.mock import MagicMock
+
+from bot.packages.text_pocessor import TextProcessor
+from bot.packages.my_logger import StandardLogger
+
+@pytest.fixture
+def mock_logger():
+    return MagicMock(StandardLogger)
+
+@pytest.fixture
+def text():
+    sentences = [f"Предложение номер {i} про тестирование потокового разбиения" for i in range(400)]
+    return ". ".join(sentences) + "."
+
+def test_iter_chunks_respects_chunk_size_across_segments(mock_logger, text):
+    processor = TextProcessor(mock_logger)
+    segments = [text[i:i + 137] for i in range(0, len(text), 137)]
+
+    chunks = [chunk.page_content for chunk in processor.iter_chunks(segments, chunk_size=300, chunk_overlap=50)]
+    expected = [chunk.page_content for chunk in processor.create_splitter(300, 50).create_documents([text])]
+
+    assert max(len(chunk) for chunk in chunks) <= 300
+    assert all(chunk in text for chunk in chunks)
+    assert chunks[0] == expected[0]
+    assert chunks[-1] == expected[-1]
+
+def test_iter_chunks_is_lazy(mock_logger, text):
+    processor = TextProcessor(mock_logger)
+    consumed = []
+
+    def segments():
+        for i in range(0, len(text), 100):
+            consumed.append(i)
+            yield text[i:i + 100]
+
+    first = next(processor.iter_chunks(segments(), chunk_size=300, chunk_overlap=50))
+
+    assert first.page_content
+    assert len(consumed) < len(range(0, len(text), 100))
+
+def test_chunk_text_reads_file(mock_logger, tmp_path, text):
+    processor = TextProcessor(mock_logger)
+    filepath = tmp_path / "text.txt"
+    filepath.write_text(text, encoding="utf-8")
+
+    chunks = processor.chunk_text(filepath, chunk_size=300, chunk_overlap=50)
+
+    assert chunks[0].page_content.startswith("Предложение номер 0")
+    assert chunks[-1].page_content.endswith("разбиения.")
+    assert list(chunks[0].metadata) == ["token_count"]
+
+def test_iter_chunks_by_tokens_respects_token_budget(mock_logger, text):
+    tokenizer = MagicMock()
+    # Один токен на слово
+    tokenizer.count_tokens.side_effect = lambda chunk: len(chunk.split())
+    processor = TextProcessor(mock_logger, tokenizer=tokenizer)
+
+    chunks = list(processor.iter_chunks([text], chunk_size=40, chunk_overlap=5, by_tokens=True))
+
+    assert len(chunks) > 1
+    assert all(chunk.metadata["token_count"] == len(chunk.page_content.split()) for chunk in chunks)
+    assert max(chunk.metadata["token_count"] for chunk in chunks) <= 40